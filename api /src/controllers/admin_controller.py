@@ -0,0 +1,41 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+from utils.profiler import LoopLagMonitor, SamplingProfiler
+from utils.security_middleware import JWTBearer
+
+router = APIRouter(prefix="/admin")
+
+ADMIN_USERS = {"admin"}
+
+profiler = SamplingProfiler()
+loop_monitor = LoopLagMonitor()
+
+async def require_admin(payload: dict = Depends(JWTBearer())):
+    if not payload or payload.get("sub") not in ADMIN_USERS:
+        raise HTTPException(
+            status_code=403,
+            detail="Admin access required"
+        )
+    return payload
+
+@router.get("/profile", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def profile(seconds: float = Query(10.0, gt=0, le=120), interval_ms: float = Query(5.0, ge=1, le=1000)):
+    """Sample all thread stacks for ``seconds``; returns collapsed stacks for flamegraph tools"""
+    if profiler.busy:
+        raise HTTPException(
+            status_code=409,
+            detail="A profile is already running"
+        )
+    try:
+        counts = await profiler.profile(seconds, interval_ms / 1000)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(SamplingProfiler.collapsed(counts))
+
+@router.get("/loop-lag", dependencies=[Depends(require_admin)])
+async def loop_lag():
+    """Recent event loop stalls with the stack that was holding the loop"""
+    return {
+        "threshold_ms": loop_monitor.threshold * 1000,
+        "stalls": loop_monitor.stalls()
+    }
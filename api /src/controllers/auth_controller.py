@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException
 from fastapi.security import OAuth2PasswordRequestForm
 from datetime import timedelta
-from utils.security import create_access_token, verify_password
+from utils.security import create_access_token, verify_password_async
 
 router = APIRouter()
 
@@ -15,7 +15,7 @@ fake_users_db = {
 @router.post("/token")
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     user = fake_users_db.get(form_data.username)
-    if not user or not verify_password(form_data.password, user["hashed_password"]):
+    if not user or not await verify_password_async(form_data.password, user["hashed_password"]):
         raise HTTPException(
             status_code=400,
             detail="Incorrect username or password"
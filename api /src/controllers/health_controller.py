@@ -1,16 +1,28 @@
 from fastapi import APIRouter
 from datetime import datetime
-import psutil
+from utils.metrics_sampler import MetricsSampler
 
 router = APIRouter()
 
+metrics_sampler = MetricsSampler()
+
 @router.get("/health")
 async def health_check():
+    """Served from the sampler's latest snapshot, so checks cost no sampling"""
+    snapshot = metrics_sampler.snapshot
+    if snapshot is None:
+        return {
+            "status": "starting",
+            "timestamp": datetime.now().isoformat()
+        }
+    now = datetime.now()
+    age = (now - snapshot.sampled_at).total_seconds()
     return {
-        "status": "healthy",
-        "timestamp": datetime.now().isoformat(),
+        "status": "healthy" if age <= 3 * metrics_sampler.interval else "degraded",
+        "timestamp": now.isoformat(),
         "system": {
-            "cpu_usage": psutil.cpu_percent(),
-            "memory_usage": psutil.virtual_memory().percent
+            "cpu_usage": snapshot.host.cpu_percent,
+            "memory_usage": snapshot.host.memory_percent,
+            "sampled_at": snapshot.sampled_at.isoformat()
         }
     }
@@ -1,13 +1,26 @@
 
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, WebSocket, status
 from fastapi.security import OAuth2PasswordBearer
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import List, Optional
 import subprocess
+import asyncio
+import codecs
+import json
 import os
 import logging
 from pathlib import Path
+from services.command_executor import CommandExecutor
+from services.environment_manager import EnvironmentManager
+from services.environment_pool import EnvironmentPool
+from services.process_manager import ProcessManager
+from controllers import admin_controller, health_controller
+from utils.instrumentation import MetricsMiddleware
+from utils.monitoring import start_monitoring, stop_monitoring
+from utils.terminal_session import SESSION_NAME, TerminalSessionRegistry
+from utils.terminal_websocket import TerminalWebSocket
 
 app = FastAPI(
     title="Development Server API",
@@ -17,8 +30,24 @@ app = FastAPI(
     docs_url="/docs",
     redoc_url="/redoc"
 )
-start_monitoring()
-asyncio.create_task(update_system_metrics())
+
+@app.on_event("startup")
+async def start_background_monitoring():
+    """Start the metrics server (in one worker), process limits, environment pool and background monitors once the server is up"""
+    start_monitoring()
+    process_manager.cgroups.setup()
+    environment_pool.start()
+    health_controller.metrics_sampler.start(process_manager)
+    admin_controller.loop_monitor.start()
+
+@app.on_event("shutdown")
+async def stop_background_monitoring():
+    admin_controller.loop_monitor.stop()
+    health_controller.metrics_sampler.stop()
+    stop_monitoring()
+
+app.include_router(admin_controller.router)
+app.include_router(health_controller.router)
 
 # CORS Configuration
 app.add_middleware(
@@ -29,9 +58,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request metrics; added last so it times everything, CORS included
+app.add_middleware(MetricsMiddleware)
+
 # Security
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Command execution
+command_executor = CommandExecutor()
+terminal_sessions = TerminalSessionRegistry()
+process_manager = ProcessManager()
+environment_pool = EnvironmentPool()
+environment_manager = EnvironmentManager(pool=environment_pool)
+
 # Logger setup
 logging.basicConfig(
     level=logging.INFO,
@@ -48,6 +87,7 @@ class Project(BaseModel):
 class Command(BaseModel):
     command: str
     working_dir: str
+    timeout: Optional[float] = None
 
 class Process(BaseModel):
     pid: int
@@ -59,6 +99,42 @@ def authenticate_user(token: str = Depends(oauth2_scheme)):
     # Implement your authentication logic here
     pass
 
+async def sse_command_frames(frames):
+    """Encode executor frames as Server-Sent Events"""
+    decoders = {
+        "stdout": codecs.getincrementaldecoder("utf-8")(errors="replace"),
+        "stderr": codecs.getincrementaldecoder("utf-8")(errors="replace")
+    }
+    async for kind, data in frames:
+        if kind in ("exit", "error"):
+            payload = data
+        else:
+            payload = decoders[kind].decode(data)
+            if not payload:
+                continue
+        yield f"event: {kind}\ndata: {json.dumps(payload)}\n\n"
+
+async def process_log_chunks(log, offset: int):
+    """Stream a process log from ``offset`` to its current end"""
+    loop = asyncio.get_running_loop()
+    end = log.end_offset
+    while offset < end:
+        data, offset = await loop.run_in_executor(None, log.read, offset, min(64 * 1024, end - offset))
+        if not data:
+            break
+        yield data
+
+async def sse_process_log(pid: int, log, offset: int):
+    """Follow a process log as Server-Sent Events, ending with an ``exit`` frame"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    async for data in log.follow(offset):
+        text = decoder.decode(data)
+        if text:
+            yield f"event: output\ndata: {json.dumps(text)}\n\n"
+    info = process_manager.get_process(pid)
+    payload = {"status": info.status, "return_code": info.return_code} if info else {}
+    yield f"event: exit\ndata: {json.dumps(payload)}\n\n"
+
 # API Endpoints
 @app.post("/projects/", status_code=status.HTTP_201_CREATED)
 async def create_project(project: Project, token: str = Depends(oauth2_scheme)):
@@ -83,45 +159,119 @@ async def create_project(project: Project, token: str = Depends(oauth2_scheme)):
         )
 
 @app.post("/projects/{project_name}/execute")
-async def execute_command(project_name: str, cmd: Command, token: str = Depends(oauth2_scheme)):
-    """Execute a command in the project directory"""
+async def execute_command(project_name: str, cmd: Command, stream: bool = False,
+                          token: str = Depends(oauth2_scheme)):
+    """Execute a command in the project directory.
+
+    With ``?stream=true`` the output is sent as Server-Sent Events
+    (``stdout``/``stderr`` frames, then a final ``exit`` frame, or a single
+    ``error`` frame if the command could not be started).
+    """
     project_path = Path(f"/app/projects/{project_name}")
     if not project_path.exists():
         raise HTTPException(
             status_code=404,
             detail="Project not found"
         )
+
+    args = cmd.command.split()
+    if not args:
+        raise HTTPException(
+            status_code=400,
+            detail="Command is empty"
+        )
+    cwd = project_path / cmd.working_dir
+    if not cwd.is_dir():
+        raise HTTPException(
+            status_code=400,
+            detail="Working directory not found"
+        )
+
+    if stream:
+        frames = command_executor.stream(
+            project_name,
+            args,
+            cwd=str(cwd),
+            timeout=cmd.timeout
+        )
+        return StreamingResponse(
+            sse_command_frames(frames),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
     
     try:
-        result = subprocess.run(
-            cmd.command.split(),
-            cwd=str(project_path / cmd.working_dir),
-            capture_output=True,
-            text=True
+        result = await command_executor.run(
+            project_name,
+            args,
+            cwd=str(cwd),
+            timeout=cmd.timeout
         )
-        return {
-            "returncode": result.returncode,
-            "stdout": result.stdout,
-            "stderr": result.stderr
-        }
+        return result.dict()
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=str(e)
         )
 @app.websocket("/ws/terminal/{project_name}")
-async def websocket_terminal(websocket: WebSocket, project_name: str):
-    terminal = TerminalWebSocket(websocket)
-    await terminal.connect()
+async def websocket_terminal(websocket: WebSocket, project_name: str, session: str = "default"):
+    """Attach to the project's named shell session, starting it if needed"""
+    project_path = Path(f"/app/projects/{project_name}")
+    if not SESSION_NAME.match(session) or project_name in (".", "..") or not project_path.is_dir():
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    terminal = TerminalWebSocket(
+        websocket,
+        terminal_sessions,
+        session_key=f"{project_name}/{session}",
+        cwd=str(project_path)
+    )
+    if not await terminal.connect():
+        return
+    tasks = [
+        asyncio.ensure_future(terminal.receive_commands()),
+        asyncio.ensure_future(terminal.send_output())
+    ]
     try:
-        await asyncio.gather(
-            terminal.receive_commands(),
-            terminal.send_output()
-        )
+        # Either side finishing (client gone or shell exited) ends this viewer
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            task.result()
     except Exception as e:
         logger.error(f"WebSocket error: {str(e)}")
     finally:
+        for task in tasks:
+            task.cancel()
         await terminal.disconnect()
+@app.get("/processes/{pid}/logs")
+async def get_process_logs(pid: int, tail: Optional[int] = None, follow: bool = False,
+                           token: str = Depends(oauth2_scheme)):
+    """Output of a managed process (stdout and stderr interleaved).
+
+    ``tail=N`` starts at the last N lines instead of the oldest kept output.
+    ``follow=true`` keeps the response open as Server-Sent Events
+    (``output`` frames, then an ``exit`` frame when the process ends).
+    """
+    log = process_manager.get_log(pid)
+    if log is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Process not found"
+        )
+
+    if tail is None:
+        offset = log.start_offset
+    else:
+        offset = await asyncio.get_running_loop().run_in_executor(None, log.tail_offset, tail)
+
+    if follow:
+        return StreamingResponse(
+            sse_process_log(pid, log, offset),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
+    return StreamingResponse(process_log_chunks(log, offset), media_type="text/plain")
+
 @app.get("/projects/{project_name}/dependencies")
 async def get_dependencies(project_name: str, token: str = Depends(oauth2_scheme)):
     """Get project dependencies based on language"""
@@ -0,0 +1,10 @@
+from pydantic import BaseModel
+
+class ExecutionResult(BaseModel):
+    returncode: int
+    stdout: str
+    stderr: str
+    duration: float
+    timed_out: bool = False
+    stdout_truncated: bool = False
+    stderr_truncated: bool = False
@@ -0,0 +1,34 @@
+from datetime import datetime
+from pydantic import BaseModel
+from typing import Dict, List
+
+class ResourceUsage(BaseModel):
+    cpu_percent: float = 0.0  # Of one core, so may exceed 100
+    cpu_seconds: float = 0.0  # User plus system time of the processes alive now
+    memory_bytes: int = 0  # Resident set size
+    open_fds: int = 0
+    io_read_bytes: int = 0
+    io_write_bytes: int = 0
+    processes: int = 0
+
+    class Config:
+        allow_mutation = False
+
+class HostMetrics(BaseModel):
+    cpu_percent: float
+    memory_percent: float
+    memory_used_bytes: int
+    memory_total_bytes: int
+    load_average: List[float]
+
+    class Config:
+        allow_mutation = False
+
+class MetricsSnapshot(BaseModel):
+    sampled_at: datetime
+    host: HostMetrics
+    projects: Dict[str, ResourceUsage]
+    processes: Dict[int, ResourceUsage]  # Tracked process pid -> usage of its process tree
+
+    class Config:
+        allow_mutation = False
@@ -2,6 +2,11 @@ from datetime import datetime
 from pydantic import BaseModel
 from typing import Optional
 
+class ResourceLimits(BaseModel):
+    cpu: Optional[float] = None  # CPU cores, e.g. 0.5
+    memory_bytes: Optional[int] = None
+    pids: Optional[int] = None
+
 class ProcessInfo(BaseModel):
     pid: int
     command: str
@@ -12,3 +17,9 @@ class ProcessInfo(BaseModel):
     return_code: Optional[int] = None
     output: Optional[str] = None
     error: Optional[str] = None
+    restarts: int = 0
+    limits: Optional[ResourceLimits] = None
+    cpu_seconds: Optional[float] = None
+    memory_bytes: Optional[int] = None
+    memory_peak_bytes: Optional[int] = None
+    pids: Optional[int] = None
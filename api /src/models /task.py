@@ -11,3 +11,4 @@ class Task(BaseModel):
     updated_at: Optional[datetime] = None
     error: Optional[str] = None
     result: Optional[Any] = None
+    result_size: Optional[int] = None
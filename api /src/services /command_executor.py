@@ -0,0 +1,251 @@
+import asyncio
+import logging
+import os
+import signal
+import time
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+from models.execution import ExecutionResult
+
+class CommandExecutor:
+    """Runs project commands on the event loop without blocking it.
+
+    Concurrency is bounded per project and globally; a command waits for
+    its project's slot before taking a global one, so a busy project cannot
+    hold global slots while queued behind itself. Every command gets a
+    timeout of at most ``max_timeout`` and its captured output is capped at
+    ``max_output_bytes`` per stream (the rest is drained and discarded so
+    the child never blocks). Once the command exits, whatever it left
+    running in its session is killed, so inherited pipes reach EOF.
+    ``stream`` yields output as it is produced instead, holding at most
+    ``stream_buffer_chunks`` unread chunks before the child is throttled.
+    """
+
+    def __init__(self, max_concurrent: int = 32, max_per_project: int = 4,
+                 default_timeout: float = 300.0, max_timeout: float = 3600.0,
+                 max_output_bytes: int = 1024 * 1024, stream_buffer_chunks: int = 16):
+        self.max_concurrent = max_concurrent
+        self.max_per_project = max_per_project
+        self.default_timeout = default_timeout
+        self.max_timeout = max_timeout
+        self.max_output_bytes = max_output_bytes
+        self.stream_buffer_chunks = stream_buffer_chunks
+        self.logger = logging.getLogger(__name__)
+        # Semaphores are created lazily so they bind to the running loop
+        self._global_slots: Optional[asyncio.Semaphore] = None
+        self._project_slots: Dict[str, asyncio.Semaphore] = {}
+
+    def _slots(self, project: str) -> Tuple[asyncio.Semaphore, asyncio.Semaphore]:
+        if self._global_slots is None:
+            self._global_slots = asyncio.Semaphore(self.max_concurrent)
+        if project not in self._project_slots:
+            self._project_slots[project] = asyncio.Semaphore(self.max_per_project)
+        return self._global_slots, self._project_slots[project]
+
+    def _timeout(self, timeout: Optional[float]) -> float:
+        """The requested timeout, clamped to ``max_timeout``"""
+        if not timeout or timeout <= 0:
+            return self.default_timeout
+        return min(timeout, self.max_timeout)
+
+    async def run(self, project: str, args: List[str], cwd: str,
+                  timeout: Optional[float] = None, env: Dict[str, str] = None) -> ExecutionResult:
+        """Run a command and return its (capped) output once it exits"""
+        timeout = self._timeout(timeout)
+        global_slots, project_slots = self._slots(project)
+        loop = asyncio.get_running_loop()
+
+        async with project_slots, global_slots:
+            start = time.monotonic()
+            deadline = loop.time() + timeout
+            process = await asyncio.create_subprocess_exec(
+                *args,
+                cwd=cwd,
+                env=env,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                start_new_session=True
+            )
+            stdout_chunks: List[bytes] = []
+            stderr_chunks: List[bytes] = []
+            readers = asyncio.gather(
+                self._read_capped(process.stdout, stdout_chunks),
+                self._read_capped(process.stderr, stderr_chunks)
+            )
+
+            timed_out = False
+            try:
+                try:
+                    await asyncio.wait_for(self._leader_exited(process), timeout)
+                except asyncio.TimeoutError:
+                    timed_out = True
+                # Kill anything left in the session, e.g. a backgrounded
+                # grandchild holding the pipes open
+                self._kill(process)
+                # The pipes close as soon as the session is dead; allow a
+                # moment for that even when the deadline has already passed
+                done, _ = await asyncio.wait({readers}, timeout=max(deadline - loop.time(), 1.0))
+                if done:
+                    await process.wait()
+                else:
+                    # Something left the session with the pipes; give up on them
+                    timed_out = True
+                    readers.cancel()
+            except asyncio.CancelledError:
+                self._kill(process)
+                readers.cancel()
+                raise
+            if timed_out:
+                self.logger.warning(f"Command timed out after {timeout}s in {project}: {args}")
+
+            stdout, stdout_truncated = self._captured(stdout_chunks)
+            stderr, stderr_truncated = self._captured(stderr_chunks)
+
+            return ExecutionResult(
+                # Not yet set only if the exit is still being reaped after a kill
+                returncode=process.returncode if process.returncode is not None else -signal.SIGKILL,
+                stdout=stdout,
+                stderr=stderr,
+                duration=time.monotonic() - start,
+                timed_out=timed_out,
+                stdout_truncated=stdout_truncated,
+                stderr_truncated=stderr_truncated
+            )
+
+    async def stream(self, project: str, args: List[str], cwd: str,
+                     timeout: Optional[float] = None,
+                     env: Dict[str, str] = None) -> AsyncIterator[Tuple[str, Any]]:
+        """Run a command, yielding ("stdout"|"stderr", bytes) frames as output
+        arrives and a final ("exit", {...}) frame with the return code.
+
+        If the command cannot be started (missing executable or working
+        directory) the only frame is ("error", {"message": ...}), since by then
+        the response has usually begun. Pipes are only read as fast as the
+        consumer drains frames, so a slow client throttles the child instead
+        of growing server memory.
+        """
+        timeout = self._timeout(timeout)
+        global_slots, project_slots = self._slots(project)
+        loop = asyncio.get_running_loop()
+
+        async with project_slots, global_slots:
+            start = time.monotonic()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *args,
+                    cwd=cwd,
+                    env=env,
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    start_new_session=True
+                )
+            except (OSError, ValueError) as e:
+                self.logger.warning(f"Failed to start command in {project}: {args}: {str(e)}")
+                yield "error", {"message": str(e)}
+                return
+            frames = asyncio.Queue(maxsize=self.stream_buffer_chunks)
+            pumps = [
+                asyncio.ensure_future(self._pump("stdout", process.stdout, frames)),
+                asyncio.ensure_future(self._pump("stderr", process.stderr, frames))
+            ]
+            # As in ``run``, the session goes once the command exits so
+            # inherited pipes reach EOF
+            reaper = asyncio.ensure_future(self._leader_exited(process))
+            reaper.add_done_callback(lambda done: done.cancelled() or self._kill(process))
+            deadline = loop.time() + timeout
+            timed_out = False
+            open_streams = len(pumps)
+
+            try:
+                while open_streams:
+                    try:
+                        kind, data = await asyncio.wait_for(
+                            frames.get(), max(deadline - loop.time(), 0)
+                        )
+                    except asyncio.TimeoutError:
+                        timed_out = True
+                        break
+
+                    if data is None:
+                        open_streams -= 1
+                        continue
+                    yield kind, data
+
+                # Both pipes can close (e.g. redirected away) while the command keeps running
+                if not timed_out and process.returncode is None:
+                    try:
+                        await asyncio.wait_for(process.wait(), max(deadline - loop.time(), 0))
+                    except asyncio.TimeoutError:
+                        timed_out = True
+                if timed_out:
+                    self.logger.warning(f"Command timed out after {timeout}s in {project}: {args}")
+                    self._kill(process)
+                await process.wait()
+                yield "exit", {
+                    "returncode": process.returncode,
+                    "duration": time.monotonic() - start,
+                    "timed_out": timed_out
+                }
+            finally:
+                reaper.cancel()
+                for pump in pumps:
+                    pump.cancel()
+                if process.returncode is None:
+                    self._kill(process)
+                    await process.wait()
+
+    async def _pump(self, kind: str, stream: asyncio.StreamReader, frames: asyncio.Queue):
+        """Forward a pipe into the frame queue, then signal EOF with None"""
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                break
+            await frames.put((kind, chunk))
+        await frames.put((kind, None))
+
+    async def _read_capped(self, stream: asyncio.StreamReader, chunks: List[bytes]):
+        """Read a stream to EOF into ``chunks``, keeping at most ``max_output_bytes``
+        plus one byte to mark truncation"""
+        size = 0
+        while True:
+            chunk = await stream.read(65536)
+            if not chunk:
+                break
+            if size <= self.max_output_bytes:
+                chunks.append(chunk[:self.max_output_bytes + 1 - size])
+            size += len(chunk)
+
+    def _captured(self, chunks: List[bytes]) -> Tuple[str, bool]:
+        output = b"".join(chunks)
+        truncated = len(output) > self.max_output_bytes
+        return output[:self.max_output_bytes].decode(errors="replace"), truncated
+
+    async def _leader_exited(self, process: asyncio.subprocess.Process):
+        """Wait for the command itself to exit; ``process.wait()`` also waits
+        for its pipes to close, which anything it left running can hold open"""
+        if process.returncode is not None:
+            return
+        if not hasattr(os, "pidfd_open"):
+            while process.returncode is None:
+                await asyncio.sleep(0.05)
+            return
+        try:
+            pidfd = os.pidfd_open(process.pid)
+        except ProcessLookupError:
+            return
+        loop = asyncio.get_running_loop()
+        exited = loop.create_future()
+        loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+        try:
+            await exited
+        finally:
+            loop.remove_reader(pidfd)
+            os.close(pidfd)
+
+    def _kill(self, process: asyncio.subprocess.Process):
+        """Kill the command and anything it spawned"""
+        try:
+            os.killpg(process.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
@@ -1,40 +1,169 @@
+import base64
+import os
+import re
+import json
+import hashlib
+import shutil
 import subprocess
+import uuid
 import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple, Union
 from models.dependency import Dependency
+from utils.monitoring import DEPENDENCY_CACHE_HITS, DEPENDENCY_CACHE_MISSES, DEPENDENCY_CACHE_SIZE
+
+# "# comment" in a requirements file; a "#" inside a token (URL fragments) is not one
+_REQUIREMENT_COMMENT = re.compile(r"(^|\s)#.*$")
+# Options naming another requirements or constraints file
+_INCLUDE_OPTION = re.compile(r"^(?:-r|--requirement|-c|--constraint)(?:\s*=\s*|\s*)(\S+)$")
+# Options that install something themselves, so they cannot be part of a delta install
+_INSTALL_OPTIONS = ("-r", "--requirement", "-e", "--editable")
 
 class DependencyManager:
-    def __init__(self):
+    """Installs project dependencies through a host-wide package cache.
+
+    pip's wheel/HTTP cache and npm's cacache (both content-addressed) live
+    under ``cache_dir`` and are shared by every project, so a package is
+    downloaded and built once per host. The cache is trimmed to
+    ``max_cache_bytes`` by evicting least recently used entries. At most
+    ``max_parallel_installs`` installs run at once, and installs for the same
+    project are serialized.
+
+    Installs are incremental: after a successful install the dependency
+    inputs (requirement lines or package.json entries, plus any lockfile) are
+    recorded in the project's ``.dependency_state.json``, together with the
+    identity of the environment they were installed into (the pip's prefix,
+    or node_modules). If the inputs and the environment are unchanged next
+    time, the recorded Dependency list is returned without running pip/npm;
+    if plain requirements were only added, just those are installed. Files
+    pulled in with ``-r``/``-c`` count as inputs too.
+    """
+
+    STATE_FILE = ".dependency_state.json"
+
+    def __init__(self, cache_dir: str = "/app/cache", max_cache_bytes: int = 10 * 1024 ** 3,
+                 max_parallel_installs: int = 4, evict_interval: int = 300):
         self.logger = logging.getLogger(__name__)
+        self.cache_dir = Path(cache_dir)
+        self.pip_cache = self.cache_dir / "pip"
+        self.npm_cache = self.cache_dir / "npm"
+        self.max_cache_bytes = max_cache_bytes
+        self.evict_interval = evict_interval
+        self.pip_cache.mkdir(parents=True, exist_ok=True)
+        self.npm_cache.mkdir(parents=True, exist_ok=True)
+
+        self._install_slots = threading.BoundedSemaphore(max_parallel_installs)
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel_installs)
+        self._project_locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+        self._evict_lock = threading.Lock()
+        self._last_eviction = 0.0
 
     def install_dependencies(self, project_path: str, language: str, dependencies: List[str] = None) -> List[Dependency]:
         """Install dependencies for a project"""
         project_path = Path(project_path)
-        
-        if language == "python":
-            return self._install_python_deps(project_path, dependencies)
-        elif language == "nodejs":
-            return self._install_nodejs_deps(project_path, dependencies)
-        # Add other languages...
+
+        if language not in ("python", "nodejs"):
+            # Add other languages...
+            return None
+
+        with self._project_lock(project_path):
+            if language == "python" and dependencies:
+                self._append_requirements(project_path, dependencies)
+                dependencies = None
+
+            environment = self._environment_identity(project_path, language)
+            state = self._load_state(project_path)
+            if state and (environment is None or state.get("environment") != environment):
+                state = None  # Installed into an environment that is gone or was recreated
+            entries, lock_digest = self._dependency_inputs(project_path, language)
+            inputs_hash = self._inputs_hash(language, entries, lock_digest)
+            if not dependencies and state and state["inputs_hash"] == inputs_hash:
+                self.logger.info(f"Dependencies of {project_path} unchanged, skipping install")
+                return [Dependency(**dep) for dep in state["dependencies"]]
+
+            previous = []
+            if state and state["language"] == language:
+                if dependencies:
+                    # Explicit npm additions on top of an installed project
+                    previous = [Dependency(**dep) for dep in state["dependencies"]]
+                elif state["lock_digest"] == lock_digest and set(state["entries"]) <= set(entries):
+                    added = [entry for entry in entries if entry not in state["entries"]]
+                    if not any(entry.startswith("-") for entry in added):
+                        # Only plain requirements were added: install just those
+                        dependencies = added
+                        previous = [Dependency(**dep) for dep in state["dependencies"]]
+
+            with self._install_slots:
+                if language == "python":
+                    installed = self._install_python_deps(project_path, dependencies)
+                else:
+                    installed = self._install_nodejs_deps(project_path, dependencies)
+            installed = self._merge_dependencies(previous, installed)
+
+            # npm may have rewritten package.json/package-lock.json
+            entries, lock_digest = self._dependency_inputs(project_path, language)
+            self._save_state(project_path, {
+                "language": language,
+                "environment": self._environment_identity(project_path, language),
+                "inputs_hash": self._inputs_hash(language, entries, lock_digest),
+                "entries": entries,
+                "lock_digest": lock_digest,
+                "dependencies": [dep.dict() for dep in installed]
+            })
+
+        self._maybe_evict_cache()
+        return installed
+
+    def install_many(self, requests: List[Tuple[str, str, List[str]]]) -> Dict[str, Union[List[Dependency], Exception]]:
+        """Install dependencies for several projects in parallel.
+
+        ``requests`` holds ``(project_path, language, dependencies)`` tuples;
+        the result maps each project path to its installed dependencies, or
+        to the exception its install raised.
+        """
+        futures = {
+            project_path: self._executor.submit(self.install_dependencies, project_path, language, dependencies)
+            for project_path, language, dependencies in requests
+        }
+        results = {}
+        for project_path, future in futures.items():
+            try:
+                results[project_path] = future.result()
+            except Exception as e:
+                results[project_path] = e
+        return results
 
     def _install_python_deps(self, project_path: Path, dependencies: List[str]) -> List[Dependency]:
-        """Install Python dependencies"""
+        """Install Python dependencies (only ``dependencies`` if given, else requirements.txt)"""
         requirements_file = project_path / "requirements.txt"
-        
+        delta_file = None
         if dependencies:
-            with open(requirements_file, "a") as f:
-                for dep in dependencies:
-                    f.write(f"{dep}\n")
+            # The new lines go through a requirements file of their own, next
+            # to the real one, so markers, hashes and the file's index and
+            # constraint options keep their meaning
+            delta_file = project_path / f".requirements-delta-{uuid.uuid4().hex}.txt"
+            options = [
+                entry for entry, _ in self._requirement_lines(requirements_file)
+                if entry.startswith("-") and not entry.startswith(_INSTALL_OPTIONS)
+            ]
+            delta_file.write_text("".join(f"{line}\n" for line in options + dependencies))
+        cmd = ["pip", "install", "-r", str(delta_file or requirements_file)]
 
         try:
             result = subprocess.run(
-                ["pip", "install", "-r", str(requirements_file)],
+                cmd,
                 cwd=str(project_path),
+                env=self._cache_env(),
                 capture_output=True,
-                text=True
+                text=True,
+                check=True
             )
-            
+            self._record_cache_stats("python", result.stdout, hit_marker="Using cached", miss_marker="Downloading")
+
             installed = []
             for line in result.stdout.splitlines():
                 if "Successfully installed" in line:
@@ -47,27 +176,34 @@ class DependencyManager:
                             language="python",
                             source="pip"
                         ))
-            
+
             return installed
 
         except subprocess.CalledProcessError as e:
             self.logger.error(f"Failed to install Python dependencies: {e.stderr}")
             raise
+        finally:
+            if delta_file is not None:
+                delta_file.unlink()
 
     def _install_nodejs_deps(self, project_path: Path, dependencies: List[str]) -> List[Dependency]:
         """Install Node.js dependencies"""
         try:
-            cmd = ["npm", "install"]
+            # --loglevel=http makes npm report "(cache hit)"/"(cache miss)" per fetch
+            cmd = ["npm", "install", "--prefer-offline", "--loglevel=http"]
             if dependencies:
                 cmd.extend(dependencies)
-            
+
             result = subprocess.run(
                 cmd,
                 cwd=str(project_path),
+                env=self._cache_env(),
                 capture_output=True,
-                text=True
+                text=True,
+                check=True
             )
-            
+            self._record_cache_stats("nodejs", result.stderr, hit_marker="(cache hit)", miss_marker="(cache miss)")
+
             installed = []
             for line in result.stdout.splitlines():
                 if "added" in line and "package" in line:
@@ -81,9 +217,288 @@ class DependencyManager:
                             language="nodejs",
                             source="npm"
                         ))
-            
+
             return installed
 
         except subprocess.CalledProcessError as e:
             self.logger.error(f"Failed to install Node.js dependencies: {e.stderr}")
             raise
+
+    def _append_requirements(self, project_path: Path, dependencies: List[str]):
+        with open(project_path / "requirements.txt", "a") as f:
+            for dep in dependencies:
+                f.write(f"{dep}\n")
+
+    def _dependency_inputs(self, project_path: Path, language: str) -> Tuple[List[str], Optional[str]]:
+        """Return the declared dependency entries and a digest of the lockfile, if any"""
+        entries = []
+        lock_file = None
+        if language == "python":
+            included = hashlib.sha256()
+            for entry, include in self._requirement_lines(project_path / "requirements.txt"):
+                if entry not in entries:
+                    entries.append(entry)
+                if include is not None:
+                    self._digest_included(include, included, set())
+            return entries, included.hexdigest()
+        else:
+            package_json = project_path / "package.json"
+            if package_json.exists():
+                manifest = json.loads(package_json.read_text())
+                for section in ("dependencies", "devDependencies"):
+                    for name, spec in sorted(manifest.get(section, {}).items()):
+                        entries.append(f"{name}@{spec}")
+            lock_file = project_path / "package-lock.json"
+
+        lock_digest = None
+        if lock_file is not None and lock_file.exists():
+            lock_digest = hashlib.sha256(lock_file.read_bytes()).hexdigest()
+        return entries, lock_digest
+
+    @staticmethod
+    def _requirement_lines(path: Path) -> List[Tuple[str, Optional[Path]]]:
+        """Logical lines of a requirements file, without comments.
+
+        Each comes with the path of the file it includes (``-r``/``-c``), if any.
+        """
+        try:
+            text = path.read_text()
+        except FileNotFoundError:
+            return []
+        lines = []
+        for line in text.replace("\\\n", " ").splitlines():
+            line = " ".join(_REQUIREMENT_COMMENT.sub("", line).split())
+            if not line:
+                continue
+            match = _INCLUDE_OPTION.match(line)
+            lines.append((line, path.parent / match.group(1) if match else None))
+        return lines
+
+    def _digest_included(self, path: Path, digest, seen: set):
+        """Add the content of an included requirements file, and of what it includes"""
+        key = str(path.resolve())
+        if key in seen:
+            return
+        seen.add(key)
+        digest.update(key.encode() + b"\0")
+        try:
+            digest.update(path.read_bytes())
+        except FileNotFoundError:
+            digest.update(b"missing")
+            return
+        for _, include in self._requirement_lines(path):
+            if include is not None:
+                self._digest_included(include, digest, seen)
+
+    def _environment_identity(self, project_path: Path, language: str) -> Optional[str]:
+        """Identify the environment installs go into; None if it does not exist.
+
+        A recreated environment gets a new directory inode even at the same
+        path, so its recorded state no longer applies.
+        """
+        if language == "python":
+            pip = shutil.which("pip", path=self._cache_env().get("PATH"))
+            if pip is None:
+                return None
+            target = Path(pip).resolve().parent.parent
+        else:
+            target = project_path / "node_modules"
+        try:
+            stat = target.stat()
+        except FileNotFoundError:
+            return None
+        return f"{target.resolve()}:{stat.st_dev}:{stat.st_ino}"
+
+    @staticmethod
+    def _inputs_hash(language: str, entries: List[str], lock_digest: Optional[str]) -> str:
+        digest = hashlib.sha256(language.encode())
+        for entry in sorted(entries):
+            digest.update(b"\0" + entry.encode())
+        digest.update(b"\0" + (lock_digest or "").encode())
+        return digest.hexdigest()
+
+    @staticmethod
+    def _merge_dependencies(previous: List[Dependency], installed: List[Dependency]) -> List[Dependency]:
+        merged = {dep.name: dep for dep in previous}
+        merged.update((dep.name, dep) for dep in installed)
+        return list(merged.values())
+
+    def _load_state(self, project_path: Path) -> Optional[Dict]:
+        try:
+            with open(project_path / self.STATE_FILE) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _save_state(self, project_path: Path, state: Dict):
+        state_file = project_path / self.STATE_FILE
+        tmp_file = state_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, state_file)
+
+    def _cache_env(self) -> Dict[str, str]:
+        """Environment pointing pip and npm at the shared cache"""
+        return {
+            **os.environ,
+            "PIP_CACHE_DIR": str(self.pip_cache),
+            "npm_config_cache": str(self.npm_cache)
+        }
+
+    def _project_lock(self, project_path: Path) -> threading.Lock:
+        key = str(project_path.resolve())
+        with self._locks_guard:
+            if key not in self._project_locks:
+                self._project_locks[key] = threading.Lock()
+            return self._project_locks[key]
+
+    def _record_cache_stats(self, language: str, output: str, hit_marker: str, miss_marker: str):
+        hits = misses = 0
+        for line in output.splitlines():
+            if hit_marker in line:
+                hits += 1
+            elif miss_marker in line:
+                misses += 1
+        DEPENDENCY_CACHE_HITS.labels(language=language).inc(hits)
+        DEPENDENCY_CACHE_MISSES.labels(language=language).inc(misses)
+
+    def _maybe_evict_cache(self):
+        """Run an eviction pass at most once per ``evict_interval`` seconds"""
+        if time.monotonic() - self._last_eviction < self.evict_interval:
+            return
+        if not self._evict_lock.acquire(blocking=False):
+            return  # Another install is already evicting
+        try:
+            self._last_eviction = time.monotonic()
+            self.evict_cache()
+        finally:
+            self._evict_lock.release()
+
+    def evict_cache(self):
+        """Remove least recently used cache entries until under ``max_cache_bytes``.
+
+        Entries are removed whole, following each tool's layout, so neither
+        cache is left with an index pointing at missing content: a pip HTTP
+        response (body and metadata), a built wheel directory, or an npm
+        index bucket together with the content only it references.
+        """
+        total = self._cache_size()
+        if total > self.max_cache_bytes:
+            content_refs: Dict[str, int] = {}
+            entries = self._pip_cache_entries() + self._npm_cache_entries(content_refs)
+            entries.sort(key=lambda entry: entry[0])
+            for _, size, paths, content in entries:
+                if total <= self.max_cache_bytes:
+                    break
+                self._remove_cache_paths(paths)
+                total -= size
+                for path in content:
+                    content_refs[path] -= 1
+                    if not content_refs[path]:
+                        total -= self._last_used([path])[1]
+                        self._remove_cache_paths([path])
+            total = self._cache_size()
+            self.logger.info(f"Evicted package cache down to {total} bytes")
+
+        DEPENDENCY_CACHE_SIZE.set(total)
+
+    def _cache_size(self) -> int:
+        total = 0
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                try:
+                    total += os.stat(os.path.join(root, name)).st_size
+                except FileNotFoundError:
+                    pass
+        return total
+
+    @staticmethod
+    def _last_used(paths: List[str]) -> Tuple[float, int]:
+        """Latest access or modification time of ``paths`` and their total size"""
+        last_used = 0.0
+        size = 0
+        for path in paths:
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            last_used = max(last_used, stat.st_atime, stat.st_mtime)
+            size += stat.st_size
+        return last_used, size
+
+    def _pip_cache_entries(self) -> List[Tuple[float, int, List[str], List[str]]]:
+        """pip's HTTP responses (a file, or metadata plus ``.body`` in http-v2) and built wheel directories"""
+        entries = []
+        for http_dir in ("http", "http-v2"):
+            responses: Dict[str, List[str]] = {}
+            for root, _, files in os.walk(self.pip_cache / http_dir):
+                for name in files:
+                    path = os.path.join(root, name)
+                    # Metadata first, so the entry disappears before its body
+                    responses.setdefault(path[:-len(".body")] if path.endswith(".body") else path, []).append(path)
+            for paths in responses.values():
+                paths.sort(key=lambda path: path.endswith(".body"))
+                last_used, size = self._last_used(paths)
+                entries.append((last_used, size, paths, []))
+        for root, _, files in os.walk(self.pip_cache / "wheels"):
+            if any(name.endswith(".whl") for name in files):
+                last_used, size = self._last_used([os.path.join(root, name) for name in files])
+                entries.append((last_used, size, [root], []))
+        return entries
+
+    def _npm_cache_entries(self, content_refs: Dict[str, int]) -> List[Tuple[float, int, List[str], List[str]]]:
+        """npm index buckets with the content files they reference.
+
+        ``content_refs`` is filled with the number of buckets referencing each
+        content file, so content shared between keys outlives a single bucket.
+        """
+        cacache = self.npm_cache / "_cacache"
+        entries = []
+        for root, _, files in os.walk(cacache / "index-v5"):
+            for name in files:
+                bucket = os.path.join(root, name)
+                bucket_used, size = self._last_used([bucket])  # Before reading it bumps the atime
+                try:
+                    with open(bucket) as f:
+                        lines = f.read().splitlines()
+                except FileNotFoundError:
+                    continue
+                content = set()
+                for line in lines:
+                    try:
+                        integrity = json.loads(line.partition("\t")[2]).get("integrity")
+                    except ValueError:
+                        continue
+                    for path in self._npm_content_paths(cacache, integrity or ""):
+                        content.add(path)
+                # Content is counted in the total when its last reference goes
+                last_used = max(bucket_used, self._last_used(list(content))[0])
+                for path in content:
+                    content_refs[path] = content_refs.get(path, 0) + 1
+                entries.append((last_used, size, [bucket], sorted(content)))
+        return entries
+
+    @staticmethod
+    def _npm_content_paths(cacache: Path, integrity: str) -> List[str]:
+        """Content files for an SRI string, e.g. ``sha512-<base64>``"""
+        paths = []
+        for part in integrity.split():
+            algorithm, _, digest = part.partition("-")
+            try:
+                hex_digest = base64.b64decode(digest).hex()
+            except ValueError:
+                continue
+            if algorithm and len(hex_digest) > 4:
+                paths.append(str(cacache / "content-v2" / algorithm / hex_digest[:2] / hex_digest[2:4] / hex_digest[4:]))
+        return paths
+
+    @staticmethod
+    def _remove_cache_paths(paths: List[str]):
+        for path in paths:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
@@ -0,0 +1,137 @@
+import bisect
+import fcntl
+import json
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from models.environment import Environment
+
+INDEX_FILE = ".env_index.json"
+
+class EnvironmentIndex:
+    """In-memory index of environments, persisted to one file under ``base_path``.
+
+    Lookups are dict hits; names are kept sorted overall and per type, so a
+    page of a (filtered) listing is a slice. Every change is applied under an
+    exclusive ``flock`` and written to ``.env_index.json`` with a temp file and
+    rename. Before answering, the index stats that file and reloads it if
+    another process replaced it, so several API workers stay consistent
+    without rescanning the environment directories.
+    """
+
+    def __init__(self, base_path: Path):
+        self.index_file = base_path / INDEX_FILE
+        self.lock_file = base_path / ".env_index.lock"
+        self.logger = logging.getLogger(__name__)
+        self._environments: Dict[str, Environment] = {}
+        self._names: List[str] = []
+        self._by_type: Dict[str, List[str]] = {}
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._lock = threading.Lock()
+
+    def load(self, scan: Callable[[], Iterable[Environment]]):
+        """Load the persisted index, rebuilding it with ``scan`` if there is none"""
+        with self._file_lock():
+            if self.index_file.exists():
+                self._refresh()
+            else:
+                self._replace_all(scan())
+                self._persist()
+                self.logger.info(f"Built environment index with {len(self._names)} entries")
+
+    def rebuild(self, scan: Callable[[], Iterable[Environment]]):
+        """Replace the index with the result of ``scan``"""
+        with self._file_lock():
+            self._replace_all(scan())
+            self._persist()
+
+    def get(self, name: str) -> Optional[Environment]:
+        with self._lock:
+            self._refresh()
+            return self._environments.get(name)
+
+    def list(self, env_type: Optional[str] = None, offset: int = 0, limit: Optional[int] = None) -> List[Environment]:
+        with self._lock:
+            self._refresh()
+            names = self._names if env_type is None else self._by_type.get(env_type, [])
+            end = None if limit is None else offset + limit
+            return [self._environments[name] for name in names[offset:end]]
+
+    def count(self, env_type: Optional[str] = None) -> int:
+        with self._lock:
+            self._refresh()
+            names = self._names if env_type is None else self._by_type.get(env_type, [])
+            return len(names)
+
+    def put(self, env: Environment):
+        with self._file_lock():
+            self._refresh()
+            self._remove(env.name)
+            self._add(env)
+            self._persist()
+
+    def remove(self, name: str):
+        with self._file_lock():
+            self._refresh()
+            self._remove(name)
+            self._persist()
+
+    @contextmanager
+    def _file_lock(self):
+        with self._lock, open(self.lock_file, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Reload from disk if the index file was replaced since we last read it"""
+        try:
+            stat = os.stat(self.index_file)
+        except FileNotFoundError:
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+        with open(self.index_file) as f:
+            data = json.load(f)
+        self._replace_all(Environment(**env_data) for env_data in data["environments"])
+        self._signature = signature
+
+    def _persist(self):
+        tmp_file = self.index_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
+            json.dump(
+                {"environments": [self._environments[name].dict() for name in self._names]},
+                f,
+                separators=(",", ":")
+            )
+        os.replace(tmp_file, self.index_file)
+        stat = os.stat(self.index_file)
+        self._signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _replace_all(self, environments: Iterable[Environment]):
+        self._environments = {env.name: env for env in environments}
+        self._names = sorted(self._environments)
+        self._by_type = {}
+        for name in self._names:
+            self._by_type.setdefault(self._environments[name].type, []).append(name)
+
+    def _add(self, env: Environment):
+        self._environments[env.name] = env
+        bisect.insort(self._names, env.name)
+        bisect.insort(self._by_type.setdefault(env.type, []), env.name)
+
+    def _remove(self, name: str):
+        env = self._environments.pop(name, None)
+        if env is None:
+            return
+        del self._names[bisect.bisect_left(self._names, name)]
+        names = self._by_type[env.type]
+        del names[bisect.bisect_left(names, name)]
+        if not names:
+            del self._by_type[env.type]
@@ -1,22 +1,47 @@
 import os
 import json
+import logging
 import shutil
+import subprocess
+import threading
+import uuid
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional
 from models.environment import Environment
+from services.environment_index import EnvironmentIndex
+from services.environment_pool import ORIGIN_FILE, EnvironmentPool, relocate_environment
+from utils.file_clone import clone_tree, reap_staging, staging_dir
 
 class EnvironmentManager:
-    def __init__(self, base_path: str = "/app/environments"):
+    def __init__(self, base_path: str = "/app/environments", pool: Optional[EnvironmentPool] = None):
         self.base_path = Path(base_path)
         self.base_path.mkdir(parents=True, exist_ok=True)
+        self.pool = pool
+        self.cloning_path = self.base_path / ".cloning"
+        self.trash_path = self.base_path / ".trash"
+        self.logger = logging.getLogger(__name__)
+
+        # Clones whose worker died mid-clone; other workers' clones are left alone
+        reap_staging(self.cloning_path)
+        self.trash_path.mkdir(exist_ok=True)
+        self._reap_requested = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        self._reaper_lock = threading.Lock()
+        if any(self.trash_path.iterdir()):
+            self._request_reap()
+
+        self.index = EnvironmentIndex(self.base_path)
+        self.index.load(self._scan_environments)
 
     def create_environment(self, env_name: str, env_type: str, config: Dict = None) -> Environment:
-        """Create a new isolated environment"""
+        """Create a new isolated environment, claiming a pre-built one if the pool has it"""
         env_path = self.base_path / env_name
         if env_path.exists():
             raise ValueError(f"Environment {env_name} already exists")
 
-        env_path.mkdir()
+        version = (config or {}).get("version")
+        if self.pool is None or not self.pool.claim(env_type, version, env_path):
+            env_path.mkdir()
         
         env = Environment(
             name=env_name,
@@ -33,12 +58,16 @@ class EnvironmentManager:
         # Add other environment types...
 
         self._save_env_config(env)
+        self.index.put(env)
         return env
 
     def _setup_python_env(self, env: Environment):
         """Setup Python virtual environment"""
         venv_path = Path(env.path) / "venv"
-        os.system(f"python -m venv {venv_path}")
+        if not venv_path.exists():
+            version = env.config.get("version")
+            interpreter = f"python{version}" if version else "python"
+            subprocess.run([interpreter, "-m", "venv", str(venv_path)], check=True)
         env.config["venv_path"] = str(venv_path)
         env.config["activate_cmd"] = f"source {venv_path}/bin/activate"
 
@@ -50,21 +79,102 @@ class EnvironmentManager:
                 json.dump({"name": env.name, "version": "1.0.0"}, f)
         env.config["package_manager"] = "npm"
 
+    def clone_environment(self, src_name: str, dst_name: str) -> Environment:
+        """Create ``dst_name`` as a copy of ``src_name`` sharing unchanged file content.
+
+        Files are reflinked where the filesystem supports it and copied
+        otherwise, so a write in one environment never shows up in the other.
+        """
+        src_path = self.base_path / src_name
+        dst_path = self.base_path / dst_name
+        config_file = src_path / ".env_config.json"
+        if not config_file.exists():
+            raise ValueError(f"Environment {src_name} does not exist")
+        if dst_path.exists():
+            raise ValueError(f"Environment {dst_name} already exists")
+
+        build_path = staging_dir(self.cloning_path)
+        self.cloning_path.mkdir(exist_ok=True)
+        try:
+            method = clone_tree(src_path, build_path)
+            (build_path / ORIGIN_FILE).write_text(str(src_path))
+            os.rename(build_path, dst_path)
+        except Exception:
+            shutil.rmtree(build_path, ignore_errors=True)
+            raise
+        relocate_environment(dst_path, dst_name)
+
+        with open(config_file) as f:
+            env_data = json.load(f)
+        src_prefix, dst_prefix = str(src_path), str(dst_path)
+        config = {
+            key: value.replace(src_prefix, dst_prefix) if isinstance(value, str) else value
+            for key, value in env_data["config"].items()
+        }
+        env = Environment(
+            name=dst_name,
+            path=dst_prefix,
+            type=env_data["type"],
+            config=config
+        )
+        self._save_env_config(env)
+        self.index.put(env)
+        self.logger.info(f"Cloned environment {src_name} to {dst_name} ({method})")
+        return env
+
     def _save_env_config(self, env):
         """Save environment configuration"""
         config_file = Path(env.path) / ".env_config.json"
-        with open(config_file, "w") as f:
+        # Write and rename, so a crash never leaves a truncated config
+        tmp_file = config_file.with_suffix(".tmp")
+        with open(tmp_file, "w") as f:
             json.dump(env.dict(), f)
+        os.replace(tmp_file, config_file)
 
     def delete_environment(self, env_name: str):
-        """Delete an environment"""
+        """Delete an environment.
+
+        The directory is renamed into ``.trash`` immediately and removed by a
+        background thread, so the call does not wait on rmtree.
+        """
         env_path = self.base_path / env_name
         if not env_path.exists():
             raise ValueError(f"Environment {env_name} does not exist")
-        shutil.rmtree(env_path)
+        os.rename(env_path, self.trash_path / f"{env_name}-{uuid.uuid4().hex}")
+        self.index.remove(env_name)
+        self._request_reap()
+
+    def _request_reap(self):
+        with self._reaper_lock:
+            if self._reaper is None:
+                self._reaper = threading.Thread(target=self._reap_trash, name="env-trash-reaper", daemon=True)
+                self._reaper.start()
+        self._reap_requested.set()
+
+    def _reap_trash(self):
+        while True:
+            self._reap_requested.wait()
+            self._reap_requested.clear()
+            for entry in self.trash_path.iterdir():
+                try:
+                    shutil.rmtree(entry)
+                except Exception as e:
+                    self.logger.error(f"Failed to remove deleted environment {entry.name}: {str(e)}")
+
+    def get_environment(self, env_name: str) -> Optional[Environment]:
+        """Look up an environment by name"""
+        return self.index.get(env_name)
+
+    def list_environments(self, env_type: Optional[str] = None, offset: int = 0,
+                          limit: Optional[int] = None) -> List[Environment]:
+        """List environments sorted by name, optionally filtered by type and paginated"""
+        return self.index.list(env_type, offset, limit)
+
+    def rebuild_index(self):
+        """Rescan the environment directories, e.g. after changes made outside the API"""
+        self.index.rebuild(self._scan_environments)
 
-    def list_environments(self) -> List[Environment]:
-        """List all available environments"""
+    def _scan_environments(self) -> List[Environment]:
         environments = []
         for env_dir in self.base_path.iterdir():
             if env_dir.is_dir():
@@ -0,0 +1,210 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from utils.file_clone import reap_staging, staging_dir
+
+ORIGIN_FILE = ".pool_origin"
+
+def relocate_environment(env_path: Path, env_name: str):
+    """Rewrite paths baked into a built environment after it has been moved.
+
+    venv scripts (activate*, console-script shebangs) and pyvenv.cfg embed
+    the absolute path they were created at, and the Node skeleton carries a
+    package name. Files are rewritten via a temp file and rename, so a
+    script that is running while it is relocated never sees a partial file.
+    """
+    origin_file = env_path / ORIGIN_FILE
+    if not origin_file.exists():
+        return
+    old_prefix = origin_file.read_text().encode()
+    new_prefix = str(env_path).encode()
+
+    venv_path = env_path / "venv"
+    candidates = [venv_path / "pyvenv.cfg"]
+    if (venv_path / "bin").is_dir():
+        candidates.extend(p for p in (venv_path / "bin").iterdir() if p.is_file() and not p.is_symlink())
+    for path in candidates:
+        if not path.exists() or path.stat().st_size > 1024 * 1024:
+            continue
+        content = path.read_bytes()
+        if old_prefix in content:
+            _replace_file(path, content.replace(old_prefix, new_prefix))
+
+    package_json = env_path / "package.json"
+    if package_json.exists():
+        manifest = json.loads(package_json.read_text())
+        manifest["name"] = env_name
+        _replace_file(package_json, json.dumps(manifest).encode())
+
+    origin_file.unlink()
+
+def _replace_file(path: Path, content: bytes):
+    tmp_path = path.with_name(f".{path.name}.{uuid.uuid4().hex}")
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    shutil.copymode(path, tmp_path)
+    os.replace(tmp_path, path)
+
+class EnvironmentPool:
+    """Keeps ready-built environments on hand so creation is a rename.
+
+    For every version listed in ``configs/languages/{language}.json`` (plus
+    the default interpreter) the pool holds ``pool_sizes[language]`` ready
+    environments under ``{base_path}/.pool/{language}-{version}/``; by
+    default the sizes come from each language config's ``pool_size``.
+    Python entries are venvs with the language's default packages already
+    installed; Node entries are package.json skeletons with an ``.nvmrc``.
+    Entries are built in ``.pool/.building`` (in ``staging_dir``s, so builds
+    of a worker that died are reaped and other workers' are left alone) and
+    published with a rename, and claimed with another rename, so concurrent
+    claims never share an entry. A background thread refills the pool with
+    ``refill_concurrency`` builders; a file lock lets only one worker refill
+    at a time, so workers do not each build the same missing entries.
+    """
+
+    def __init__(self, base_path: str = "/app/environments",
+                 config_dir: str = "/app/configs/languages",
+                 pool_sizes: Dict[str, int] = None, refill_concurrency: int = 2,
+                 refill_interval: float = 60.0):
+        self.base_path = Path(base_path)
+        self.pool_path = self.base_path / ".pool"
+        self.building_path = self.pool_path / ".building"
+        self.config_dir = Path(config_dir)
+        self.refill_interval = refill_interval
+        self.logger = logging.getLogger(__name__)
+        self.language_configs = self._load_language_configs()
+        if pool_sizes is None:
+            pool_sizes = {
+                language: config["pool_size"]
+                for language, config in self.language_configs.items()
+                if language in ("python", "nodejs") and "pool_size" in config
+            }
+        self.pool_sizes = pool_sizes
+
+        self._builders = ThreadPoolExecutor(max_workers=refill_concurrency)
+        self._refill_requested = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        reap_staging(self.building_path)
+        self.building_path.mkdir(parents=True, exist_ok=True)
+
+    def start(self):
+        """Start the background refill thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refill_loop, name="env-pool-refill", daemon=True)
+            self._thread.start()
+
+    def claim(self, language: str, version: Optional[str], dest: Path) -> bool:
+        """Move a ready environment to ``dest`` (absent or an empty directory);
+        False if none is available or ``dest`` is in the way"""
+        slot = self.pool_path / self._slot_name(language, version)
+        if not slot.is_dir():
+            return False
+
+        for entry in sorted(slot.iterdir()):
+            try:
+                os.rename(entry, dest)
+            except FileNotFoundError:
+                continue  # Claimed by someone else first
+            except OSError as e:
+                # ``dest`` already exists and is not empty; the caller builds afresh
+                self.logger.warning(f"Cannot claim pooled {slot.name} environment for {dest}: {str(e)}")
+                self._refill_requested.set()
+                return False
+            relocate_environment(dest, dest.name)
+            self.logger.info(f"Claimed pooled {slot.name} environment for {dest.name}")
+            self._refill_requested.set()
+            return True
+
+        self._refill_requested.set()
+        return False
+
+    def _slots(self) -> List[Tuple[str, Optional[str]]]:
+        """All (language, version) pairs the pool should keep warm"""
+        slots = []
+        for language, size in self.pool_sizes.items():
+            if size <= 0:
+                continue
+            slots.append((language, None))
+            for version in self.language_configs.get(language, {}).get("versions", []):
+                if language != "python" or shutil.which(f"python{version}"):
+                    slots.append((language, version))
+        return slots
+
+    @staticmethod
+    def _slot_name(language: str, version: Optional[str]) -> str:
+        return f"{language}-{version or 'default'}"
+
+    def _refill_loop(self):
+        while True:
+            try:
+                self._refill()
+            except Exception as e:
+                self.logger.error(f"Environment pool refill failed: {str(e)}")
+            self._refill_requested.wait(self.refill_interval)
+            self._refill_requested.clear()
+
+    def _refill(self):
+        """Build every missing entry and wait for the builds, under the refill lock"""
+        with open(self.pool_path / ".refill.lock", "w") as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return  # Another worker is refilling
+            builds = []
+            for language, version in self._slots():
+                slot = self.pool_path / self._slot_name(language, version)
+                slot.mkdir(parents=True, exist_ok=True)
+                missing = self.pool_sizes[language] - sum(1 for _ in slot.iterdir())
+                for _ in range(missing):
+                    builds.append(self._builders.submit(self._build_entry, language, version, slot))
+            wait(builds)
+
+    def _build_entry(self, language: str, version: Optional[str], slot: Path):
+        build_path = staging_dir(self.building_path)
+        try:
+            build_path.mkdir()
+            if language == "python":
+                self._build_python(build_path, version)
+            elif language == "nodejs":
+                self._build_nodejs(build_path, version)
+            (build_path / ORIGIN_FILE).write_text(str(build_path))
+            os.rename(build_path, slot / build_path.name)
+        except Exception as e:
+            self.logger.error(f"Failed to build pooled {slot.name} environment: {str(e)}")
+            shutil.rmtree(build_path, ignore_errors=True)
+
+    def _build_python(self, build_path: Path, version: Optional[str]):
+        venv_path = build_path / "venv"
+        interpreter = f"python{version}" if version else "python"
+        subprocess.run([interpreter, "-m", "venv", str(venv_path)], check=True, capture_output=True)
+
+        packages = self.language_configs.get("python", {}).get("default_packages", [])
+        if packages:
+            subprocess.run(
+                [str(venv_path / "bin" / "pip"), "install", "--upgrade", *packages],
+                check=True,
+                capture_output=True
+            )
+
+    def _build_nodejs(self, build_path: Path, version: Optional[str]):
+        with open(build_path / "package.json", "w") as f:
+            json.dump({"name": build_path.name, "version": "1.0.0"}, f)
+        if version:
+            (build_path / ".nvmrc").write_text(f"{version}\n")
+
+    def _load_language_configs(self) -> Dict[str, Dict]:
+        configs = {}
+        if self.config_dir.is_dir():
+            for config_file in self.config_dir.glob("*.json"):
+                with open(config_file) as f:
+                    configs[config_file.stem] = json.load(f)
+        return configs
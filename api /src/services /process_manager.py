@@ -1,48 +1,142 @@
+import heapq
+import os
+import selectors
 import subprocess
+import threading
+import time
 import psutil
 import logging
+from datetime import datetime
+from pathlib import Path
 from typing import List, Dict, Optional
 from threading import Lock
-from models.process import ProcessInfo
+from models.metrics import MetricsSnapshot
+from models.process import ProcessInfo, ResourceLimits
+from utils.cgroups import CgroupManager
+from utils.monitoring import PROCESS_COUNT, PROCESS_CPU_SECONDS, PROCESS_MEMORY_BYTES, PROCESS_PIDS
+from utils.process_log import ProcessLog
+from utils.terminal_session import ScrollbackBuffer
+
+class _TrackedProcess:
+    """Supervisor-side state for one tracked command"""
+
+    def __init__(self, command: str, working_dir: str, env: Optional[Dict[str, str]],
+                 restart: bool, output_bytes: int, limits: Optional[ResourceLimits],
+                 cgroup: Optional[Path]):
+        self.command = command
+        self.working_dir = working_dir
+        self.env = env
+        self.restart = restart
+        self.output_bytes = output_bytes
+        self.process: Optional[subprocess.Popen] = None
+        self.info: Optional[ProcessInfo] = None
+        self.stdout = ScrollbackBuffer(output_bytes)
+        self.stderr = ScrollbackBuffer(output_bytes)
+        self.pidfd: Optional[int] = None
+        self.returncode: Optional[int] = None
+        self.started_at = 0.0
+        self.stopping = False
+        self.limits = limits
+        self.cgroup = cgroup
+        self.key: Optional[int] = None  # First pid, stable across restarts
+        self.log: Optional[ProcessLog] = None
+        self.finished_at: Optional[float] = None  # Exited for good (monotonic)
 
 class ProcessManager:
-    def __init__(self):
-        self.processes = {}
+    """Starts and supervises long-running commands.
+
+    A single supervisor thread waits on an epoll selector holding every
+    process's stdout/stderr pipe and its pidfd, so tracked processes cost
+    nothing while idle and exits are noticed immediately rather than on the
+    next ``cleanup_processes`` call. Output is drained into per-stream ring
+    buffers of ``output_bytes`` bytes (children never block on a full pipe)
+    and copied into ``ProcessInfo.output``/``error`` when the process exits.
+    Both streams are also appended to ``{log_dir}/{pid}-{start time}.log`` (see
+    ``ProcessLog``), which keeps up to ``max_log_bytes`` for tail/follow. The
+    ``running_processes_count`` metric is updated as processes start and exit.
+    A process that has exited for good stays listed for ``retention``
+    seconds; the supervisor then forgets it (see ``cleanup_processes``),
+    deleting its log, cgroup and per-process metric series.
+
+    Processes started with ``restart=True`` are restarted after a non-zero
+    exit, with exponential backoff from ``restart_backoff`` up to
+    ``max_restart_backoff`` seconds; the backoff resets once a run has lasted
+    ``restart_reset_after`` seconds. A restarted process gets a new pid, but
+    it stays reachable through the pid it was first started with.
+
+    Once ``cgroups.setup()`` has run (the API startup event), each process
+    tree runs in its own cgroup v2 leaf (see ``CgroupManager``) with
+    ``limits`` or ``default_limits`` applied, and stopping a process kills
+    its whole cgroup at once. Without cgroup v2 processes run unconfined and
+    are stopped by walking their children. CPU, memory and task counts are
+    copied into ``ProcessInfo`` and the managed_process_* metrics by
+    ``record_usage``, which the ``MetricsSampler`` calls on each pass: from
+    the cgroup where there is one, else from the sampled process tree.
+    """
+
+    def __init__(self, output_bytes: int = 64 * 1024, restart_backoff: float = 1.0,
+                 max_restart_backoff: float = 60.0, restart_reset_after: float = 60.0,
+                 max_restarts: int = 10, cgroups: Optional[CgroupManager] = None,
+                 default_limits: Optional[ResourceLimits] = None,
+                 log_dir: str = "/app/logs/processes", max_log_bytes: int = 10 * 1024 * 1024,
+                 retention: float = 3600.0, cleanup_interval: float = 60.0):
+        self.processes: Dict[int, _TrackedProcess] = {}
         self.lock = Lock()
         self.logger = logging.getLogger(__name__)
+        self.output_bytes = output_bytes
+        self.restart_backoff = restart_backoff
+        self.max_restart_backoff = max_restart_backoff
+        self.restart_reset_after = restart_reset_after
+        self.max_restarts = max_restarts
+        self.cgroups = cgroups if cgroups is not None else CgroupManager()
+        self.default_limits = default_limits
+        self.log_dir = Path(log_dir)
+        self.max_log_bytes = max_log_bytes
+        self.retention = retention
+        self.cleanup_interval = cleanup_interval
+        self._next_cleanup = time.monotonic() + cleanup_interval
+
+        self._aliases: Dict[int, int] = {}
+        self._selector = selectors.DefaultSelector()
+        self._wakeup_r, self._wakeup_w = os.pipe()
+        os.set_blocking(self._wakeup_r, False)
+        os.set_blocking(self._wakeup_w, False)
+        self._selector.register(self._wakeup_r, selectors.EVENT_READ)
+        self._pending: List[_TrackedProcess] = []
+        self._unreaped: List[_TrackedProcess] = []  # Polled when pidfds are unavailable
+        self._restarts: List = []  # heap of (due, sequence, tracked)
+        self._restart_seq = 0
+        self._has_pidfd = hasattr(os, "pidfd_open")
+        self._supervisor = threading.Thread(target=self._supervise, name="process-supervisor", daemon=True)
+        self._supervisor.start()
 
-    def start_process(self, command: str, working_dir: str, env_vars: Dict[str, str] = None) -> ProcessInfo:
+    def start_process(self, command: str, working_dir: str, env_vars: Dict[str, str] = None,
+                      restart: bool = False, limits: Optional[ResourceLimits] = None) -> ProcessInfo:
         """Start a new process and track it"""
         try:
             env = None
             if env_vars:
                 env = {**os.environ, **env_vars}
 
-            process = subprocess.Popen(
-                command,
-                cwd=working_dir,
-                shell=True,
-                env=env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                text=True
-            )
-
+            limits = limits or self.default_limits
+            cgroup = self.cgroups.create(limits)
+            tracked = _TrackedProcess(command, working_dir, env, restart, self.output_bytes, limits, cgroup)
+            try:
+                self._spawn(tracked)
+            except Exception:
+                if cgroup is not None:
+                    self.cgroups.remove(cgroup)
+                raise
+            tracked.key = tracked.info.pid
+            # The start time keeps a reused pid from truncating an earlier log
+            log_name = f"{tracked.key}-{tracked.info.start_time:%Y%m%dT%H%M%S%f}.log"
+            tracked.log = ProcessLog(self.log_dir / log_name, self.max_log_bytes)
             with self.lock:
-                proc_info = ProcessInfo(
-                    pid=process.pid,
-                    command=command,
-                    working_dir=working_dir,
-                    status="running",
-                    start_time=datetime.now()
-                )
-                self.processes[process.pid] = {
-                    "process": process,
-                    "info": proc_info
-                }
-
-            self.logger.info(f"Started process {process.pid}: {command}")
-            return proc_info
+                self.processes[tracked.info.pid] = tracked
+            self._watch(tracked)
+
+            self.logger.info(f"Started process {tracked.info.pid}: {command}")
+            return tracked.info
 
         except Exception as e:
             self.logger.error(f"Failed to start process: {str(e)}")
@@ -51,20 +145,29 @@ class ProcessManager:
     def stop_process(self, pid: int) -> bool:
         """Stop a running process"""
         with self.lock:
-            if pid not in self.processes:
+            tracked = self._lookup(pid)
+            if tracked is None or (tracked.returncode is not None and not tracked.restart):
                 return False
+            tracked.stopping = True
+            tracked.restart = False
+            if tracked.returncode is not None:
+                tracked.finished_at = time.monotonic()  # Was waiting for a restart
 
-            proc_data = self.processes[pid]
             try:
-                parent = psutil.Process(pid)
-                for child in parent.children(recursive=True):
-                    child.kill()
-                parent.kill()
-                
-                proc_data["info"].status = "stopped"
-                proc_data["info"].end_time = datetime.now()
+                if tracked.cgroup is not None:
+                    self.cgroups.kill(tracked.cgroup)
+                elif tracked.returncode is None:
+                    parent = psutil.Process(tracked.process.pid)
+                    for child in parent.children(recursive=True):
+                        child.kill()
+                    parent.kill()
+
+                tracked.info.status = "stopped"
+                tracked.info.end_time = datetime.now()
                 self.logger.info(f"Stopped process {pid}")
                 return True
+            except psutil.NoSuchProcess:
+                return True
             except Exception as e:
                 self.logger.error(f"Error stopping process {pid}: {str(e)}")
                 return False
@@ -72,26 +175,308 @@ class ProcessManager:
     def list_processes(self) -> List[ProcessInfo]:
         """List all tracked processes"""
         with self.lock:
-            return [data["info"] for data in self.processes.values()]
+            return [tracked.info for tracked in self.processes.values()]
 
     def get_process(self, pid: int) -> Optional[ProcessInfo]:
         """Get details for a specific process"""
         with self.lock:
-            if pid in self.processes:
-                return self.processes[pid]["info"]
-            return None
+            tracked = self._lookup(pid)
+            return tracked.info if tracked else None
 
-    def cleanup_processes(self):
-        """Clean up finished processes"""
+    def get_output(self, pid: int) -> Optional[Dict[str, str]]:
+        """Recent stdout/stderr of a process, including one that is still running"""
         with self.lock:
-            to_remove = []
-            for pid, data in self.processes.items():
-                if data["process"].poll() is not None:  # Process finished
-                    data["info"].status = "finished"
-                    data["info"].end_time = datetime.now()
-                    if data["process"].poll() != 0:
-                        data["info"].status = "failed"
-                    to_remove.append(pid)
+            tracked = self._lookup(pid)
+            if tracked is None:
+                return None
+            return {"output": self._decode(tracked.stdout), "error": self._decode(tracked.stderr)}
 
+    def get_log(self, pid: int) -> Optional[ProcessLog]:
+        """The on-disk output log of a process, for tailing and following"""
+        with self.lock:
+            tracked = self._lookup(pid)
+            return tracked.log if tracked else None
+
+    def cleanup_processes(self, older_than: float = 0.0):
+        """Forget processes that exited at least ``older_than`` seconds ago and will not be restarted"""
+        now = time.monotonic()
+        with self.lock:
+            to_remove = [
+                pid for pid, tracked in self.processes.items()
+                if tracked.returncode is not None and not tracked.restart
+                and tracked.finished_at is not None and now - tracked.finished_at >= older_than
+            ]
             for pid in to_remove:
-                del self.processes[pid]
+                tracked = self.processes.pop(pid)
+                if tracked.cgroup is not None and not self.cgroups.remove(tracked.cgroup):
+                    self.processes[pid] = tracked  # Still draining; retry next time
+                    continue
+                tracked.log.remove()
+                for gauge in (PROCESS_CPU_SECONDS, PROCESS_MEMORY_BYTES, PROCESS_PIDS):
+                    try:
+                        gauge.remove(str(tracked.key))
+                    except KeyError:
+                        pass
+            self._aliases = {old: new for old, new in self._aliases.items() if new in self.processes}
+
+    def _lookup(self, pid: int) -> Optional[_TrackedProcess]:
+        return self.processes.get(self._aliases.get(pid, pid))
+
+    def _spawn(self, tracked: _TrackedProcess):
+        if tracked.cgroup is None:
+            process = subprocess.Popen(
+                tracked.command,
+                cwd=tracked.working_dir,
+                shell=True,
+                env=tracked.env,
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+        else:
+            # The shell waits on stdin until it has been moved into the cgroup
+            process = subprocess.Popen(
+                self.cgroups.gated(tracked.command),
+                cwd=tracked.working_dir,
+                env=tracked.env,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE
+            )
+            try:
+                self.cgroups.attach(tracked.cgroup, process.pid)
+            except OSError:
+                process.kill()
+                process.communicate()
+                raise
+            process.stdin.close()
+        PROCESS_COUNT.inc()
+        restarts = tracked.info.restarts + 1 if tracked.info else 0
+        tracked.process = process
+        tracked.returncode = None
+        tracked.started_at = time.monotonic()
+        tracked.info = ProcessInfo(
+            pid=process.pid,
+            command=tracked.command,
+            working_dir=tracked.working_dir,
+            status="running",
+            start_time=datetime.now(),
+            restarts=restarts,
+            limits=tracked.limits
+        )
+        tracked.pidfd = os.pidfd_open(process.pid) if self._has_pidfd else None
+
+    def _watch(self, tracked: _TrackedProcess):
+        """Hand a freshly spawned process to the supervisor thread"""
+        with self.lock:
+            self._pending.append(tracked)
+        self._wake()
+
+    def _wake(self):
+        try:
+            os.write(self._wakeup_w, b"\0")
+        except BlockingIOError:
+            pass  # A wakeup is already pending
+
+    def _supervise(self):
+        while True:
+            try:
+                self._supervise_once()
+            except Exception as e:
+                self.logger.error(f"Process supervisor error: {str(e)}")
+
+    def _supervise_once(self):
+        timeout = max(0.0, self._next_cleanup - time.monotonic())
+        if self._restarts:
+            timeout = min(timeout, max(0.0, self._restarts[0][0] - time.monotonic()))
+        if not self._has_pidfd:
+            timeout = min(timeout, 1.0)
+
+        for key, _ in self._selector.select(timeout):
+            if key.fd == self._wakeup_r:
+                self._drain_wakeups()
+            elif key.data[0] == "exit":
+                self._on_exit(key.data[1])
+            else:
+                self._on_output(key)
+
+        for tracked in [t for t in self._unreaped if t.process.poll() is not None]:
+            self._unreaped.remove(tracked)
+            self._on_exit(tracked)
+
+        now = time.monotonic()
+        while self._restarts and self._restarts[0][0] <= now:
+            _, _, tracked = heapq.heappop(self._restarts)
+            self._restart(tracked)
+
+        if now >= self._next_cleanup:
+            self._next_cleanup = now + self.cleanup_interval
+            self.cleanup_processes(self.retention)
+
+    def _drain_wakeups(self):
+        try:
+            while os.read(self._wakeup_r, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        with self.lock:
+            pending, self._pending = self._pending, []
+        for tracked in pending:
+            self._register(tracked)
+
+    def _register(self, tracked: _TrackedProcess):
+        for name, stream in (("stdout", tracked.process.stdout), ("stderr", tracked.process.stderr)):
+            os.set_blocking(stream.fileno(), False)
+            self._selector.register(stream, selectors.EVENT_READ, ("output", tracked, name))
+        if tracked.pidfd is not None:
+            self._selector.register(tracked.pidfd, selectors.EVENT_READ, ("exit", tracked))
+        else:
+            self._unreaped.append(tracked)
+
+    def _on_output(self, key):
+        _, tracked, name = key.data
+        if key.fileobj.closed:
+            return  # Already drained by _on_exit earlier in this batch
+        buffer = tracked.stdout if name == "stdout" else tracked.stderr
+        try:
+            data = os.read(key.fd, 65536)
+        except BlockingIOError:
+            return
+        if data:
+            with self.lock:
+                buffer.append(data)
+            tracked.log.append(data)
+            return
+        self._selector.unregister(key.fileobj)
+        key.fileobj.close()
+
+    def _on_exit(self, tracked: _TrackedProcess):
+        if tracked.pidfd is not None:
+            self._selector.unregister(tracked.pidfd)
+            os.close(tracked.pidfd)
+            tracked.pidfd = None
+        returncode = tracked.process.wait()
+        PROCESS_COUNT.dec()
+        if tracked.cgroup is not None:
+            with self.lock:
+                self._refresh_usage(tracked)
+            # Take down anything the process left behind
+            self.cgroups.kill(tracked.cgroup)
+
+        # Collect what is left in the pipes; a pipe held open by a grandchild
+        # is closed rather than waited on.
+        for stream, buffer in ((tracked.process.stdout, tracked.stdout), (tracked.process.stderr, tracked.stderr)):
+            if stream.closed:
+                continue
+            try:
+                while True:
+                    data = os.read(stream.fileno(), 65536)
+                    if not data:
+                        break
+                    buffer.append(data)
+                    tracked.log.append(data)
+            except BlockingIOError:
+                pass
+            self._selector.unregister(stream)
+            stream.close()
+
+        with self.lock:
+            tracked.returncode = returncode
+            info = tracked.info
+            info.return_code = returncode
+            info.output = self._decode(tracked.stdout)
+            info.error = self._decode(tracked.stderr)
+            if not tracked.stopping:
+                info.status = "finished" if returncode == 0 else "failed"
+                info.end_time = datetime.now()
+            restart = tracked.restart and returncode != 0 and info.restarts < self.max_restarts
+            tracked.restart = restart
+            if not restart:
+                tracked.finished_at = time.monotonic()
+
+        self.logger.info(f"Process {info.pid} exited with code {returncode}")
+        if restart:
+            self._schedule_restart(tracked)
+        else:
+            tracked.log.close()
+
+    def _schedule_restart(self, tracked: _TrackedProcess):
+        run_time = time.monotonic() - tracked.started_at
+        if run_time >= self.restart_reset_after:
+            attempt = 0
+        else:
+            attempt = tracked.info.restarts
+        delay = min(self.restart_backoff * (2 ** attempt), self.max_restart_backoff)
+        self._restart_seq += 1
+        heapq.heappush(self._restarts, (time.monotonic() + delay, self._restart_seq, tracked))
+        self.logger.info(f"Restarting process {tracked.info.pid} in {delay:.1f}s")
+
+    def _restart(self, tracked: _TrackedProcess):
+        with self.lock:
+            if not tracked.restart:
+                tracked.log.close()  # Stopped while waiting for its backoff
+                tracked.finished_at = time.monotonic()
+                return
+            old_pid = tracked.info.pid
+            tracked.stdout = ScrollbackBuffer(tracked.output_bytes)
+            tracked.stderr = ScrollbackBuffer(tracked.output_bytes)
+            try:
+                self._spawn(tracked)
+            except Exception as e:
+                self.logger.error(f"Failed to restart process {old_pid}: {str(e)}")
+                tracked.restart = False
+                tracked.log.close()
+                tracked.finished_at = time.monotonic()
+                return
+            del self.processes[old_pid]
+            self.processes[tracked.info.pid] = tracked
+            for alias, target in self._aliases.items():
+                if target == old_pid:
+                    self._aliases[alias] = tracked.info.pid
+            self._aliases[old_pid] = tracked.info.pid
+        self._register(tracked)
+        self.logger.info(f"Restarted process {old_pid} as {tracked.info.pid}")
+
+    def record_usage(self, snapshot: MetricsSnapshot):
+        """Update running processes' usage; called by the MetricsSampler each pass"""
+        with self.lock:
+            for tracked in self.processes.values():
+                if tracked.returncode is not None:
+                    continue
+                if tracked.cgroup is not None:
+                    self._refresh_usage(tracked)
+                    continue
+                sampled = snapshot.processes.get(tracked.info.pid)
+                if sampled is not None:
+                    self._set_usage(tracked, {
+                        "cpu_seconds": sampled.cpu_seconds,
+                        "memory_bytes": sampled.memory_bytes,
+                        "pids": sampled.processes
+                    })
+
+    def _refresh_usage(self, tracked: _TrackedProcess):
+        """Copy the cgroup's counters into ProcessInfo and the metrics (lock held)"""
+        if tracked.cgroup is None:
+            return
+        usage = self.cgroups.usage(tracked.cgroup)
+        if usage:
+            self._set_usage(tracked, usage)
+
+    @staticmethod
+    def _set_usage(tracked: _TrackedProcess, usage: Dict[str, float]):
+        info = tracked.info
+        info.cpu_seconds = usage.get("cpu_seconds")
+        info.memory_bytes = usage.get("memory_bytes")
+        info.memory_peak_bytes = usage.get("memory_peak_bytes")
+        info.pids = usage.get("pids")
+        label = str(tracked.key)
+        if info.cpu_seconds is not None:
+            PROCESS_CPU_SECONDS.labels(pid=label).set(info.cpu_seconds)
+        if info.memory_bytes is not None:
+            PROCESS_MEMORY_BYTES.labels(pid=label).set(info.memory_bytes)
+        if info.pids is not None:
+            PROCESS_PIDS.labels(pid=label).set(info.pids)
+
+    @staticmethod
+    def _decode(buffer: ScrollbackBuffer) -> str:
+        return buffer.snapshot().decode("utf-8", errors="replace")
@@ -0,0 +1,96 @@
+import json
+import logging
+import os
+import time
+import zlib
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+class TaskResultStore:
+    """Stores task results outside the ``task:{id}`` hash.
+
+    Results live under their own ``task:{id}:result`` key so that reading a
+    task's status never transfers its result. Serialized results larger than
+    ``compress_threshold`` bytes are zlib-compressed, and those larger than
+    ``offload_threshold`` are written (compressed) to ``offload_path`` with
+    only a reference kept in Redis. Finished tasks and their results expire
+    after a per-task-type TTL.
+    """
+
+    def __init__(self, redis_conn, offload_path: str = "/app/task_results",
+                 default_ttl: int = 7 * 24 * 3600, ttls: Dict[str, int] = None,
+                 compress_threshold: int = 4 * 1024, offload_threshold: int = 1024 * 1024):
+        self.redis = redis_conn
+        self.offload_path = Path(offload_path)
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.compress_threshold = compress_threshold
+        self.offload_threshold = offload_threshold
+        self.logger = logging.getLogger(__name__)
+
+    def ttl(self, task_type: Optional[str]) -> int:
+        return self.ttls.get(task_type, self.default_ttl)
+
+    def save(self, pipe, task_id: str, task_type: Optional[str], result: Any) -> Dict[str, str]:
+        """Queue the result write on ``pipe``; returns the hash fields describing it"""
+        data = json.dumps(result).encode()
+        ttl = self.ttl(task_type)
+
+        if len(data) > self.offload_threshold:
+            encoding = "file"
+            value = str(self._offload(task_id, zlib.compress(data)))
+        elif len(data) > self.compress_threshold:
+            encoding = "zlib"
+            value = zlib.compress(data)
+        else:
+            encoding = "json"
+            value = data
+
+        pipe.set(f"task:{task_id}:result", value, ex=ttl)
+        return {"result_encoding": encoding, "result_size": str(len(data))}
+
+    def expire(self, pipe, task_id: str, task_type: Optional[str]):
+        """Queue expiry of a finished task's hash"""
+        pipe.expire(f"task:{task_id}", self.ttl(task_type))
+
+    def load(self, task_id: str, encoding: Optional[str]) -> Any:
+        """Fetch and decode a stored result (None if absent or expired)"""
+        value = self.redis.get(f"task:{task_id}:result")
+        if value is None:
+            return None
+
+        if encoding == "file":
+            path = value.decode() if isinstance(value, bytes) else value
+            try:
+                with open(path, "rb") as f:
+                    value = f.read()
+            except FileNotFoundError:
+                return None
+            value = zlib.decompress(value)
+        elif encoding == "zlib":
+            value = zlib.decompress(value)
+        return json.loads(value)
+
+    def purge_offloaded(self):
+        """Delete offloaded result files whose Redis reference has expired"""
+        if not self.offload_path.exists():
+            return
+
+        files = [p for p in self.offload_path.iterdir() if p.suffix == ".z"]
+        pipe = self.redis.pipeline(transaction=False)
+        for path in files:
+            pipe.exists(f"task:{path.stem}:result")
+        for path, exists in zip(files, pipe.execute()):
+            # Skip files still being written (reference not set yet)
+            if not exists and time.time() - path.stat().st_mtime > 60:
+                path.unlink()
+                self.logger.info(f"Removed expired task result {path.name}")
+
+    def _offload(self, task_id: str, data: bytes) -> Path:
+        self.offload_path.mkdir(parents=True, exist_ok=True)
+        path = self.offload_path / f"{task_id}.z"
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return path
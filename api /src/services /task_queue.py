@@ -1,93 +1,483 @@
 import redis
 import json
 import uuid
+import logging
+import threading
+import time
+from collections import deque
 from datetime import datetime
-from typing import Dict, Any, Optional
-from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Dict, Any, Iterable, List, NamedTuple, Optional, Tuple
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
 from models.task import Task
+from services.result_store import TaskResultStore
+
+# Tasks queued before per-type queues existed sit in one shared key. These
+# move a batch (ARGV[1]) of them onto "{key}:{type}" atomically and return
+# how many were moved. Oldest tasks end up at the head of their type's list.
+LEGACY_LIST_DRAIN_SCRIPT = """
+local moved = 0
+for _ = 1, tonumber(ARGV[1]) do
+    local item = redis.call('RPOP', KEYS[1])
+    if not item then
+        break
+    end
+    local ok, task = pcall(cjson.decode, item)
+    local task_type = 'unparseable'
+    if ok and type(task) == 'table' and type(task['type']) == 'string' then
+        task_type = task['type']
+    end
+    redis.call('LPUSH', KEYS[1] .. ':' .. task_type, item)
+    moved = moved + 1
+end
+return moved
+"""
+
+LEGACY_STREAM_DRAIN_SCRIPT = """
+local entries = redis.call('XRANGE', KEYS[1], '-', '+', 'COUNT', tonumber(ARGV[1]))
+for _, entry in ipairs(entries) do
+    local fields = entry[2]
+    local task_json = nil
+    for i = 1, #fields, 2 do
+        if fields[i] == 'task' then
+            task_json = fields[i + 1]
+        end
+    end
+    if task_json then
+        local ok, task = pcall(cjson.decode, task_json)
+        local task_type = 'unparseable'
+        if ok and type(task) == 'table' and type(task['type']) == 'string' then
+            task_type = task['type']
+        end
+        redis.call('XADD', KEYS[1] .. ':' .. task_type, '*', 'task', task_json)
+    end
+    redis.call('XDEL', KEYS[1], entry[1])
+end
+if redis.call('XLEN', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[1])  -- Also drops the old consumer group
+end
+return #entries
+"""
+
+def _drain(script, key: str, batch: int) -> int:
+    moved = 0
+    while True:
+        count = script(keys=[key], args=[batch])
+        moved += count
+        if count < batch:
+            return moved
+
+class ListQueueBackend:
+    """Redis lists, one per task type: one consumer per task, no acknowledgement"""
+
+    def __init__(self, redis_conn, key: str = "task_queue"):
+        self.redis = redis_conn
+        self.key = key
+        self._drain_script = redis_conn.register_script(LEGACY_LIST_DRAIN_SCRIPT)
+
+    def queue_key(self, task_type: str) -> str:
+        return f"{self.key}:{task_type}"
+
+    def register(self, task_type: str):
+        pass
+
+    def push(self, pipe, task_type: str, task_json: str):
+        pipe.rpush(self.queue_key(task_type), task_json)
+
+    def take(self, task_type: str, count: int) -> List[Tuple[Optional[str], str]]:
+        """Pop up to ``count`` waiting tasks of one type in one MULTI, without blocking"""
+        key = self.queue_key(task_type)
+        pipe = self.redis.pipeline()
+        pipe.lrange(key, 0, count - 1)
+        pipe.ltrim(key, count, -1)
+        tasks, _ = pipe.execute()
+        return [(None, task_json) for task_json in tasks]
+
+    def wait(self, task_types: List[str], timeout: int) -> List[Tuple[Optional[str], str]]:
+        """Block until a task of any listed type arrives; earlier types win ties"""
+        item = self.redis.blpop([self.queue_key(t) for t in task_types], timeout=timeout)
+        if item is None:
+            return []
+        return [(None, item[1])]
+
+    def ack(self, pipe, task_type: str, message_ids: List[str]):
+        pass
+
+    def drain_legacy(self, batch: int = 1000) -> int:
+        """Move tasks from the shared ``key`` list onto their type's list"""
+        return _drain(self._drain_script, self.key, batch)
+
+class StreamQueueBackend:
+    """Redis Streams, one per task type, shared by several workers through a
+    consumer group.
+
+    Entries stay pending until acknowledged, and entries left pending by a
+    dead consumer for longer than ``claim_idle_ms`` are claimed by another,
+    so every task is delivered at least once.
+    """
+
+    def __init__(self, redis_conn, stream: str = "task_stream", group: str = "workers",
+                 consumer: Optional[str] = None, claim_idle_ms: int = 300000):
+        self.redis = redis_conn
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or str(uuid.uuid4())
+        self.claim_idle_ms = claim_idle_ms
+        self._drain_script = redis_conn.register_script(LEGACY_STREAM_DRAIN_SCRIPT)
+
+    def queue_key(self, task_type: str) -> str:
+        return f"{self.stream}:{task_type}"
+
+    def register(self, task_type: str):
+        """Create the consumer group for a task type's stream"""
+        try:
+            self.redis.xgroup_create(self.queue_key(task_type), self.group, id="0", mkstream=True)
+        except redis.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    def push(self, pipe, task_type: str, task_json: str):
+        pipe.xadd(self.queue_key(task_type), {"task": task_json})
+
+    def take(self, task_type: str, count: int) -> List[Tuple[Optional[str], str]]:
+        """Claim stale entries, then read new ones, up to ``count`` without blocking"""
+        messages = self._claim_stale(task_type, count)
+        if len(messages) < count:
+            messages += self._read_new([task_type], count - len(messages))
+        return messages
+
+    def wait(self, task_types: List[str], timeout: int) -> List[Tuple[Optional[str], str]]:
+        """Block until an entry arrives on any listed stream (at most one per stream)"""
+        return self._read_new(task_types, 1, block=timeout * 1000)
+
+    def ack(self, pipe, task_type: str, message_ids: List[str]):
+        if message_ids:
+            stream = self.queue_key(task_type)
+            pipe.xack(stream, self.group, *message_ids)
+            pipe.xdel(stream, *message_ids)
+
+    def drain_legacy(self, batch: int = 1000) -> int:
+        """Move entries, pending or not, from the shared ``stream`` onto their type's stream"""
+        return _drain(self._drain_script, self.stream, batch)
+
+    def _read_new(self, task_types: List[str], count: int,
+                  block: Optional[int] = None) -> List[Tuple[Optional[str], str]]:
+        response = self.redis.xreadgroup(
+            self.group, self.consumer, {self.queue_key(t): ">" for t in task_types},
+            count=count, block=block
+        )
+        return [
+            (message_id, self._task_field(fields))
+            for _, entries in response or []
+            for message_id, fields in entries
+            if fields
+        ]
+
+    def _claim_stale(self, task_type: str, count: int) -> List[Tuple[Optional[str], str]]:
+        """Take over entries another consumer left unacknowledged"""
+        # Claimed entries become ours and stop being idle, so scanning from
+        # the start of the pending list always finds the oldest stale ones
+        entries = self.redis.xautoclaim(
+            self.queue_key(task_type), self.group, self.consumer,
+            min_idle_time=self.claim_idle_ms,
+            start_id="0-0",
+            count=count
+        )
+        return [
+            (message_id, self._task_field(fields))
+            for message_id, fields in entries
+            if fields
+        ]
+
+    @staticmethod
+    def _task_field(fields: Dict) -> str:
+        return fields.get(b"task") or fields.get("task")
+
+class HandlerSpec(NamedTuple):
+    handler: Callable
+    concurrency: Optional[int]
+    priority: int
+    executor: str  # thread or process
 
 class TaskQueue:
-    def __init__(self, redis_conn):
+    """Redis-backed task queue with a backpressure-aware scheduler.
+
+    Each task type has its own queue; tasks left in the shared queue key
+    used before that are moved onto them when the scheduler starts and at
+    every purge. The scheduler only takes a task off Redis when its
+    handler's pool has a free worker and the type is under its concurrency
+    limit, so backlogs stay in Redis and a task is marked "processing" only
+    when it actually starts. Types are served in priority order, and a type
+    that was at its limit is picked up again within ``poll_timeout`` seconds
+    of a slot freeing. Tasks for types this worker has no handler for stay
+    queued for workers that have one.
+
+    Results are kept by ``result_store`` (see TaskResultStore) and written
+    by ``result_workers`` threads; a task's slot is released once its result
+    is recorded. Finished tasks expire after their type's TTL, and expired
+    offloaded results are purged every ``purge_interval`` seconds.
+    """
+
+    def __init__(self, redis_conn, backend: str = "list", batch_size: int = 32,
+                 max_workers: int = 4, process_workers: int = 2, poll_timeout: int = 1,
+                 result_store: Optional[TaskResultStore] = None, purge_interval: int = 600,
+                 result_workers: int = 2, **backend_options):
         self.redis = redis_conn
-        self.executor = ThreadPoolExecutor(max_workers=4)
-        self.task_callbacks = {}
+        self.task_callbacks: Dict[str, HandlerSpec] = {}
+        self.batch_size = batch_size
+        self.poll_timeout = poll_timeout
+        self.result_store = result_store or TaskResultStore(redis_conn)
+        self.purge_interval = purge_interval
+        self._last_purge = time.monotonic()
+        self.logger = logging.getLogger(__name__)
+
+        self.pool_sizes = {"thread": max_workers, "process": process_workers}
+        self._pools = {"thread": ThreadPoolExecutor(max_workers=max_workers)}
+        # Results are serialized, compressed and written here, not in the
+        # completion callback (a process pool runs those on its manager thread)
+        self._result_writers = ThreadPoolExecutor(max_workers=result_workers, thread_name_prefix="task-results")
+        self._pool_running = {"thread": 0, "process": 0}
+        self._type_running: Dict[str, int] = {}
+        self._parked = deque()
+        self._slot_freed = threading.Condition()
+
+        if backend == "stream":
+            self.backend = StreamQueueBackend(redis_conn, **backend_options)
+        else:
+            self.backend = ListQueueBackend(redis_conn, **backend_options)
 
     def enqueue(self, task_type: str, payload: Dict[str, Any]) -> str:
         """Add a new task to the queue"""
-        task_id = str(uuid.uuid4())
-        task = Task(
-            id=task_id,
-            type=task_type,
-            payload=payload,
-            status="queued",
-            created_at=datetime.now()
-        )
-        
-        self.redis.rpush("task_queue", task.json())
-        self.redis.hset(f"task:{task_id}", mapping=task.dict())
-        
-        return task_id
+        return self.enqueue_many([(task_type, payload)])[0]
+
+    def enqueue_many(self, tasks: Iterable[Tuple[str, Dict[str, Any]]]) -> List[str]:
+        """Add several tasks to the queue in a single MULTI round trip"""
+        pipe = self.redis.pipeline()
+        task_ids = []
+        for task_type, payload in tasks:
+            task = Task(
+                id=str(uuid.uuid4()),
+                type=task_type,
+                payload=payload,
+                status="queued",
+                created_at=datetime.now()
+            )
+            # The hash goes first so a worker never sees a task without one
+            pipe.hset(f"task:{task.id}", mapping=self._task_mapping(task))
+            self.backend.push(pipe, task_type, task.json())
+            task_ids.append(task.id)
+
+        if task_ids:
+            pipe.execute()
+        return task_ids
 
-    def register_handler(self, task_type: str, handler):
-        """Register a handler for a task type"""
-        self.task_callbacks[task_type] = handler
+    def register_handler(self, task_type: str, handler, concurrency: Optional[int] = None,
+                         priority: int = 0, executor: str = "thread"):
+        """Register a handler for a task type.
+
+        ``concurrency`` caps how many tasks of this type run at once, and
+        higher ``priority`` types are dequeued first. ``executor="process"``
+        runs the handler in a process pool (handler and payload must be
+        picklable), which keeps CPU-bound handlers off the GIL.
+        """
+        if executor not in self.pool_sizes:
+            raise ValueError(f"Unknown executor {executor}")
+        if executor not in self._pools:
+            self._pools[executor] = ProcessPoolExecutor(max_workers=self.pool_sizes[executor])
+
+        self.backend.register(task_type)
+        self.task_callbacks[task_type] = HandlerSpec(handler, concurrency, priority, executor)
+        self._type_running.setdefault(task_type, 0)
 
     def process_tasks(self):
         """Process tasks from the queue"""
+        self._drain_legacy()
         while True:
-            _, task_json = self.redis.blpop("task_queue", timeout=30)
-            if not task_json:
+            self._housekeeping()
+
+            with self._slot_freed:
+                if not self._eligible_types() or self._parked and not self._parked_runnable():
+                    # Wake up for housekeeping even if no slot frees
+                    self._slot_freed.wait(self._until_purge())
+                    continue
+                eligible = self._eligible_types()
+
+            if self._parked:
+                self._dispatch([self._parked.popleft()])
                 continue
-                
-            task = Task.parse_raw(task_json)
-            self._update_task_status(task.id, "processing")
-            
-            try:
-                if task.type in self.task_callbacks:
-                    self.executor.submit(
-                        self._execute_task,
-                        task,
-                        self.task_callbacks[task.type]
-                    )
+
+            dispatched = 0
+            for task_type in eligible:
+                free = self._free_slots(task_type)
+                if free > 0:
+                    messages = self.backend.take(task_type, min(free, self.batch_size))
+                    dispatched += self._dispatch(self._parse(messages))
+
+            if not dispatched:
+                messages = self.backend.wait(eligible, timeout=self.poll_timeout)
+                self._dispatch(self._parse(messages))
+
+    def _until_purge(self) -> float:
+        return max(0.0, self._last_purge + self.purge_interval - time.monotonic())
+
+    def _housekeeping(self):
+        """Periodically drop offloaded results whose tasks have expired, and
+        pick up tasks still being queued under the legacy key"""
+        if self._until_purge() > 0:
+            return
+        self._last_purge = time.monotonic()
+        try:
+            self.result_store.purge_offloaded()
+        except Exception as e:
+            self.logger.error(f"Failed to purge task results: {str(e)}")
+        self._drain_legacy()
+
+    def _drain_legacy(self):
+        try:
+            moved = self.backend.drain_legacy()
+        except Exception as e:
+            self.logger.error(f"Failed to drain the legacy task queue: {str(e)}")
+            return
+        if moved:
+            self.logger.info(f"Moved {moved} tasks from the legacy queue onto per-type queues")
+
+    def _eligible_types(self) -> List[str]:
+        """Registered types with a free slot, highest priority first"""
+        eligible = [t for t in self.task_callbacks if self._free_slots(t) > 0]
+        return sorted(eligible, key=lambda t: -self.task_callbacks[t].priority)
+
+    def _free_slots(self, task_type: str) -> int:
+        spec = self.task_callbacks[task_type]
+        free = self.pool_sizes[spec.executor] - self._pool_running[spec.executor]
+        if spec.concurrency is not None:
+            free = min(free, spec.concurrency - self._type_running[task_type])
+        return free
+
+    def _parked_runnable(self) -> bool:
+        _, task = self._parked[0]
+        return self._free_slots(task.type) > 0
+
+    @staticmethod
+    def _parse(messages: List[Tuple[Optional[str], str]]) -> List[Tuple[Optional[str], Task]]:
+        return [(message_id, Task.parse_raw(task_json)) for message_id, task_json in messages]
+
+    def _dispatch(self, batch: List[Tuple[Optional[str], Task]]) -> int:
+        """Start tasks, parking any that no longer fit in a free slot"""
+        runnable = []
+        with self._slot_freed:
+            for message_id, task in batch:
+                if self._free_slots(task.type) > 0:
+                    spec = self.task_callbacks[task.type]
+                    self._pool_running[spec.executor] += 1
+                    self._type_running[task.type] += 1
+                    runnable.append((message_id, task))
                 else:
-                    self._update_task_status(task.id, "failed", "No handler registered")
+                    # Only a multi-stream wait can over-deliver, by at most one per type
+                    self._parked.append((message_id, task))
+
+        if runnable:
+            self._update_task_statuses([task.id for _, task in runnable], "processing")
+        for message_id, task in runnable:
+            spec = self.task_callbacks[task.type]
+            try:
+                future = self._pools[spec.executor].submit(spec.handler, task.payload)
             except Exception as e:
-                self._update_task_status(task.id, "failed", str(e))
+                future = Future()
+                future.set_exception(e)
+            future.add_done_callback(partial(self._on_task_done, task, message_id))
+        return len(runnable)
 
-    def _execute_task(self, task: Task, handler):
-        """Execute a task with its handler"""
+    def _on_task_done(self, task: Task, message_id: Optional[str], future: Future):
+        """Hand a finished task to the result writers, off the worker's thread"""
         try:
-            result = handler(task.payload)
-            self._update_task_status(
-                task.id,
-                "completed",
-                result=result
-            )
+            self._result_writers.submit(self._record_result, task, message_id, future)
+        except RuntimeError:
+            self._record_result(task, message_id, future)  # Interpreter shutting down
+
+    def _record_result(self, task: Task, message_id: Optional[str], future: Future):
+        """Record a finished task (compressing or offloading its result) and release its slot"""
+        try:
+            try:
+                result = future.result()
+            except Exception as e:
+                self._update_task_status(task.id, "failed", error=str(e),
+                                         message_id=message_id, task_type=task.type)
+            else:
+                self._update_task_status(task.id, "completed", result=result,
+                                         message_id=message_id, task_type=task.type)
         except Exception as e:
-            self._update_task_status(
-                task.id,
-                "failed",
-                error=str(e)
-            )
+            self.logger.error(f"Failed to record result of task {task.id}: {str(e)}")
+        finally:
+            spec = self.task_callbacks[task.type]
+            with self._slot_freed:
+                self._pool_running[spec.executor] -= 1
+                self._type_running[task.type] -= 1
+                self._slot_freed.notify()
 
-    def _update_task_status(self, task_id: str, status: str, 
-                          error: Optional[str] = None, result: Any = None):
-        """Update task status in Redis"""
+    def _update_task_status(self, task_id: str, status: str,
+                          error: Optional[str] = None, result: Any = None,
+                          message_id: Optional[str] = None, task_type: Optional[str] = None):
+        """Update task status in Redis, acknowledging its queue entry if given"""
         updates = {
             "status": status,
             "updated_at": datetime.now().isoformat()
         }
-        
+
+        pipe = self.redis.pipeline()
         if error:
             updates["error"] = error
-        if result:
-            updates["result"] = json.dumps(result)
-        
-        self.redis.hset(f"task:{task_id}", mapping=updates)
+        if result is not None:
+            updates.update(self.result_store.save(pipe, task_id, task_type, result))
+
+        pipe.hset(f"task:{task_id}", mapping=updates)
+        if status in ("completed", "failed"):
+            self.result_store.expire(pipe, task_id, task_type)
+        if message_id is not None:
+            self.backend.ack(pipe, task_type, [message_id])
+        pipe.execute()
+
+    def _update_task_statuses(self, task_ids: List[str], status: str):
+        """Move several tasks to the same status in one round trip"""
+        updates = {
+            "status": status,
+            "updated_at": datetime.now().isoformat()
+        }
+        pipe = self.redis.pipeline(transaction=False)
+        for task_id in task_ids:
+            pipe.hset(f"task:{task_id}", mapping=updates)
+        pipe.execute()
+
+    @staticmethod
+    def _task_mapping(task: Task) -> Dict[str, str]:
+        """Flatten a task into string hash fields"""
+        mapping = {}
+        for key, value in json.loads(task.json()).items():
+            if value is None:
+                continue
+            mapping[key] = value if isinstance(value, str) else json.dumps(value)
+        return mapping
 
-    def get_task(self, task_id: str) -> Optional[Task]:
-        """Get task details"""
+    def get_task(self, task_id: str, include_result: bool = False) -> Optional[Task]:
+        """Get task details; the result is only fetched if ``include_result``"""
         task_data = self.redis.hgetall(f"task:{task_id}")
         if not task_data:
             return None
-        return Task(**task_data)
+
+        fields = {
+            (k.decode() if isinstance(k, bytes) else k): (v.decode() if isinstance(v, bytes) else v)
+            for k, v in task_data.items()
+        }
+        fields["payload"] = json.loads(fields["payload"])
+        encoding = fields.pop("result_encoding", None)
+        if include_result and encoding:
+            fields["result"] = self.result_store.load(task_id, encoding)
+        return Task(**fields)
+
+    def get_task_result(self, task_id: str) -> Any:
+        """Get only a task's result"""
+        encoding = self.redis.hget(f"task:{task_id}", "result_encoding")
+        if encoding is None:
+            return None
+        if isinstance(encoding, bytes):
+            encoding = encoding.decode()
+        return self.result_store.load(task_id, encoding)
@@ -0,0 +1,204 @@
+import logging
+import os
+import signal
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+import psutil
+from models.process import ResourceLimits
+
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+CONTROLLERS = ("cpu", "memory", "pids")
+CPU_PERIOD_USEC = 100000
+# Holds the shell until the parent has moved it into its cgroup (stdin is
+# closed once it has), then runs the command as ``shell=True`` would
+_GATE_SCRIPT = 'read -r _; exec /bin/sh -c "$0" </dev/null'
+
+class CgroupManager:
+    """Places process trees in cgroup v2 leaves with CPU/memory/pids limits.
+
+    Uses the cgroup this API runs in as the delegated subtree. Because a
+    cgroup with controllers enabled may not contain processes itself, the
+    API process is moved into a ``supervisor`` leaf and managed processes go
+    under ``processes/<id>``::
+
+        <own cgroup>/
+            supervisor/          the API itself
+            processes/           controllers enabled here
+                <id>/            one leaf per managed process tree
+
+    ``setup`` runs once the server is up (the startup event), not at import.
+    Only this worker, its uvicorn parent and the parent's other workers are
+    moved; if the cgroup holds anything else (nginx, a shell as PID 1) it is
+    shared, and ``setup`` fails closed rather than moving foreign processes.
+    The container entrypoint (``scripts/start_server.sh``) therefore starts
+    uvicorn alone in an ``api`` cgroup, with nginx in an ``init`` sibling.
+    In that case, or if cgroup v2 is not mounted or the subtree is not
+    writable, ``available`` is False and ``create`` returns None, so
+    processes run unconfined.
+    """
+
+    def __init__(self, root: Path = CGROUP_ROOT):
+        self.logger = logging.getLogger(__name__)
+        self.root = Path(root)
+        self.processes_path: Optional[Path] = None
+        self.available = False
+
+    def setup(self) -> bool:
+        """Claim the delegated subtree; False if limits are unavailable"""
+        if self.available:
+            return True
+        try:
+            self._setup()
+            self.available = True
+        except OSError as e:
+            self.logger.warning(f"cgroup v2 unavailable, process limits disabled: {str(e)}")
+        return self.available
+
+    def _setup(self):
+        if not (self.root / "cgroup.controllers").exists():
+            raise OSError("cgroup v2 is not mounted")
+        own = self._own_cgroup()
+        controllers = (own / "cgroup.controllers").read_text().split()
+        missing = [c for c in CONTROLLERS if c not in controllers]
+        if missing:
+            raise OSError(f"controllers not delegated: {', '.join(missing)}")
+
+        server = self._server_pids()
+        members = [int(pid) for pid in (own / "cgroup.procs").read_text().split()]
+        foreign = [pid for pid in members if pid not in server]
+        if foreign:
+            raise OSError(f"{own} is shared with processes outside this server: {foreign[:10]}")
+
+        supervisor = own / "supervisor"
+        supervisor.mkdir(exist_ok=True)
+        for pid in members:
+            try:
+                (supervisor / "cgroup.procs").write_text(str(pid))
+            except ProcessLookupError:
+                pass
+        self._enable_controllers(own)
+
+        self.processes_path = own / "processes"
+        self.processes_path.mkdir(exist_ok=True)
+        self._enable_controllers(self.processes_path)
+
+    @staticmethod
+    def _server_pids() -> Set[int]:
+        """This process, plus its parent and siblings when they run the same
+        executable (the uvicorn master and its other workers)"""
+        me = psutil.Process()
+        pids = {me.pid}
+        try:
+            exe = me.exe()
+            parent = me.parent()
+            if parent is not None and parent.pid > 0 and parent.exe() == exe:
+                pids.add(parent.pid)
+                for sibling in parent.children():
+                    try:
+                        if sibling.exe() == exe:
+                            pids.add(sibling.pid)
+                    except psutil.Error:
+                        pass
+        except psutil.Error:
+            pass
+        return pids
+
+    def _own_cgroup(self) -> Path:
+        for line in Path("/proc/self/cgroup").read_text().splitlines():
+            if line.startswith("0::"):
+                own = self.root / line[3:].lstrip("/")
+                # Another worker of this API already moved us into the leaf
+                return own.parent if own.name == "supervisor" else own
+        raise OSError("process is not in a cgroup v2 hierarchy")
+
+    @staticmethod
+    def _enable_controllers(path: Path):
+        (path / "cgroup.subtree_control").write_text(" ".join(f"+{c}" for c in CONTROLLERS))
+
+    def create(self, limits: Optional[ResourceLimits] = None) -> Optional[Path]:
+        """Create a leaf cgroup with ``limits`` applied; None if unavailable"""
+        if not self.available:
+            return None
+        path = self.processes_path / uuid.uuid4().hex[:12]
+        path.mkdir()
+        if limits:
+            self.apply_limits(path, limits)
+        return path
+
+    def apply_limits(self, path: Path, limits: ResourceLimits):
+        if limits.cpu is not None:
+            quota = max(1000, int(limits.cpu * CPU_PERIOD_USEC))
+            (path / "cpu.max").write_text(f"{quota} {CPU_PERIOD_USEC}")
+        if limits.memory_bytes is not None:
+            (path / "memory.max").write_text(str(limits.memory_bytes))
+            # Fail allocations instead of pushing the whole box into swap
+            swap_max = path / "memory.swap.max"
+            if swap_max.exists():
+                swap_max.write_text("0")
+        if limits.pids is not None:
+            (path / "pids.max").write_text(str(limits.pids))
+
+    @staticmethod
+    def gated(command: str) -> List[str]:
+        """argv that runs ``command`` through the shell once its stdin closes.
+
+        Spawn it with ``stdin=PIPE``, ``attach`` the pid, then close stdin:
+        the child is in its cgroup before the command can fork, without a
+        ``preexec_fn`` running Python between fork and exec.
+        """
+        return ["/bin/sh", "-c", _GATE_SCRIPT, command]
+
+    @staticmethod
+    def attach(path: Path, pid: int):
+        """Move ``pid`` into the leaf at ``path``"""
+        (path / "cgroup.procs").write_text(str(pid))
+
+    @staticmethod
+    def usage(path: Path) -> Dict[str, float]:
+        """Read the tree's accumulated CPU time, memory and task count"""
+        usage = {}
+        try:
+            for line in (path / "cpu.stat").read_text().splitlines():
+                key, value = line.split()
+                if key == "usage_usec":
+                    usage["cpu_seconds"] = int(value) / 1e6
+                    break
+            usage["memory_bytes"] = int((path / "memory.current").read_text())
+            peak = path / "memory.peak"
+            if peak.exists():
+                usage["memory_peak_bytes"] = int(peak.read_text())
+            usage["pids"] = int((path / "pids.current").read_text())
+        except (FileNotFoundError, ValueError):
+            pass
+        return usage
+
+    def kill(self, path: Path):
+        """SIGKILL every process in the tree"""
+        kill_file = path / "cgroup.kill"
+        if kill_file.exists():
+            kill_file.write_text("1")
+            return
+        # Kernels before 5.14: kill members until none are left (a fork
+        # racing the first pass is caught by the next one)
+        for _ in range(100):
+            pids = (path / "cgroup.procs").read_text().split()
+            if not pids:
+                return
+            for pid in pids:
+                try:
+                    os.kill(int(pid), signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+            time.sleep(0.01)
+
+    def remove(self, path: Path) -> bool:
+        """Remove an empty leaf; False if processes are still exiting"""
+        try:
+            path.rmdir()
+            return True
+        except FileNotFoundError:
+            return True
+        except OSError:
+            return False
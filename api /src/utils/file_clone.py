@@ -0,0 +1,104 @@
+import errno
+import fcntl
+import os
+import shutil
+import socket
+import time
+import uuid
+from pathlib import Path
+
+# ioctl(dest_fd, FICLONE, src_fd) from linux/fs.h
+FICLONE = 0x40049409
+
+_REFLINK_UNSUPPORTED = {errno.EOPNOTSUPP, errno.EXDEV, errno.EINVAL, errno.ENOTTY, errno.EPERM}
+
+def reflink(src: str, dst: str):
+    """Clone ``src`` to ``dst`` sharing extents (btrfs, XFS, overlay on those)"""
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            os.unlink(dst)
+            raise
+    shutil.copystat(src, dst)
+
+def clone_tree(src: Path, dst: Path) -> str:
+    """Copy a directory tree, sharing file content where the filesystem allows.
+
+    Files are reflinked when the filesystem supports it, which gives true
+    copy-on-write: either side can later be written in place, truncated or
+    chmod-ed without affecting the other. Otherwise every file is copied.
+
+    Returns the method used: "reflink" or "copy".
+    """
+    method = "reflink"
+    for root, dirs, files in os.walk(src):
+        rel_root = Path(root).relative_to(src)
+        target_root = dst / rel_root
+        target_root.mkdir(parents=True, exist_ok=True)
+        shutil.copystat(root, target_root)
+
+        for name in dirs:
+            source = os.path.join(root, name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target_root / name)
+
+        for name in files:
+            source = os.path.join(root, name)
+            target = str(target_root / name)
+            if os.path.islink(source):
+                os.symlink(os.readlink(source), target)
+                continue
+
+            if method == "reflink":
+                try:
+                    reflink(source, target)
+                    continue
+                except OSError as e:
+                    if e.errno not in _REFLINK_UNSUPPORTED:
+                        raise
+                    method = "copy"
+            shutil.copy2(source, target)
+    return method
+
+def staging_dir(parent: Path) -> Path:
+    """A fresh path under ``parent`` for work in progress, named after its owner.
+
+    Several API workers (and containers) may share ``parent``; the name
+    records the host and pid so ``reap_staging`` only removes abandoned work.
+    """
+    return Path(parent) / f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex}"
+
+def reap_staging(parent: Path, max_age: float = 24 * 3600):
+    """Remove entries from ``staging_dir`` whose owner is gone.
+
+    An entry made on this host is removed once its pid has exited; entries
+    from other hosts (or with unparseable names) only after ``max_age`` seconds.
+    """
+    parent = Path(parent)
+    if not parent.is_dir():
+        return
+    hostname = socket.gethostname()
+    now = time.time()
+    for entry in parent.iterdir():
+        host, _, rest = entry.name.rpartition("-")[0].rpartition("-")
+        stale = False
+        if host == hostname and rest.isdigit():
+            stale = not _pid_alive(int(rest))
+        if not stale:
+            try:
+                stale = now - entry.lstat().st_mtime > max_age
+            except FileNotFoundError:
+                continue
+        if stale:
+            shutil.rmtree(entry, ignore_errors=True)
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
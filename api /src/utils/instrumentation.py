@@ -0,0 +1,72 @@
+import time
+from typing import Dict, Tuple
+from utils.monitoring import API_LATENCY, API_REQUESTS, API_TTFB
+
+KNOWN_METHODS = frozenset({"GET", "HEAD", "POST", "PUT", "PATCH", "DELETE", "OPTIONS"})
+UNMATCHED = "unmatched"
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording ``API_REQUESTS``, ``API_LATENCY`` and ``API_TTFB``.
+
+    Requests are labelled with the route template (``/projects/{project_name}``)
+    that FastAPI's router leaves in the scope, never the raw path, and
+    requests matching no route share one ``unmatched`` label. Time to first
+    byte is taken when the first body bytes are sent, so for streaming
+    responses it differs from the total latency, which ends when the
+    response is complete. Labelled metric children are looked up once and
+    cached, keeping the per-request cost to a few microseconds.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._latency: Dict[Tuple[str, str], tuple] = {}  # (endpoint, method) -> (latency, ttfb)
+        self._requests: Dict[Tuple[str, str, int], object] = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        first_byte = 0.0
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal first_byte, status_code
+            message_type = message["type"]
+            if message_type == "http.response.start":
+                status_code = message["status"]
+            elif not first_byte and (message.get("body") or not message.get("more_body", False)):
+                first_byte = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            finished = time.perf_counter()
+            route = scope.get("route")
+            endpoint = getattr(route, "path", None) or UNMATCHED
+            method = scope["method"]
+            if method not in KNOWN_METHODS:
+                method = "OTHER"
+            latency, ttfb = self._latency_children(endpoint, method)
+            latency.observe(finished - started)
+            ttfb.observe((first_byte or finished) - started)
+            self._requests_child(endpoint, method, status_code).inc()
+
+    def _latency_children(self, endpoint: str, method: str) -> tuple:
+        key = (endpoint, method)
+        children = self._latency.get(key)
+        if children is None:
+            children = self._latency[key] = (
+                API_LATENCY.labels(endpoint=endpoint, method=method),
+                API_TTFB.labels(endpoint=endpoint, method=method)
+            )
+        return children
+
+    def _requests_child(self, endpoint: str, method: str, status_code: int):
+        key = (endpoint, method, status_code)
+        child = self._requests.get(key)
+        if child is None:
+            child = self._requests[key] = API_REQUESTS.labels(endpoint=endpoint, method=method, status=str(status_code))
+        return child
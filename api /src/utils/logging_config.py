@@ -1,14 +1,47 @@
 import logging
-from logging.handlers import RotatingFileHandler
-import os
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+import atexit
+import copy
+import queue
+import threading
+import time
 from pathlib import Path
 import json
-from datetime import datetime
+from typing import Dict, List, Optional
+from utils.monitoring import LOG_RECORDS_DROPPED
+
+try:
+    import orjson
+except ImportError:  # Optional; the stdlib encoder is used without it
+    orjson = None
+
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_SIZE = 256
+
+_listeners: List[QueueListener] = []
+
+def _dumps(data: Dict) -> str:
+    if orjson is not None:
+        return orjson.dumps(data, default=str).decode()
+    return json.dumps(data, default=str)
 
 class JSONFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__()
+        self._second = None
+        self._second_text = ""
+
+    def _timestamp(self, created: float) -> str:
+        # Records arrive in time order, so the formatted second is almost always reusable
+        second = int(created)
+        if second != self._second:
+            self._second = second
+            self._second_text = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+        return f"{self._second_text}.{int((created - second) * 1e6):06d}"
+
     def format(self, record):
         log_data = {
-            "timestamp": datetime.utcnow().isoformat(),
+            "timestamp": self._timestamp(record.created),
             "level": record.levelname,
             "message": record.getMessage(),
             "logger": record.name,
@@ -18,55 +51,243 @@ class JSONFormatter(logging.Formatter):
             "thread": record.threadName,
             "process": record.processName
         }
-        
+
         if record.exc_info:
             log_data["exception"] = self.formatException(record.exc_info)
-        
-        return json.dumps(log_data)
+        elif record.exc_text:
+            log_data["exception"] = record.exc_text
+
+        return _dumps(log_data)
+
+class BoundedQueueHandler(QueueHandler):
+    """Hands records to a ``QueueListener`` thread without ever blocking.
+
+    The message is rendered here, since its arguments may change after the
+    call returns, but formatting and I/O happen on the listener. When the
+    queue is full the record is dropped and counted in
+    ``LOG_RECORDS_DROPPED``. Records are first checked against
+    ``rate_limits``; the count of suppressed records is added to the
+    queued copy, never to the record other handlers see.
+    """
+
+    def __init__(self, maxsize: int = LOG_QUEUE_SIZE, rate_limits: Optional[List["RateLimitFilter"]] = None):
+        super().__init__(queue.Queue(maxsize))
+        self.rate_limits = rate_limits or []
+        self.dropped = 0
+
+    def emit(self, record):
+        suppressed = 0
+        for limit in self.rate_limits:
+            admitted = limit.admit(record)
+            if admitted is None:
+                return
+            suppressed += admitted
+        try:
+            queued = self.prepare(record)
+            if suppressed:
+                queued.msg = f"{queued.msg} ({suppressed} similar messages suppressed)"
+            self.enqueue(queued)
+        except Exception:
+            self.handleError(record)
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks keep whole stack frames alive; keep only the text
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.labels(reason="queue_full").inc()
+
+class BatchingQueueListener(QueueListener):
+    """``QueueListener`` that drains up to ``batch_size`` queued records at a time.
+
+    Handlers with ``handle_batch`` (``BatchedRotatingFileHandler``) write
+    each batch with one write and flush; others get records one by one.
+    """
+
+    def __init__(self, queue, *handlers, batch_size: int = LOG_BATCH_SIZE):
+        super().__init__(queue, *handlers, respect_handler_level=True)
+        self.batch_size = batch_size
+
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # Wait for room rather than fail on a full queue
+
+    def _monitor(self):
+        q = self.queue
+        while True:
+            batch = [q.get()]
+            while len(batch) < self.batch_size and batch[-1] is not self._sentinel:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is self._sentinel
+            records = batch[:-1] if stop else batch
+            if records:
+                self.handle_batch(records)
+            for _ in batch:
+                q.task_done()
+            if stop:
+                return
 
-def setup_logging():
+    def handle_batch(self, records: List[logging.LogRecord]):
+        for handler in self.handlers:
+            selected = [record for record in records if record.levelno >= handler.level]
+            if not selected:
+                continue
+            if hasattr(handler, "handle_batch"):
+                handler.handle_batch(selected)
+            else:
+                for record in selected:
+                    handler.handle(record)
+
+class BatchedRotatingFileHandler(RotatingFileHandler):
+    """``RotatingFileHandler`` that writes a batch of records at once.
+
+    The rollover check is done once per batch on the batch's total encoded
+    size, instead of formatting every record twice as ``shouldRollover`` does.
+    """
+
+    def handle_batch(self, records: List[logging.LogRecord]):
+        records = [record for record in records if self.filter(record)]
+        if not records:
+            return
+        try:
+            data = "".join(self.format(record) + self.terminator for record in records)
+        except Exception:
+            self.handleError(records[0])
+            return
+        self.acquire()
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            size = len(data) if data.isascii() else len(data.encode(self.encoding or "utf-8", self.errors or "strict"))
+            if self.maxBytes > 0 and self.stream.tell() > 0 and self.stream.tell() + size >= self.maxBytes:
+                self.doRollover()
+            self.stream.write(data)
+            self.stream.flush()
+        except Exception:
+            self.handleError(records[0])
+        finally:
+            self.release()
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most ``rate`` records per second per logger (bursts of ``burst``).
+
+    Applies to loggers named by ``prefixes`` (and their children); warnings
+    and errors always pass. Suppressed records count towards
+    ``LOG_RECORDS_DROPPED``; ``admit`` returns how many were suppressed
+    before a record that gets through, for ``BoundedQueueHandler`` to report
+    in its copy of that record.
+    """
+
+    def __init__(self, prefixes: List[str], rate: float, burst: Optional[float] = None):
+        super().__init__()
+        self.prefixes = tuple(prefixes)
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._buckets: Dict[str, List[float]] = {}  # logger -> [tokens, last update, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        return self.admit(record) is not None
+
+    def admit(self, record) -> Optional[int]:
+        """None if ``record`` is suppressed, else the number suppressed since the last one let through"""
+        if record.levelno >= logging.WARNING or not self._applies(record.name):
+            return 0
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(record.name)
+            if bucket is None:
+                bucket = self._buckets[record.name] = [self.burst, now, 0]
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                LOG_RECORDS_DROPPED.labels(reason="rate_limited").inc()
+                return None
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        return int(suppressed)
+
+    def _applies(self, name: str) -> bool:
+        return any(name == prefix or name.startswith(prefix + ".") for prefix in self.prefixes)
+
+def _queue_logger(logger: logging.Logger, handlers: List[logging.Handler], queue_size: int,
+                  rate_limits: Dict[str, float]) -> QueueListener:
+    queue_handler = BoundedQueueHandler(
+        queue_size, [RateLimitFilter([prefix], rate) for prefix, rate in rate_limits.items()]
+    )
+    listener = BatchingQueueListener(queue_handler.queue, *handlers)
+    logger.addHandler(queue_handler)
+    listener.start()
+    _listeners.append(listener)
+    return listener
+
+def setup_logging(queue_size: int = LOG_QUEUE_SIZE, rate_limits: Optional[Dict[str, float]] = None):
+    """Configure logging; records are written by background listener threads.
+
+    Loggers only enqueue (see ``BoundedQueueHandler``). ``rate_limits``
+    maps noisy logger names to the records per second to keep from each.
+    """
     log_dir = Path("/app/logs")
     log_dir.mkdir(exist_ok=True)
-    
+    rate_limits = rate_limits or {}
+
     # Main logger
     logger = logging.getLogger()
     logger.setLevel(logging.INFO)
-    
+
     # Console handler
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
     console_handler.setFormatter(logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
     ))
-    logger.addHandler(console_handler)
-    
+
     # File handler (JSON)
-    file_handler = RotatingFileHandler(
+    file_handler = BatchedRotatingFileHandler(
         log_dir / "api.log",
         maxBytes=10*1024*1024,  # 10MB
         backupCount=5
     )
     file_handler.setLevel(logging.INFO)
     file_handler.setFormatter(JSONFormatter())
-    logger.addHandler(file_handler)
-    
+
     # Error file handler
-    error_handler = RotatingFileHandler(
+    error_handler = BatchedRotatingFileHandler(
         log_dir / "errors.log",
         maxBytes=5*1024*1024,  # 5MB
         backupCount=3
     )
     error_handler.setLevel(logging.ERROR)
     error_handler.setFormatter(JSONFormatter())
-    logger.addHandler(error_handler)
-    
+    _queue_logger(logger, [console_handler, file_handler, error_handler], queue_size, rate_limits)
+
     # Access logs
     access_logger = logging.getLogger("api.access")
-    access_handler = RotatingFileHandler(
+    access_handler = BatchedRotatingFileHandler(
         log_dir / "access.log",
         maxBytes=10*1024*1024,
         backupCount=3
     )
     access_handler.setFormatter(JSONFormatter())
-    access_logger.addHandler(access_handler)
+    _queue_logger(access_logger, [access_handler], queue_size, rate_limits)
     access_logger.propagate = False
+
+def shutdown_logging():
+    """Write out queued records and stop the listener threads"""
+    while _listeners:
+        _listeners.pop().stop()
+
+atexit.register(shutdown_logging)
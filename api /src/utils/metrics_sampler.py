@@ -0,0 +1,175 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+import psutil
+from models.metrics import HostMetrics, MetricsSnapshot, ResourceUsage
+from utils.monitoring import PROJECT_CPU_USAGE, PROJECT_MEMORY_BYTES, SYSTEM_CPU_USAGE, SYSTEM_MEMORY_USAGE
+
+_PROCESS_ATTRS = ["pid", "ppid", "cwd", "create_time", "cpu_times", "memory_info", "num_fds", "io_counters"]
+
+class MetricsSampler:
+    """Samples host, per-project and per-process resource usage on a background thread.
+
+    Every ``interval`` seconds one pass over the process table produces a
+    ``MetricsSnapshot``: host CPU and memory, usage summed per project
+    (processes whose working directory is under ``projects_root``) and per
+    process tree tracked by the ``ProcessManager``. CPU percentages are
+    computed from the change in CPU time since the previous pass, so the
+    thread first takes a baseline and publishes nothing until a second pass
+    about a second later. Readers
+    such as ``/health`` get the latest snapshot by reference; the system
+    and project gauges, and the manager's per-process usage (see
+    ``ProcessManager.record_usage``), are updated once per pass. Projects
+    that are gone are set to zero rather than removed, since removing a
+    series does not reach other workers' values in multiprocess mode.
+    """
+
+    def __init__(self, interval: float = 5.0, projects_root: str = "/app/projects"):
+        self.interval = interval
+        self.projects_root = os.path.normpath(projects_root)
+        self.logger = logging.getLogger(__name__)
+        self.process_manager = None
+        self._snapshot: Optional[MetricsSnapshot] = None
+        self._cpu_times: Dict[int, Tuple[float, float, float]] = {}  # pid -> (create time, cpu seconds, when)
+        self._projects: Set[str] = set()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def snapshot(self) -> Optional[MetricsSnapshot]:
+        return self._snapshot
+
+    def start(self, process_manager=None):
+        """Start sampling in the background; the first sample is taken on the thread"""
+        self.process_manager = process_manager
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        try:
+            self._prime()
+        except Exception as e:
+            self.logger.error(f"Metrics sampling failed: {str(e)}")
+        if self._stop.wait(min(self.interval, 1.0)):
+            return
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                self.logger.error(f"Metrics sampling failed: {str(e)}")
+            if self._stop.wait(self.interval):
+                return
+
+    def _prime(self):
+        """Take the CPU baseline that the first published pass is measured against"""
+        psutil.cpu_percent(None)  # Start the host CPU measurement interval
+        now = time.monotonic()
+        cpu_times = {}
+        for process in psutil.process_iter(["pid", "create_time", "cpu_times"], ad_value=None):
+            info = process.info
+            if info["cpu_times"] is not None:
+                cpu_times[info["pid"]] = (info["create_time"], info["cpu_times"].user + info["cpu_times"].system, now)
+        self._cpu_times = cpu_times
+
+    def sample(self) -> MetricsSnapshot:
+        """Collect and publish a new snapshot"""
+        now = time.monotonic()
+        usage: Dict[int, Dict] = {}
+        children: Dict[int, List[int]] = {}
+        projects: Dict[str, Dict] = {}
+        cpu_times = {}
+
+        for process in psutil.process_iter(_PROCESS_ATTRS, ad_value=None):
+            info = process.info
+            pid = info["pid"]
+            if info["ppid"] != pid:
+                children.setdefault(info["ppid"], []).append(pid)
+            cpu_percent = 0.0
+            if info["cpu_times"] is not None:
+                cpu = info["cpu_times"].user + info["cpu_times"].system
+                previous = self._cpu_times.get(pid)
+                if previous is not None and previous[0] == info["create_time"] and now > previous[2]:
+                    cpu_percent = max(0.0, (cpu - previous[1]) / (now - previous[2]) * 100)
+                cpu_times[pid] = (info["create_time"], cpu, now)
+            io = info["io_counters"]
+            usage[pid] = {
+                "cpu_percent": cpu_percent,
+                "cpu_seconds": cpu_times[pid][1] if pid in cpu_times else 0.0,
+                "memory_bytes": info["memory_info"].rss if info["memory_info"] else 0,
+                "open_fds": info["num_fds"] or 0,
+                "io_read_bytes": io.read_bytes if io else 0,
+                "io_write_bytes": io.write_bytes if io else 0,
+                "processes": 1
+            }
+            project = self._project_of(info["cwd"])
+            if project is not None:
+                self._add(projects.setdefault(project, {}), usage[pid])
+        self._cpu_times = cpu_times
+
+        trees = {}
+        if self.process_manager is not None:
+            for tracked in self.process_manager.list_processes():
+                if tracked.status == "running" and tracked.pid in usage:
+                    trees[tracked.pid] = self._tree_usage(tracked.pid, usage, children)
+
+        memory = psutil.virtual_memory()
+        snapshot = MetricsSnapshot(
+            sampled_at=datetime.now(),
+            host=HostMetrics(
+                cpu_percent=psutil.cpu_percent(None),
+                memory_percent=memory.percent,
+                memory_used_bytes=memory.used,
+                memory_total_bytes=memory.total,
+                load_average=list(os.getloadavg())
+            ),
+            projects={name: ResourceUsage(**totals) for name, totals in projects.items()},
+            processes={pid: ResourceUsage(**totals) for pid, totals in trees.items()}
+        )
+        self._snapshot = snapshot
+        self._export(snapshot)
+        if self.process_manager is not None:
+            self.process_manager.record_usage(snapshot)
+        return snapshot
+
+    def _project_of(self, cwd: Optional[str]) -> Optional[str]:
+        if not cwd or not cwd.startswith(self.projects_root + os.sep):
+            return None
+        return cwd[len(self.projects_root) + 1:].split(os.sep, 1)[0]
+
+    @staticmethod
+    def _add(totals: Dict, usage: Dict):
+        for key, value in usage.items():
+            totals[key] = totals.get(key, 0) + value
+
+    def _tree_usage(self, root: int, usage: Dict[int, Dict], children: Dict[int, List[int]]) -> Dict:
+        totals: Dict = {}
+        stack = [root]
+        while stack:
+            pid = stack.pop()
+            if pid in usage:
+                self._add(totals, usage[pid])
+            stack.extend(children.get(pid, ()))
+        return totals
+
+    def _export(self, snapshot: MetricsSnapshot):
+        SYSTEM_CPU_USAGE.set(snapshot.host.cpu_percent)
+        SYSTEM_MEMORY_USAGE.set(snapshot.host.memory_percent)
+        for name, project in snapshot.projects.items():
+            PROJECT_CPU_USAGE.labels(project=name).set(project.cpu_percent)
+            PROJECT_MEMORY_BYTES.labels(project=name).set(project.memory_bytes)
+        for name in self._projects - snapshot.projects.keys():
+            PROJECT_CPU_USAGE.labels(project=name).set(0)
+            PROJECT_MEMORY_BYTES.labels(project=name).set(0)
+        self._projects = set(snapshot.projects)
@@ -1,6 +1,11 @@
-from prometheus_client import start_http_server, Counter, Gauge, Histogram
-import psutil
-import asyncio
+import fcntl
+import os
+import tempfile
+from prometheus_client import start_http_server, CollectorRegistry, Counter, Gauge, Histogram, multiprocess
+
+# Set (and emptied before the server starts) when several workers share one
+# exporter; prometheus_client then keeps each worker's values in this directory
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
 
 # Metrics definitions
 API_REQUESTS = Counter(
@@ -15,34 +20,129 @@ API_LATENCY = Histogram(
     ['endpoint', 'method']
 )
 
+API_TTFB = Histogram(
+    'api_request_ttfb_seconds',
+    'Time until the first response body bytes are sent, in seconds',
+    ['endpoint', 'method']
+)
+
 SYSTEM_CPU_USAGE = Gauge(
     'system_cpu_usage_percent',
-    'Current system CPU usage percent'
+    'Current system CPU usage percent',
+    multiprocess_mode='livemax'
 )
 
 SYSTEM_MEMORY_USAGE = Gauge(
     'system_memory_usage_percent',
-    'Current system memory usage percent'
+    'Current system memory usage percent',
+    multiprocess_mode='livemax'
+)
+
+PROJECT_CPU_USAGE = Gauge(
+    'project_cpu_usage_percent',
+    'CPU usage of processes running in a project directory, percent of one core',
+    ['project'],
+    multiprocess_mode='livemax'
+)
+
+PROJECT_MEMORY_BYTES = Gauge(
+    'project_memory_bytes',
+    'Resident memory of processes running in a project directory',
+    ['project'],
+    multiprocess_mode='livemax'
 )
 
 PROCESS_COUNT = Gauge(
     'running_processes_count',
-    'Number of currently running processes'
-)
-
-def start_monitoring(port=8001):
-    """Start Prometheus metrics server"""
-    start_http_server(port)
-    
-async def update_system_metrics():
-    """Update system metrics periodically"""
-    while True:
-        # Get CPU usage
-        cpu_percent = psutil.cpu_percent()
-        SYSTEM_CPU_USAGE.set(cpu_percent)
-        
-        # Get memory usage
-        mem = psutil.virtual_memory()
-        SYSTEM_MEMORY_USAGE.set(mem.percent)
-        
-        await asyncio.sleep(5)
+    'Number of currently running processes',
+    multiprocess_mode='livesum'
+)
+
+DEPENDENCY_CACHE_HITS = Counter(
+    'dependency_cache_hits_total',
+    'Packages served from the shared package cache',
+    ['language']
+)
+
+DEPENDENCY_CACHE_MISSES = Counter(
+    'dependency_cache_misses_total',
+    'Packages downloaded because they were not in the shared package cache',
+    ['language']
+)
+
+DEPENDENCY_CACHE_SIZE = Gauge(
+    'dependency_cache_size_bytes',
+    'Size of the shared package cache after the last eviction pass',
+    multiprocess_mode='livemax'
+)
+
+PROCESS_CPU_SECONDS = Gauge(
+    'managed_process_cpu_seconds',
+    'CPU time used by a managed process tree (from its cgroup, else its live processes)',
+    ['pid'],
+    multiprocess_mode='livesum'
+)
+
+PROCESS_MEMORY_BYTES = Gauge(
+    'managed_process_memory_bytes',
+    'Memory charged to a managed process tree (from its cgroup, else summed RSS)',
+    ['pid'],
+    multiprocess_mode='livesum'
+)
+
+PROCESS_PIDS = Gauge(
+    'managed_process_pids',
+    'Number of tasks in a managed process tree (from its cgroup, else its live processes)',
+    ['pid'],
+    multiprocess_mode='livesum'
+)
+
+LOG_RECORDS_DROPPED = Counter(
+    'log_records_dropped_total',
+    'Log records discarded before being written',
+    ['reason']
+)
+
+EVENT_LOOP_LAG = Histogram(
+    'event_loop_lag_seconds',
+    'How late event loop heartbeat callbacks ran, in seconds',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+
+EVENT_LOOP_STALLS = Counter(
+    'event_loop_stalls_total',
+    'Times a callback held the event loop longer than the stall threshold'
+)
+
+_exporter_lock = None
+
+def start_monitoring(port=8001) -> bool:
+    """Start the Prometheus metrics server, unless another worker already serves it.
+
+    The first worker to take the exporter lock serves ``port`` for its
+    lifetime; with ``PROMETHEUS_MULTIPROC_DIR`` it exports the metrics of
+    all workers. Returns whether this worker serves the metrics.
+    """
+    global _exporter_lock
+    if _exporter_lock is not None:
+        return True
+    lock_path = os.path.join(MULTIPROC_DIR or tempfile.gettempdir(), f".metrics-exporter-{port}.lock")
+    lock = open(lock_path, "a")
+    try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return False
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        start_http_server(port, registry=registry)
+    else:
+        start_http_server(port)
+    _exporter_lock = lock
+    return True
+
+def stop_monitoring():
+    """Drop this worker's live gauge values from the shared metrics"""
+    if MULTIPROC_DIR:
+        multiprocess.mark_process_dead(os.getpid())
@@ -0,0 +1,209 @@
+import asyncio
+import os
+import threading
+from pathlib import Path
+from typing import AsyncIterator, Optional, Set, Tuple
+
+_LAGGED = object()
+
+class _Follower:
+    def __init__(self, loop: asyncio.AbstractEventLoop, max_chunks: int):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=max_chunks)
+
+    def deliver(self, item):
+        """Runs on the follower's loop"""
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            # Too far behind for the live feed: drop it and re-read from disk
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(_LAGGED)
+
+class ProcessLog:
+    """Append-only, size-capped output log of one process, with live followers.
+
+    Output is written to ``{path}`` and, once that exceeds half of
+    ``max_bytes``, the file is rotated to ``{path}.1`` (replacing the
+    previous one), so at most ``max_bytes`` are kept on disk. Positions are
+    logical byte offsets since the process started; reads seek into
+    whichever segment holds the offset, and offsets that were rotated away
+    resume at the oldest byte still kept.
+
+    ``append`` is called by the single thread draining the process's pipes.
+    Each chunk is written once and the same bytes object is handed to every
+    follower's queue, so followers never copy or re-read live output. A
+    follower that falls ``max_chunks`` behind catches up from disk instead.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 10 * 1024 * 1024, max_chunks: int = 256):
+        self.path = Path(path)
+        self.old_path = self.path.with_name(self.path.name + ".1")
+        self.segment_bytes = max(1, max_bytes // 2)
+        self.max_chunks = max_chunks
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o640)
+        self._segment_start = 0  # Logical offset of the first byte of ``path``
+        self._old_start: Optional[int] = None  # ... and of ``path.1``, if any
+        self._end = 0
+        self._closed = False
+        self._followers: Set[_Follower] = set()
+
+    @property
+    def end_offset(self) -> int:
+        return self._end
+
+    @property
+    def start_offset(self) -> int:
+        with self._lock:
+            return self._segment_start if self._old_start is None else self._old_start
+
+    def append(self, data: bytes):
+        with self._lock:
+            if self._closed:
+                return
+            os.write(self._fd, data)
+            offset = self._end
+            self._end += len(data)
+            if self._end - self._segment_start >= self.segment_bytes:
+                self._rotate()
+            followers = list(self._followers)
+        self._notify(followers, (offset, data))
+
+    def close(self):
+        """Mark the log complete; followers finish once they have read everything"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            os.close(self._fd)
+            followers = list(self._followers)
+        self._notify(followers, None)
+
+    def _notify(self, followers, item):
+        for follower in followers:
+            try:
+                follower.loop.call_soon_threadsafe(follower.deliver, item)
+            except RuntimeError:
+                # The follower's loop was closed without it unsubscribing
+                with self._lock:
+                    self._followers.discard(follower)
+
+    def remove(self):
+        self.close()
+        for path in (self.path, self.old_path):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def _rotate(self):
+        os.close(self._fd)
+        os.replace(self.path, self.old_path)
+        self._old_start = self._segment_start
+        self._segment_start = self._end
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o640)
+
+    def read(self, offset: int, size: int = 64 * 1024) -> Tuple[bytes, int]:
+        """Read up to ``size`` bytes from ``offset``; returns (data, next offset)"""
+        with self._lock:
+            segments = [(self._segment_start, self.path)]
+            if self._old_start is not None:
+                segments.insert(0, (self._old_start, self.old_path))
+            end = self._end
+            # Open under the lock so a concurrent rotation cannot swap files
+            # between choosing a segment and opening it
+            offset = max(offset, segments[0][0])
+            files = []
+            for start, path in segments:
+                try:
+                    files.append((start, open(path, "rb")))
+                except FileNotFoundError:
+                    pass
+
+        chunks = []
+        try:
+            for i, (start, f) in enumerate(files):
+                next_start = files[i + 1][0] if i + 1 < len(files) else end
+                if offset < start or offset >= next_start:
+                    continue
+                f.seek(offset - start)
+                data = f.read(min(size, next_start - offset))
+                chunks.append(data)
+                offset += len(data)
+                size -= len(data)
+                if size <= 0:
+                    break
+        finally:
+            for _, f in files:
+                f.close()
+        return b"".join(chunks) if len(chunks) != 1 else chunks[0], offset
+
+    def tail_offset(self, lines: int) -> int:
+        """Offset at which the last ``lines`` lines start, scanning backwards"""
+        start = self.start_offset
+        end = self.end_offset
+        if lines <= 0:
+            return end
+        position = end
+        newlines = 0
+        block = 8192
+        while position > start:
+            read_from = max(start, position - block)
+            data, _ = self.read(read_from, position - read_from)
+            # A trailing newline terminates the last line rather than starting one
+            scan_end = len(data) - 1 if position == end and data.endswith(b"\n") else len(data)
+            index = scan_end
+            while True:
+                index = data.rfind(b"\n", 0, index)
+                if index < 0:
+                    break
+                newlines += 1
+                if newlines == lines:
+                    return read_from + index + 1
+            position = read_from
+        return start
+
+    async def follow(self, offset: int) -> AsyncIterator[bytes]:
+        """Yield output from ``offset`` onwards, then live output until the log is closed"""
+        loop = asyncio.get_running_loop()
+        follower = _Follower(loop, self.max_chunks)
+        with self._lock:
+            self._followers.add(follower)
+            caught_up_to = self._end
+            closed = self._closed
+
+        try:
+            while True:
+                # Output written before subscribing (or missed while lagging) comes from disk
+                while offset < caught_up_to:
+                    data, next_offset = await loop.run_in_executor(None, self.read, offset)
+                    if not data:
+                        break
+                    offset = next_offset
+                    yield data
+                if closed:
+                    return
+
+                item = await follower.queue.get()
+                if item is None:
+                    closed = True
+                    caught_up_to = self._end
+                elif item is _LAGGED:
+                    caught_up_to = self._end
+                else:
+                    chunk_offset, data = item
+                    if chunk_offset + len(data) <= offset:
+                        continue  # Already read from disk
+                    if chunk_offset > offset:
+                        caught_up_to = chunk_offset + len(data)  # Gap: fill from disk
+                        continue
+                    yield data if chunk_offset == offset else data[offset - chunk_offset:]
+                    offset = chunk_offset + len(data)
+                    caught_up_to = offset
+        finally:
+            with self._lock:
+                self._followers.discard(follower)
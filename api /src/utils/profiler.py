@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+from collections import Counter, deque
+from pathlib import Path
+from typing import Dict, List, Optional
+from utils.monitoring import EVENT_LOOP_LAG, EVENT_LOOP_STALLS
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})"
+
+def _stack(frame) -> List[str]:
+    """Frame labels from the outermost call to ``frame``"""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return labels
+
+class SamplingProfiler:
+    """Samples the stacks of all threads at a fixed interval.
+
+    Runs on its own thread and reads ``sys._current_frames()``, so the
+    profiled code is not instrumented and pays only for the sampling
+    thread's GIL time. Only one profile runs at a time.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._running = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self._running.locked()
+
+    def sample(self, duration: float, interval: Optional[float] = None) -> Counter:
+        """Sample for ``duration`` seconds; returns a count per collapsed stack"""
+        interval = interval or self.interval
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("A profile is already running")
+        try:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            own = threading.get_ident()
+            counts = Counter()
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                for ident, frame in sys._current_frames().items():
+                    if ident == own:
+                        continue
+                    if ident not in names:
+                        names = {thread.ident: thread.name for thread in threading.enumerate()}
+                    thread_name = names.get(ident, str(ident)).replace(";", ":")
+                    counts[";".join([thread_name] + _stack(frame))] += 1
+                time.sleep(interval)
+            return counts
+        finally:
+            self._running.release()
+
+    async def profile(self, duration: float, interval: Optional[float] = None) -> Counter:
+        """``sample`` on a thread of its own, leaving the default executor free"""
+        loop = asyncio.get_running_loop()
+        result = loop.create_future()
+
+        def deliver(value, error):
+            if result.done():
+                return  # The awaiting request was cancelled
+            if error is not None:
+                result.set_exception(error)
+            else:
+                result.set_result(value)
+
+        def run():
+            try:
+                value, error = self.sample(duration, interval), None
+            except Exception as e:
+                value, error = None, e
+            try:
+                loop.call_soon_threadsafe(deliver, value, error)
+            except RuntimeError:
+                pass  # The loop closed while sampling
+
+        threading.Thread(target=run, name="sampling-profiler", daemon=True).start()
+        return await result
+
+    @staticmethod
+    def collapsed(counts: Counter) -> str:
+        """Render counts in the collapsed format read by flamegraph.pl and speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in counts.most_common())
+
+class LoopLagMonitor:
+    """Measures event loop lag and captures what is blocking the loop.
+
+    A callback on the loop stamps a heartbeat every ``interval`` seconds;
+    how late each stamp runs is observed in ``EVENT_LOOP_LAG``. A watchdog
+    thread checks the heartbeat, and when the loop has not stamped it for
+    ``threshold`` seconds it records the stack of the loop's thread, i.e.
+    the callback currently holding the loop. The last ``max_stalls`` stalls
+    are kept, with their final duration, for ``stalls()``.
+    """
+
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, max_stalls: int = 50):
+        self.threshold = threshold
+        self.interval = interval
+        self.logger = logging.getLogger(__name__)
+        self._stalls: deque = deque(maxlen=max_stalls)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._last_tick = 0.0
+        self._current_stall: Optional[Dict] = None
+        self._stall_started = 0.0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+
+    def start(self):
+        """Start monitoring the running loop; call from the loop's thread"""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stop.clear()
+        self._handle = self._loop.call_later(self.interval, self._tick, self._last_tick + self.interval)
+        self._watchdog = threading.Thread(target=self._watch, name="loop-lag-watchdog", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _tick(self, due: float):
+        now = time.monotonic()
+        EVENT_LOOP_LAG.observe(max(0.0, now - due))
+        with self._lock:
+            self._last_tick = now
+            if self._current_stall is not None:
+                self._current_stall["duration"] = round(now - self._stall_started, 6)
+                self._current_stall = None
+        if not self._stop.is_set():
+            self._handle = self._loop.call_later(self.interval, self._tick, now + self.interval)
+
+    def _watch(self):
+        while not self._stop.wait(self.threshold / 2):
+            with self._lock:
+                stalled_for = time.monotonic() - self._last_tick - self.interval
+                if stalled_for < self.threshold or self._current_stall is not None:
+                    continue
+                frame = sys._current_frames().get(self._loop_thread)
+                self._stall_started = self._last_tick + self.interval
+                stall = {
+                    "detected_at": time.time(),
+                    "duration": None,  # Filled in once the loop runs again
+                    "stack": _stack(frame) if frame is not None else []
+                }
+                self._current_stall = stall
+                self._stalls.append(stall)
+            EVENT_LOOP_STALLS.inc()
+            self.logger.warning(
+                f"Event loop blocked for over {self.threshold * 1000:.0f} ms in {stall['stack'][-1] if stall['stack'] else '?'}"
+            )
+
+    def stalls(self) -> List[Dict]:
+        """Recent stalls, newest first; ``duration`` is None while one is ongoing"""
+        with self._lock:
+            return [dict(stall) for stall in reversed(self._stalls)]
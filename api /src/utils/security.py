@@ -1,4 +1,12 @@
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from typing import Dict, Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 
@@ -7,7 +15,13 @@ SECRET_KEY = "d1b4a8f3c7e92a5b6f0e8d7c6b5a493f2e1d0c9b8a7f6e5d4c3b2a1f0e9d8c"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+TOKEN_CACHE_SIZE = 10000
+# bcrypt releases the GIL, so threads hash in parallel; the cap keeps a login
+# burst from taking every core away from request handling
+PASSWORD_HASH_WORKERS = max(1, min(4, (os.cpu_count() or 1) // 2))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+_password_pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -15,6 +29,58 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password, hashed_password) -> bool:
+    """``verify_password`` on the bcrypt pool, keeping the event loop free"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_pool, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_pool, get_password_hash, password)
+
+class TokenCache:
+    """LRU cache of verified token payloads, keyed by the token's SHA-256.
+
+    Entries expire with the token's ``exp`` claim, so a cached token is
+    never accepted past the point ``jwt.decode`` would reject it.
+    """
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()  # digest -> (payload, exp)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, digest: bytes) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            payload, exp = entry
+            if exp is not None and exp <= time.time():
+                del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return dict(payload)
+
+    def put(self, digest: bytes, payload: Dict):
+        exp = payload.get("exp")
+        with self._lock:
+            self._entries[digest] = (dict(payload), float(exp) if exp is not None else None)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+token_cache = TokenCache()
+
 def create_access_token(data: dict, expires_delta: timedelta = None):
     to_encode = data.copy()
     if expires_delta:
@@ -26,8 +92,14 @@ def create_access_token(data: dict, expires_delta: timedelta = None):
     return encoded_jwt
 
 def decode_token(token: str):
+    """Verified payload of ``token``, or None; repeat tokens skip the signature check"""
+    digest = hashlib.sha256(token.encode()).digest()
+    payload = token_cache.get(digest)
+    if payload is not None:
+        return payload
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
     except JWTError:
         return None
+    token_cache.put(digest, payload)
+    return payload
@@ -1,39 +1,129 @@
 from fastapi import Request, HTTPException
+from fastapi.responses import JSONResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from starlette.middleware.base import BaseHTTPMiddleware
-from typing import Optional
+from collections import OrderedDict
+from typing import List, Optional
+import logging
+import math
 import time
-from jose import jwt
-from jose.exceptions import JWTError
+from utils.security import decode_token
+
+# Token bucket in one atomic step, timed by the Redis server's clock so all
+# workers and nodes agree. Returns {allowed, milliseconds until a token is free}.
+TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil or ts == nil then
+    tokens = capacity
+    ts = now
+end
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = math.ceil((1 - tokens) / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], ttl)
+return {allowed, wait}
+"""
 
 class RateLimiter:
-    def __init__(self, max_requests: int, time_window: int):
+    """Token-bucket rate limit per client IP.
+
+    Each client may burst up to ``max_requests`` and is refilled at
+    ``max_requests / time_window`` per second, so there is no window edge
+    at which twice the limit gets through. Buckets live in an LRU-ordered
+    dict; a bucket idle for ``time_window`` is full again and is dropped,
+    and at most ``max_clients`` are kept, so memory stays bounded. All of
+    this runs on the event loop without awaiting, so it needs no lock.
+
+    With ``redis_conn`` (a ``redis.asyncio`` client) the buckets are kept
+    in Redis instead and each check is one Lua script call, enforcing one
+    limit across all workers and nodes. The client must have a
+    ``socket_timeout`` of at most ``max_redis_timeout`` seconds, so a hung
+    Redis delays a request by no more than that. After a failure the local
+    buckets are used, and Redis is not tried again for ``redis_retry_after``
+    seconds.
+    """
+
+    def __init__(self, max_requests: int, time_window: int, redis_conn=None,
+                 max_clients: int = 100_000, key_prefix: str = "ratelimit:",
+                 max_redis_timeout: float = 0.5, redis_retry_after: float = 5.0):
         self.max_requests = max_requests
         self.time_window = time_window
-        self.access_records = {}
+        self.rate = max_requests / time_window  # Tokens per second
+        self.max_clients = max_clients
+        self.key_prefix = key_prefix
+        self.logger = logging.getLogger(__name__)
+        self.buckets: "OrderedDict[str, List[float]]" = OrderedDict()  # ip -> [tokens, last update]
+        self.redis = redis_conn
+        self.redis_retry_after = redis_retry_after
+        self._script = None
+        if redis_conn is not None:
+            timeout = redis_conn.connection_pool.connection_kwargs.get("socket_timeout")
+            if timeout is None or timeout > max_redis_timeout:
+                raise ValueError(f"Rate limiter Redis client needs a socket_timeout of at most {max_redis_timeout}s")
+            self._script = redis_conn.register_script(TOKEN_BUCKET_SCRIPT)
+        self._redis_down = False
+        self._redis_retry_at = 0.0
 
-    async def check_rate_limit(self, client_ip: str):
-        current_time = time.time()
-        
-        if client_ip not in self.access_records:
-            self.access_records[client_ip] = {
-                "count": 1,
-                "start_time": current_time
-            }
-            return True
-        
-        record = self.access_records[client_ip]
-        
-        if current_time - record["start_time"] > self.time_window:
-            record["count"] = 1
-            record["start_time"] = current_time
-            return True
-        
-        if record["count"] >= self.max_requests:
-            return False
-        
-        record["count"] += 1
-        return True
+    async def check_rate_limit(self, client_ip: str) -> bool:
+        return await self.hit(client_ip) == 0
+
+    async def hit(self, client_ip: str) -> float:
+        """Take a token for ``client_ip``; returns 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        if self._script is not None and now >= self._redis_retry_at:
+            try:
+                allowed, wait_ms = await self._script(
+                    keys=[self.key_prefix + client_ip],
+                    args=[self.max_requests, self.rate / 1000, int(self.time_window * 1000)]
+                )
+                if self._redis_down:
+                    self._redis_down = False
+                    self.logger.info("Rate limiter reconnected to Redis")
+                return 0.0 if allowed else int(wait_ms) / 1000
+            except Exception as e:
+                now = time.monotonic()
+                self._redis_retry_at = now + self.redis_retry_after
+                if not self._redis_down:
+                    self._redis_down = True
+                    self.logger.warning(f"Rate limiter falling back to local buckets: {str(e)}")
+        return self._hit_local(client_ip, now)
+
+    def _hit_local(self, client_ip: str, now: float) -> float:
+        bucket = self.buckets.get(client_ip)
+        if bucket is None:
+            bucket = self.buckets[client_ip] = [float(self.max_requests), now]
+        else:
+            self.buckets.move_to_end(client_ip)
+            bucket[0] = min(self.max_requests, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+        self._evict(now)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / self.rate
+
+    def _evict(self, now: float):
+        buckets = self.buckets
+        while buckets:
+            ip, (_, last) = next(iter(buckets.items()))
+            if now - last < self.time_window and len(buckets) <= self.max_clients:
+                break
+            del buckets[ip]
 
 class JWTBearer(HTTPBearer):
     def __init__(self, auto_error: bool = True):
@@ -50,18 +140,13 @@ class JWTBearer(HTTPBearer):
                 detail="Invalid authentication scheme"
             )
             
-        try:
-            payload = jwt.decode(
-                credentials.credentials,
-                "your-secret-key",
-                algorithms=["HS256"]
-            )
-            return payload
-        except JWTError:
+        payload = decode_token(credentials.credentials)
+        if payload is None:
             raise HTTPException(
                 status_code=403,
                 detail="Invalid or expired token"
             )
+        return payload
 
 class SecurityMiddleware(BaseHTTPMiddleware):
     def __init__(self, app, rate_limiter: RateLimiter):
@@ -71,19 +156,22 @@ class SecurityMiddleware(BaseHTTPMiddleware):
     async def dispatch(self, request: Request, call_next):
         client_ip = request.client.host
         
-        if not await self.rate_limiter.check_rate_limit(client_ip):
-            raise HTTPException(
+        retry_after = await self.rate_limiter.hit(client_ip)
+        if retry_after:
+            # Exceptions raised here bypass FastAPI's handlers, so respond directly
+            return JSONResponse(
                 status_code=429,
-                detail="Too many requests"
+                content={"detail": "Too many requests"},
+                headers={"Retry-After": str(math.ceil(retry_after))}
             )
         
         # Check for API key in headers for certain endpoints
         if request.url.path.startswith("/api/"):
             api_key = request.headers.get("X-API-KEY")
             if not api_key or api_key != "your-api-key":
-                raise HTTPException(
+                return JSONResponse(
                     status_code=401,
-                    detail="Invalid API key"
+                    content={"detail": "Invalid API key"}
                 )
         
         response = await call_next(request)
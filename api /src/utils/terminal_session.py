@@ -0,0 +1,290 @@
+import asyncio
+import fcntl
+import logging
+import os
+import pty
+import re
+import signal
+import struct
+import subprocess
+import termios
+import time
+from collections import deque
+from typing import Dict, Optional, Set
+
+# Names of a project's terminal sessions (the part after "{project}/" in a key)
+SESSION_NAME = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+class SessionLimitReached(Exception):
+    """The project, or the server, already has its maximum number of attached sessions"""
+
+def _set_controlling_tty():
+    """Make the PTY slave (already on stdin) the child's controlling terminal"""
+    fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+class ScrollbackBuffer:
+    """Fixed-size ring of recent terminal output, replayed on attach"""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._chunks = deque()
+        self._size = 0
+
+    def append(self, data: bytes):
+        self._chunks.append(data)
+        self._size += len(data)
+        while self._size > self.max_bytes:
+            excess = self._size - self.max_bytes
+            head = self._chunks[0]
+            if len(head) <= excess:
+                self._chunks.popleft()
+                self._size -= len(head)
+            else:
+                self._chunks[0] = head[excess:]
+                self._size -= excess
+
+    def snapshot(self) -> bytes:
+        return b"".join(self._chunks)
+
+class TerminalSession:
+    """A bash shell on a pseudo-terminal, shared by any number of viewers.
+
+    The PTY master fd is registered with the event loop, so an idle session
+    costs no CPU. Every chunk read is appended to the scrollback and handed
+    (uncopied) to each attached viewer. A viewer that would fall more than
+    ``max_pending`` bytes behind is dropped (``viewer.overflow()``) rather
+    than slowing the shell down for every other viewer; it can reconnect and
+    catch up from the scrollback.
+    """
+
+    def __init__(self, key: str, cwd: Optional[str] = None,
+                 scrollback_bytes: int = 256 * 1024, max_pending: int = 1024 * 1024):
+        self.key = key
+        self.cwd = cwd
+        self.max_pending = max_pending
+        self.scrollback = ScrollbackBuffer(scrollback_bytes)
+        self.viewers: Set = set()
+        self.process: Optional[subprocess.Popen] = None
+        self.master_fd: Optional[int] = None
+        self.idle_since = time.monotonic()
+        self.logger = logging.getLogger(__name__)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._input = bytearray()
+        self._reading = False
+        self._eof = False
+
+    @property
+    def alive(self) -> bool:
+        return self.master_fd is not None and not self._eof
+
+    def start(self, rows: int = 24, cols: int = 80):
+        self._loop = asyncio.get_running_loop()
+        master_fd, slave_fd = pty.openpty()
+        try:
+            self.process = subprocess.Popen(
+                ["/bin/bash", "-i"],
+                stdin=slave_fd,
+                stdout=slave_fd,
+                stderr=slave_fd,
+                cwd=self.cwd,
+                env={**os.environ, "TERM": "xterm-256color"},
+                start_new_session=True,
+                preexec_fn=_set_controlling_tty
+            )
+        except BaseException:
+            os.close(master_fd)
+            raise
+        finally:
+            os.close(slave_fd)
+
+        os.set_blocking(master_fd, False)
+        self.master_fd = master_fd
+        self.resize(rows, cols)
+        self._resume_reading()
+        self.logger.info(f"Started terminal session {self.key} (pid {self.process.pid})")
+
+    def attach(self, viewer) -> bytes:
+        """Add a viewer and return the scrollback to replay to it"""
+        self.viewers.add(viewer)
+        return self.scrollback.snapshot()
+
+    def detach(self, viewer):
+        if viewer in self.viewers:
+            self.viewers.discard(viewer)
+            if not self.viewers:
+                self.idle_since = time.monotonic()
+
+    def resize(self, rows: int, cols: int):
+        """Set the terminal window size (bash receives SIGWINCH)"""
+        if self.master_fd is not None:
+            fcntl.ioctl(self.master_fd, termios.TIOCSWINSZ, struct.pack("HHHH", rows, cols, 0, 0))
+
+    def write(self, data: bytes):
+        """Write input to the PTY, queueing whatever the kernel won't take yet"""
+        if self.master_fd is None or not data:
+            return
+        if self._input:
+            self._input += data
+            return
+        try:
+            written = os.write(self.master_fd, data)
+        except BlockingIOError:
+            written = 0
+        if written < len(data):
+            self._input += data[written:]
+            self._loop.add_writer(self.master_fd, self._on_writable)
+
+    async def close(self):
+        """Hang up the shell, reap it and release the PTY"""
+        self._pause_reading()
+        if self.master_fd is not None:
+            self._loop.remove_writer(self.master_fd)
+
+        if self.process and self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGHUP)
+            except ProcessLookupError:
+                pass
+            try:
+                await self._loop.run_in_executor(None, self.process.wait, 5)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                await self._loop.run_in_executor(None, self.process.wait)
+
+        if self.master_fd is not None:
+            os.close(self.master_fd)
+            self.master_fd = None
+        self._mark_eof()
+        self.logger.info(f"Closed terminal session {self.key}")
+
+    def _on_readable(self):
+        try:
+            data = os.read(self.master_fd, 65536)
+        except BlockingIOError:
+            return
+        except OSError:
+            data = b""  # EIO once the shell and all its children have exited
+
+        if not data:
+            self._pause_reading()
+            self._mark_eof()
+            return
+
+        self.scrollback.append(data)
+        for viewer in list(self.viewers):
+            if viewer.pending_bytes + len(data) > self.max_pending:
+                self.detach(viewer)
+                viewer.overflow()
+            else:
+                viewer.feed(data)
+
+    def _mark_eof(self):
+        if not self._eof:
+            self._eof = True
+            for viewer in self.viewers:
+                viewer.end()
+
+    def _on_writable(self):
+        try:
+            written = os.write(self.master_fd, self._input)
+        except BlockingIOError:
+            return
+        except OSError:
+            written = len(self._input)
+        del self._input[:written]
+        if not self._input:
+            self._loop.remove_writer(self.master_fd)
+
+    def _resume_reading(self):
+        if not self._reading and self.master_fd is not None:
+            self._loop.add_reader(self.master_fd, self._on_readable)
+            self._reading = True
+
+    def _pause_reading(self):
+        if self._reading:
+            self._loop.remove_reader(self.master_fd)
+            self._reading = False
+
+class TerminalSessionRegistry:
+    """Keeps terminal sessions alive across reconnects.
+
+    Sessions are keyed ``{project}/{name}``; a session with no viewers for
+    longer than ``idle_timeout`` seconds is closed by a background reaper.
+    A project has at most ``max_sessions_per_project`` sessions and the
+    server at most ``max_sessions``: starting another closes the
+    longest-detached session over the limit (the project's own first), or
+    raises ``SessionLimitReached`` if every one of them has a viewer.
+    """
+
+    def __init__(self, idle_timeout: float = 900.0, reap_interval: float = 30.0,
+                 scrollback_bytes: int = 256 * 1024, max_sessions_per_project: int = 8,
+                 max_sessions: int = 64):
+        self.idle_timeout = idle_timeout
+        self.reap_interval = reap_interval
+        self.scrollback_bytes = scrollback_bytes
+        self.max_sessions_per_project = max_sessions_per_project
+        self.max_sessions = max_sessions
+        self.sessions: Dict[str, TerminalSession] = {}
+        self.logger = logging.getLogger(__name__)
+        self._reaper: Optional[asyncio.Task] = None
+
+    async def get_session(self, key: str, cwd: Optional[str] = None) -> TerminalSession:
+        """Return the live session for ``key``, starting one if needed"""
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.ensure_future(self._reap_idle_sessions())
+
+        session = self.sessions.get(key)
+        if session is not None and not session.alive:
+            del self.sessions[key]
+            asyncio.ensure_future(session.close())
+            session = None
+
+        if session is None:
+            self._make_room(key.split("/", 1)[0])
+            session = TerminalSession(key, cwd=cwd, scrollback_bytes=self.scrollback_bytes)
+            session.start()
+            self.sessions[key] = session
+        return session
+
+    def _make_room(self, project: str):
+        """Close longest-detached sessions until one more fits both limits"""
+        sessions = [s for key, s in self.sessions.items() if key.split("/", 1)[0] == project]
+        project_excess = max(0, len(sessions) - self.max_sessions_per_project + 1)
+        detached = sorted((s for s in sessions if not s.viewers), key=lambda s: s.idle_since)
+        if len(detached) < project_excess:
+            raise SessionLimitReached(f"Project {project} already has {len(sessions)} terminal sessions")
+        evict = detached[:project_excess]
+
+        excess = len(self.sessions) - len(evict) - self.max_sessions + 1
+        if excess > 0:
+            others = sorted(
+                (s for s in self.sessions.values() if not s.viewers and s not in evict),
+                key=lambda s: s.idle_since
+            )
+            if len(others) < excess:
+                raise SessionLimitReached(f"Server already has {len(self.sessions)} terminal sessions")
+            evict += others[:excess]
+
+        for session in evict:
+            del self.sessions[session.key]
+            asyncio.ensure_future(session.close())
+
+    async def close_all(self):
+        if self._reaper is not None:
+            self._reaper.cancel()
+        for key in list(self.sessions):
+            await self.sessions.pop(key).close()
+
+    async def _reap_idle_sessions(self):
+        while True:
+            await asyncio.sleep(self.reap_interval)
+            now = time.monotonic()
+            for key, session in list(self.sessions.items()):
+                idle = not session.viewers and now - session.idle_since > self.idle_timeout
+                if idle or not session.alive:
+                    if self.sessions.get(key) is session:
+                        del self.sessions[key]
+                    try:
+                        await session.close()
+                    except Exception as e:
+                        self.logger.error(f"Error closing terminal session {key}: {str(e)}")
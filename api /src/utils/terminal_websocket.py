@@ -1,52 +1,131 @@
 from fastapi import WebSocket
 import asyncio
-import subprocess
-from typing import Optional
+import json
+import logging
+from typing import List, Optional
+from utils.terminal_session import SessionLimitReached, TerminalSession, TerminalSessionRegistry
+
+# Close code for a viewer dropped for falling behind, or refused a session
+TRY_AGAIN_LATER = 1013
+# Close code when the session could not be started
+INTERNAL_ERROR = 1011
 
 class TerminalWebSocket:
-    def __init__(self, websocket: WebSocket):
+    """One websocket viewer of a shared terminal session.
+
+    On connect the session's scrollback is replayed, then output is forwarded
+    as binary frames carrying whatever accumulated since the previous send.
+    Disconnecting only detaches the viewer; the shell keeps running until the
+    registry evicts it as idle. A viewer the session drops for falling too
+    far behind is closed with code 1013 and may reconnect.
+
+    Binary messages from the client are raw keystrokes. Text messages may be
+    JSON control frames (``{"type": "resize", "rows": .., "cols": ..}`` or
+    ``{"type": "input", "data": ".."}``); any other text is sent as a line.
+    """
+
+    def __init__(self, websocket: WebSocket, registry: TerminalSessionRegistry,
+                 session_key: str, cwd: Optional[str] = None):
         self.websocket = websocket
-        self.process: Optional[subprocess.Popen] = None
+        self.registry = registry
+        self.session_key = session_key
+        self.cwd = cwd
+        self.session: Optional[TerminalSession] = None
+        self.pending_bytes = 0
+        self._pending: List[bytes] = []
+        self._output_ready: Optional[asyncio.Event] = None
+        self._ended = False
+        self._close_code = 1000
+        self._sending: Optional[asyncio.Future] = None
+        self.logger = logging.getLogger(__name__)
 
-    async def connect(self):
+    async def connect(self) -> bool:
+        """Accept and attach; False (the socket is closed) if no session is available"""
         await self.websocket.accept()
-        self.process = subprocess.Popen(
-            ["/bin/bash"],
-            stdin=subprocess.PIPE,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True,
-            bufsize=1,
-            universal_newlines=True
-        )
+        self._output_ready = asyncio.Event()
+        try:
+            self.session = await self.registry.get_session(self.session_key, cwd=self.cwd)
+        except SessionLimitReached:
+            await self.websocket.close(code=TRY_AGAIN_LATER)
+            return False
+        except Exception as e:
+            # The session released its PTY; only the socket is left to close
+            self.logger.error(f"Failed to start terminal session {self.session_key}: {str(e)}")
+            await self.websocket.close(code=INTERNAL_ERROR)
+            return False
+        scrollback = self.session.attach(self)
+        if scrollback:
+            self.feed(scrollback)
+        return True
+
+    def feed(self, data: bytes):
+        """Queue session output for this viewer (called by the session)"""
+        self._pending.append(data)
+        self.pending_bytes += len(data)
+        self._output_ready.set()
+
+    def end(self):
+        """The shell exited (called by the session)"""
+        self._ended = True
+        self._output_ready.set()
+
+    def overflow(self):
+        """Dropped by the session for falling behind (called by the session)"""
+        self._pending = []
+        self.pending_bytes = 0
+        self._close_code = TRY_AGAIN_LATER
+        self.end()
+        if self._sending is not None:
+            self._sending.cancel()  # Likely stuck on a client that stopped reading
 
     async def receive_commands(self):
         while True:
-            try:
-                data = await self.websocket.receive_text()
-                if self.process and self.process.stdin:
-                    self.process.stdin.write(data + "\n")
-                    self.process.stdin.flush()
-            except Exception as e:
-                print(f"Error receiving command: {e}")
+            message = await self.websocket.receive()
+            if message["type"] == "websocket.disconnect":
                 break
+            if message.get("bytes") is not None:
+                self.session.write(message["bytes"])
+            elif message.get("text") is not None:
+                self._handle_text(message["text"])
 
     async def send_output(self):
         while True:
-            if self.process and self.process.stdout:
-                output = self.process.stdout.readline()
-                if output:
-                    await self.websocket.send_text(output)
-                else:
-                    await asyncio.sleep(0.1)
-            else:
-                await asyncio.sleep(0.1)
+            await self._output_ready.wait()
+            self._output_ready.clear()
+
+            if self._pending:
+                chunks = self._pending
+                self._pending = []
+                self.pending_bytes = 0
+                self._sending = asyncio.ensure_future(self.websocket.send_bytes(b"".join(chunks)))
+                try:
+                    await asyncio.wait([self._sending])
+                finally:
+                    self._sending.cancel()
+                if self._sending.cancelled():
+                    break  # Dropped by the session
+                self._sending.result()
+
+            if self._ended and not self._pending:
+                break
 
     async def disconnect(self):
-        if self.process:
-            self.process.terminate()
-            try:
-                self.process.wait(timeout=5)
-            except subprocess.TimeoutExpired:
-                self.process.kill()
-        await self.websocket.close()
+        if self.session is not None:
+            self.session.detach(self)
+        try:
+            await self.websocket.close(code=self._close_code)
+        except RuntimeError:
+            pass  # Already closed by the client
+
+    def _handle_text(self, text: str):
+        try:
+            control = json.loads(text)
+        except ValueError:
+            control = None
+
+        if isinstance(control, dict) and control.get("type") == "resize":
+            self.session.resize(int(control["rows"]), int(control["cols"]))
+        elif isinstance(control, dict) and control.get("type") == "input":
+            self.session.write(str(control.get("data", "")).encode())
+        else:
+            self.session.write((text + "\n").encode())
@@ -0,0 +1,24 @@
+import sys
+import types
+from pathlib import Path
+
+SRC = Path(__file__).resolve().parent.parent / "src"
+REPO = SRC.parent.parent
+
+def _add_source_path():
+    """Make the API source importable as the server sees it, and the
+    backup scripts as they import each other.
+
+    Some package directories are checked out with a trailing space
+    ("services "); they are registered under their import names.
+    """
+    sys.path.insert(0, str(SRC))
+    sys.path.append(str(REPO))  # scripts.* and configs.*
+    for path in SRC.iterdir():
+        name = path.name.strip()
+        if path.is_dir() and name != path.name and name not in sys.modules:
+            package = types.ModuleType(name)
+            package.__path__ = [str(path)]
+            sys.modules[name] = package
+
+_add_source_path()
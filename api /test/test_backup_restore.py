@@ -0,0 +1,93 @@
+import io
+import os
+import tarfile
+import pytest
+from configs.backup_config import BackupConfig
+from scripts.backup_engine import ParallelExtractor
+
+def test_extractor_rejects_paths_outside_root(tmp_path):
+    extractor = ParallelExtractor(tmp_path / "root")
+    (tmp_path / "root").mkdir()
+    try:
+        with pytest.raises(ValueError):
+            extractor.create("../escaped", 1, 0o644, 0)
+        with pytest.raises(ValueError):
+            extractor.directory("projects/../../escaped", 0o755, 0)
+        extractor.symlink("link", str(tmp_path))
+        with pytest.raises(ValueError):
+            extractor.create("link/escaped", 1, 0o644, 0)
+    finally:
+        extractor.close()
+    assert not (tmp_path / "escaped").exists()
+
+def _manager(tmp_path):
+    pytest.importorskip("boto3")
+    from scripts.backup_manager import BackupManager
+    backups = tmp_path / "backups"
+    return BackupManager(BackupConfig(
+        local_storage_path=str(backups),
+        index_path=str(backups / "index"),
+        upload_state_path=str(backups / "uploads"),
+        catalog_path=str(tmp_path / "catalog.db")
+    ))
+
+def _archive(tmp_path, files) -> str:
+    path = tmp_path / "full_20240101_000000.tar.gz"
+    with tarfile.open(path, "w:gz") as tar:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            tar.addfile(info, io.BytesIO(data))
+    return str(path)
+
+def test_gc_is_not_started_on_construction(tmp_path):
+    manager = _manager(tmp_path)
+    assert manager.catalog._gc_thread is None
+
+def test_restore_replaces_selected_units(tmp_path):
+    manager = _manager(tmp_path)
+    target = tmp_path / "app"
+    (target / "projects" / "a").mkdir(parents=True)
+    (target / "projects" / "a" / "old.txt").write_text("old")
+    (target / "projects" / "b").mkdir()
+    (target / "projects" / "b" / "keep.txt").write_text("keep")
+    archive = _archive(tmp_path, {"projects/a/new.txt": b"new", "projects/b/other.txt": b"other"})
+
+    manager.restore_backup(archive, projects=["a"], target_root=str(target))
+
+    assert sorted(os.listdir(target / "projects" / "a")) == ["new.txt"]
+    assert (target / "projects" / "b" / "keep.txt").read_text() == "keep"
+    assert sorted(os.listdir(target / "projects")) == ["a", "b"]
+    assert [p.name for p in target.iterdir()] == ["projects"]  # Staging is cleaned up
+
+def test_failed_swap_rolls_back_earlier_units(tmp_path, monkeypatch):
+    manager = _manager(tmp_path)
+    target = tmp_path / "app"
+    for name in ("a", "b"):
+        (target / "projects" / name).mkdir(parents=True)
+        (target / "projects" / name / "old.txt").write_text(name)
+    archive = _archive(tmp_path, {"projects/a/new.txt": b"a2", "projects/b/new.txt": b"b2"})
+
+    rename = os.rename
+
+    def failing_rename(src, dst):
+        if str(dst) == str(target / "projects" / "b") and ".restore-" in str(src):
+            raise OSError("simulated failure")
+        return rename(src, dst)
+
+    monkeypatch.setattr(os, "rename", failing_rename)
+    with pytest.raises(OSError):
+        manager.restore_backup(archive, projects=["a", "b"], target_root=str(target))
+
+    for name in ("a", "b"):
+        assert sorted(os.listdir(target / "projects" / name)) == ["old.txt"]
+    assert sorted(os.listdir(target / "projects")) == ["a", "b"]
+
+def test_restore_rejects_archive_paths_outside_target(tmp_path):
+    manager = _manager(tmp_path)
+    target = tmp_path / "app"
+    target.mkdir()
+    archive = _archive(tmp_path, {"projects/../../escaped": b"x"})
+    with pytest.raises(ValueError):
+        manager.restore_backup(archive, target_root=str(target))
+    assert not (tmp_path / "escaped").exists()
@@ -0,0 +1,87 @@
+import asyncio
+import sys
+import time
+from services.command_executor import CommandExecutor
+
+def test_project_slot_is_taken_before_global_slot(tmp_path):
+    executor = CommandExecutor(max_concurrent=2, max_per_project=1)
+
+    async def scenario():
+        busy = [executor.run("busy", ["sleep", "0.5"], cwd=str(tmp_path)) for _ in range(3)]
+        other = executor.run("other", ["true"], cwd=str(tmp_path))
+        tasks = [asyncio.ensure_future(run) for run in busy]
+        await asyncio.sleep(0.05)
+        started = time.monotonic()
+        result = await other
+        elapsed = time.monotonic() - started
+        await asyncio.gather(*tasks)
+        return result, elapsed
+
+    result, elapsed = asyncio.run(scenario())
+    assert result.returncode == 0
+    # Queued "busy" commands must not hold the second global slot
+    assert elapsed < 0.4
+
+def test_timeout_kills_command(tmp_path):
+    executor = CommandExecutor()
+    started = time.monotonic()
+    result = asyncio.run(executor.run("p", ["sleep", "30"], cwd=str(tmp_path), timeout=0.2))
+    assert result.timed_out
+    assert time.monotonic() - started < 5
+
+def test_background_grandchild_does_not_hold_request(tmp_path):
+    executor = CommandExecutor()
+    started = time.monotonic()
+    result = asyncio.run(executor.run("p", ["sh", "-c", "sleep 30 & echo done"], cwd=str(tmp_path), timeout=20))
+    assert result.returncode == 0
+    assert result.stdout == "done\n"
+    assert not result.timed_out
+    assert time.monotonic() - started < 5
+
+def test_output_is_capped(tmp_path):
+    executor = CommandExecutor(max_output_bytes=10)
+    script = "import sys; sys.stdout.write('x' * 100000)"
+    result = asyncio.run(executor.run("p", [sys.executable, "-c", script], cwd=str(tmp_path)))
+    assert result.stdout == "x" * 10
+    assert result.stdout_truncated
+    assert not result.stderr_truncated
+
+def test_timeout_is_clamped():
+    executor = CommandExecutor(default_timeout=10, max_timeout=60)
+    assert executor._timeout(None) == 10
+    assert executor._timeout(-1) == 10
+    assert executor._timeout(30) == 30
+    assert executor._timeout(10 ** 9) == 60
+
+def test_stream_reports_start_failure(tmp_path):
+    executor = CommandExecutor()
+
+    async def frames():
+        return [frame async for frame in executor.stream("p", ["does-not-exist-xyz"], cwd=str(tmp_path))]
+
+    [(kind, payload)] = asyncio.run(frames())
+    assert kind == "error"
+    assert payload["message"]
+
+def test_stream_yields_output_and_exit(tmp_path):
+    executor = CommandExecutor()
+
+    async def frames():
+        return [frame async for frame in executor.stream("p", ["sh", "-c", "echo out; echo err >&2; exit 3"], cwd=str(tmp_path))]
+
+    frames = asyncio.run(frames())
+    assert ("stdout", b"out\n") in frames
+    assert ("stderr", b"err\n") in frames
+    kind, exit_info = frames[-1]
+    assert kind == "exit" and exit_info["returncode"] == 3 and not exit_info["timed_out"]
+
+def test_stream_background_grandchild_does_not_hold_stream(tmp_path):
+    executor = CommandExecutor()
+
+    async def frames():
+        return [frame async for frame in executor.stream("p", ["sh", "-c", "sleep 30 & echo done"], cwd=str(tmp_path), timeout=20)]
+
+    started = time.monotonic()
+    frames = asyncio.run(frames())
+    assert frames[-1][0] == "exit" and not frames[-1][1]["timed_out"]
+    assert time.monotonic() - started < 5
@@ -0,0 +1,38 @@
+from services.environment_pool import ORIGIN_FILE, EnvironmentPool
+
+def _pool(tmp_path) -> EnvironmentPool:
+    (tmp_path / "languages").mkdir()
+    return EnvironmentPool(base_path=str(tmp_path / "envs"), config_dir=str(tmp_path / "languages"), pool_sizes={})
+
+def _add_entry(pool: EnvironmentPool, name: str):
+    entry = pool.pool_path / "nodejs-default" / name
+    entry.mkdir(parents=True)
+    (entry / "package.json").write_text('{"name": "pooled"}')
+    (entry / ORIGIN_FILE).write_text(str(entry))
+    return entry
+
+def test_claim_moves_an_entry(tmp_path):
+    pool = _pool(tmp_path)
+    _add_entry(pool, "a")
+    dest = tmp_path / "envs" / "web"
+    assert pool.claim("nodejs", None, dest)
+    assert (dest / "package.json").read_text() == '{"name": "web"}'
+    assert not pool.claim("nodejs", None, tmp_path / "envs" / "other")
+
+def test_claim_into_empty_directory(tmp_path):
+    pool = _pool(tmp_path)
+    _add_entry(pool, "a")
+    dest = tmp_path / "envs" / "web"
+    dest.mkdir()
+    assert pool.claim("nodejs", None, dest)
+    assert (dest / "package.json").exists()
+
+def test_claim_refuses_existing_destination(tmp_path):
+    pool = _pool(tmp_path)
+    entry = _add_entry(pool, "a")
+    dest = tmp_path / "envs" / "web"
+    dest.mkdir()
+    (dest / "leftover").write_text("x")
+    assert not pool.claim("nodejs", None, dest)
+    assert entry.exists()
+    assert (dest / "leftover").exists()
@@ -0,0 +1,38 @@
+import logging
+from utils.logging_config import BatchedRotatingFileHandler, BoundedQueueHandler, RateLimitFilter
+
+def _record(msg, name="noisy", level=logging.INFO):
+    return logging.LogRecord(name, level, __file__, 1, msg, None, None)
+
+def test_rollover_counts_encoded_bytes(tmp_path):
+    handler = BatchedRotatingFileHandler(tmp_path / "api.log", maxBytes=100, backupCount=1, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    try:
+        handler.handle_batch([_record("é" * 30)])  # 61 bytes, 31 characters
+        handler.handle_batch([_record("é" * 30)])
+    finally:
+        handler.close()
+    assert (tmp_path / "api.log.1").exists()
+    assert (tmp_path / "api.log").stat().st_size == 61
+
+def test_rate_limit_admits_burst_then_refills():
+    limit = RateLimitFilter(["noisy"], rate=1000, burst=2)
+    assert limit.admit(_record("a")) == 0
+    assert limit.admit(_record("b")) == 0
+    assert limit.admit(_record("c")) is None
+    assert limit.admit(_record("w", level=logging.WARNING)) == 0
+    assert limit.admit(_record("other", name="quiet")) == 0
+    limit._buckets["noisy"][1] -= 1  # A second later
+    assert limit.admit(_record("d")) == 1
+
+def test_suppressed_count_goes_on_the_queued_copy_only():
+    handler = BoundedQueueHandler(rate_limits=[RateLimitFilter(["noisy"], rate=1, burst=1)])
+    handler.handle(_record("first"))
+    handler.handle(_record("dropped"))
+    handler.rate_limits[0]._buckets["noisy"][1] -= 1
+    record = _record("second")
+    handler.handle(record)
+
+    queued = [handler.queue.get_nowait() for _ in range(handler.queue.qsize())]
+    assert [r.msg for r in queued] == ["first", "second (1 similar messages suppressed)"]
+    assert record.getMessage() == "second"
@@ -0,0 +1,45 @@
+import subprocess
+import sys
+import time
+from utils.metrics_sampler import MetricsSampler
+from utils.monitoring import PROJECT_MEMORY_BYTES
+
+def test_first_pass_is_a_baseline_only(tmp_path):
+    sampler = MetricsSampler(interval=0.2, projects_root=str(tmp_path))
+    sampler.start()
+    try:
+        assert sampler.snapshot is None
+        deadline = time.monotonic() + 10
+        while sampler.snapshot is None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        assert sampler.snapshot is not None
+    finally:
+        sampler.stop()
+
+def test_cpu_percent_is_measured_between_passes(tmp_path):
+    project = tmp_path / "busy"
+    project.mkdir()
+    child = subprocess.Popen([sys.executable, "-c", "while True: pass"], cwd=project)
+    try:
+        sampler = MetricsSampler(projects_root=str(tmp_path))
+        sampler._prime()
+        time.sleep(0.5)
+        snapshot = sampler.sample()
+        assert snapshot.projects["busy"].cpu_percent > 10
+    finally:
+        child.kill()
+        child.wait()
+
+def test_projects_that_are_gone_are_zeroed(tmp_path):
+    project = tmp_path / "gone"
+    project.mkdir()
+    child = subprocess.Popen(["sleep", "30"], cwd=project)
+    sampler = MetricsSampler(projects_root=str(tmp_path))
+    try:
+        sampler.sample()
+        assert PROJECT_MEMORY_BYTES.labels(project="gone")._value.get() > 0
+    finally:
+        child.kill()
+        child.wait()
+    sampler.sample()
+    assert PROJECT_MEMORY_BYTES.labels(project="gone")._value.get() == 0
@@ -0,0 +1,66 @@
+import time
+from services.process_manager import ProcessManager
+from utils.cgroups import CgroupManager
+from utils.monitoring import PROCESS_CPU_SECONDS
+
+def _manager(tmp_path, **kwargs) -> ProcessManager:
+    # A CgroupManager that has not been set up runs processes unconfined
+    return ProcessManager(cgroups=CgroupManager(), log_dir=str(tmp_path / "logs"), **kwargs)
+
+def _wait_for(condition, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+def test_output_and_exit_are_recorded(tmp_path):
+    manager = _manager(tmp_path)
+    info = manager.start_process("echo hello; echo oops >&2; exit 3", str(tmp_path))
+    assert _wait_for(lambda: manager.get_process(info.pid).status == "failed")
+    info = manager.get_process(info.pid)
+    assert info.return_code == 3
+    assert info.output == "hello\n"
+    assert info.error == "oops\n"
+
+def test_restart_backs_off_exponentially(tmp_path):
+    manager = _manager(tmp_path, restart_backoff=0.2, max_restarts=2)
+    starts = tmp_path / "starts"
+    info = manager.start_process(f"date +%s.%N >> {starts}; exit 1", str(tmp_path), restart=True)
+    assert _wait_for(lambda: manager.get_process(info.pid).restarts == 2
+                     and manager.get_process(info.pid).status == "failed")
+    times = [float(line) for line in starts.read_text().split()]
+    assert len(times) == 3
+    # Delays of 0.2s then 0.4s
+    assert times[1] - times[0] >= 0.15
+    assert times[2] - times[1] >= 0.35
+    # Still reachable through the first pid
+    assert manager.get_process(info.pid).pid != info.pid
+
+def test_stop_during_backoff_cancels_restart(tmp_path):
+    manager = _manager(tmp_path, restart_backoff=5)
+    info = manager.start_process("exit 1", str(tmp_path), restart=True)
+    assert _wait_for(lambda: manager.get_process(info.pid).return_code == 1)
+    assert manager.stop_process(info.pid)
+    assert manager.get_process(info.pid).status == "stopped"
+    assert manager.get_process(info.pid).restarts == 0
+
+def test_finished_processes_are_forgotten_after_retention(tmp_path):
+    manager = _manager(tmp_path, retention=0.3, cleanup_interval=0.1)
+    info = manager.start_process("exit 0", str(tmp_path))
+    assert _wait_for(lambda: manager.get_process(info.pid).status == "finished")
+    log_path = manager.get_log(info.pid).path
+    assert log_path.exists()
+    PROCESS_CPU_SECONDS.labels(pid=str(info.pid)).set(1.0)
+
+    assert _wait_for(lambda: manager.get_process(info.pid) is None)
+    assert not log_path.exists()
+    assert (str(info.pid),) not in PROCESS_CPU_SECONDS._metrics
+
+def test_running_processes_are_kept(tmp_path):
+    manager = _manager(tmp_path, retention=0, cleanup_interval=0.05)
+    info = manager.start_process("sleep 30", str(tmp_path))
+    time.sleep(0.3)
+    assert manager.get_process(info.pid).status == "running"
+    manager.stop_process(info.pid)
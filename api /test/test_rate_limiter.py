@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+from utils.security_middleware import RateLimiter
+
+def test_local_bucket_allows_burst_then_refills():
+    limiter = RateLimiter(max_requests=3, time_window=3)  # One token per second
+    assert [limiter._hit_local("a", 100.0) for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert limiter._hit_local("a", 100.0) == pytest.approx(1.0)
+    assert limiter._hit_local("a", 100.5) == pytest.approx(0.5)
+    assert limiter._hit_local("a", 101.5) == 0.0
+    # Other clients have their own bucket
+    assert limiter._hit_local("b", 101.5) == 0.0
+
+def test_idle_and_excess_buckets_are_evicted():
+    limiter = RateLimiter(max_requests=1, time_window=10, max_clients=2)
+    for i, ip in enumerate(["a", "b", "c"]):
+        limiter._hit_local(ip, 100.0 + i)
+    assert list(limiter.buckets) == ["b", "c"]
+    limiter._hit_local("d", 112.5)
+    assert list(limiter.buckets) == ["d"]
+
+class _Pool:
+    def __init__(self, socket_timeout):
+        self.connection_kwargs = {"socket_timeout": socket_timeout}
+
+class _DownRedis:
+    """Redis client whose every call fails"""
+
+    def __init__(self, socket_timeout=0.1):
+        self.connection_pool = _Pool(socket_timeout)
+        self.calls = 0
+
+    def register_script(self, script):
+        async def run(keys, args):
+            self.calls += 1
+            raise ConnectionError("Redis is down")
+        return run
+
+def test_redis_client_needs_short_socket_timeout():
+    with pytest.raises(ValueError):
+        RateLimiter(1, 1, redis_conn=_DownRedis(socket_timeout=None))
+    with pytest.raises(ValueError):
+        RateLimiter(1, 1, redis_conn=_DownRedis(socket_timeout=30))
+
+def test_redis_failure_falls_back_and_backs_off():
+    redis = _DownRedis()
+    limiter = RateLimiter(max_requests=2, time_window=60, redis_conn=redis, redis_retry_after=60)
+
+    async def hits():
+        return [await limiter.hit("a") for _ in range(3)]
+
+    results = asyncio.run(hits())
+    assert results[:2] == [0.0, 0.0]
+    assert results[2] > 0
+    assert redis.calls == 1
+
+    limiter._redis_retry_at = 0  # Back-off over
+    asyncio.run(limiter.hit("a"))
+    assert redis.calls == 2
@@ -0,0 +1,97 @@
+import asyncio
+import os
+import pytest
+from utils.terminal_session import SessionLimitReached, TerminalSession, TerminalSessionRegistry
+from utils.terminal_websocket import INTERNAL_ERROR, TerminalWebSocket
+
+class _Viewer:
+    def feed(self, data):
+        pass
+
+    def end(self):
+        pass
+
+def test_project_limit_evicts_longest_detached_session(tmp_path):
+    async def scenario():
+        registry = TerminalSessionRegistry(max_sessions_per_project=2)
+        first = await registry.get_session("p/a", cwd=str(tmp_path))
+        second = await registry.get_session("p/b", cwd=str(tmp_path))
+        second.attach(_Viewer())
+        await registry.get_session("p/c", cwd=str(tmp_path))
+        keys = set(registry.sessions)
+        await asyncio.sleep(0)
+        await registry.close_all()
+        return keys, first
+
+    keys, first = asyncio.run(scenario())
+    assert keys == {"p/b", "p/c"}
+    assert first.master_fd is None
+
+def test_project_limit_refuses_when_all_attached(tmp_path):
+    async def scenario():
+        registry = TerminalSessionRegistry(max_sessions_per_project=1)
+        session = await registry.get_session("p/a", cwd=str(tmp_path))
+        session.attach(_Viewer())
+        try:
+            with pytest.raises(SessionLimitReached):
+                await registry.get_session("p/b", cwd=str(tmp_path))
+            # Another project is unaffected by this one's limit
+            await registry.get_session("q/a", cwd=str(tmp_path))
+        finally:
+            await registry.close_all()
+
+    asyncio.run(scenario())
+
+def test_global_limit_spans_projects(tmp_path):
+    async def scenario():
+        registry = TerminalSessionRegistry(max_sessions=2)
+        for project in ("p", "q"):
+            session = await registry.get_session(f"{project}/a", cwd=str(tmp_path))
+            session.attach(_Viewer())
+        try:
+            with pytest.raises(SessionLimitReached):
+                await registry.get_session("r/a", cwd=str(tmp_path))
+            registry.sessions["p/a"].viewers.clear()
+            await registry.get_session("r/a", cwd=str(tmp_path))
+            return set(registry.sessions)
+        finally:
+            await registry.close_all()
+
+    assert asyncio.run(scenario()) == {"q/a", "r/a"}
+
+def test_failed_start_releases_pty(tmp_path):
+    async def scenario():
+        before = len(os.listdir("/proc/self/fd"))
+        session = TerminalSession("p/a", cwd=str(tmp_path / "missing"))
+        with pytest.raises(OSError):
+            session.start()
+        return before, len(os.listdir("/proc/self/fd"))
+
+    before, after = asyncio.run(scenario())
+    assert after == before
+
+class _FakeWebSocket:
+    def __init__(self):
+        self.accepted = False
+        self.close_code = None
+
+    async def accept(self):
+        self.accepted = True
+
+    async def close(self, code=1000):
+        self.close_code = code
+
+def test_connect_closes_socket_when_session_fails_to_start(tmp_path):
+    websocket = _FakeWebSocket()
+
+    async def scenario():
+        registry = TerminalSessionRegistry()
+        terminal = TerminalWebSocket(websocket, registry, "p/a", cwd=str(tmp_path / "missing"))
+        connected = await terminal.connect()
+        await registry.close_all()
+        return connected, registry.sessions
+
+    connected, sessions = asyncio.run(scenario())
+    assert not connected
+    assert websocket.close_code == INTERNAL_ERROR
+    assert sessions == {}
@@ -13,3 +13,12 @@ class BackupConfig(BaseModel):
     db_user: str = "user"
     db_password: str = "pass"
     db_name: str = "devserver"
+    compression_level: int = 6
+    compression_workers: Optional[int] = None  # Defaults to the CPU count
+    index_path: str = "/app/backups/index"
+    upload_state_path: str = "/app/backups/uploads"
+    upload_part_size: int = 16 * 1024 * 1024  # S3 requires >= 5 MiB; at most 10,000 parts
+    upload_concurrency: int = 4
+    upload_max_bandwidth: Optional[int] = None  # Bytes per second
+    catalog_path: str = "/app/backups/catalog.db"
+    gc_interval: int = 3600  # Seconds between retention passes
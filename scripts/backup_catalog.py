@@ -0,0 +1,158 @@
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS backups (
+    name TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    backup_type TEXT NOT NULL,
+    incremental INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    location TEXT NOT NULL,
+    expired INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS backups_kind_created ON backups (kind, created_at);
+CREATE TABLE IF NOT EXISTS backup_projects (
+    project TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    backup TEXT NOT NULL REFERENCES backups (name) ON DELETE CASCADE,
+    PRIMARY KEY (project, created_at, backup)
+);
+CREATE INDEX IF NOT EXISTS backup_projects_backup ON backup_projects (backup);
+CREATE TABLE IF NOT EXISTS chunk_refs (
+    backup TEXT NOT NULL REFERENCES backups (name) ON DELETE CASCADE,
+    archive TEXT NOT NULL,
+    chunks INTEGER NOT NULL,
+    PRIMARY KEY (backup, archive)
+);
+CREATE INDEX IF NOT EXISTS chunk_refs_archive ON chunk_refs (archive);
+"""
+
+class BackupCatalog:
+    """SQLite catalog of stored backups.
+
+    Each backup is recorded with its type, size and SHA-256, the projects it
+    contains, and, for incremental backups, how many of its chunks live in
+    each archive (its own or earlier ones). ``latest_containing`` is an
+    index lookup, so finding a backup never lists storage.
+
+    Retention marks backups older than ``retention_days`` as expired, always
+    keeping the newest backup of each kind. An expired backup's archive is
+    deleted once no live backup references chunks in it; until then it stays
+    in storage (but is no longer offered for restore).
+    """
+
+    def __init__(self, path: str, retention_days: int):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.retention_days = retention_days
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(str(self.path), check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SCHEMA)
+        self._gc_thread: Optional[threading.Thread] = None
+        self._gc_requested = threading.Event()
+
+    def record(self, name: str, kind: str, backup_type: str, incremental: bool, size: int,
+               sha256: str, location: str, projects: Iterable[str], chunk_refs: Dict[str, int] = None,
+               created_at: Optional[float] = None):
+        """Add a completed backup"""
+        created_at = created_at or time.time()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO backups (name, kind, backup_type, incremental, created_at, size, sha256, location)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (name, kind, backup_type, int(incremental), created_at, size, sha256, location)
+                )
+                self._db.executemany(
+                    "INSERT OR IGNORE INTO backup_projects (project, created_at, backup) VALUES (?, ?, ?)",
+                    [(project, created_at, name) for project in projects]
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO chunk_refs (backup, archive, chunks) VALUES (?, ?, ?)",
+                    [(name, archive, count) for archive, count in (chunk_refs or {}).items()]
+                )
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def get(self, name: str) -> Optional[Dict]:
+        with self._lock:
+            row = self._db.execute("SELECT * FROM backups WHERE name = ?", (name,)).fetchone()
+        return dict(row) if row else None
+
+    def list(self, kind: Optional[str] = None, include_expired: bool = False) -> List[Dict]:
+        """Backups, newest first"""
+        query = "SELECT * FROM backups WHERE (? IS NULL OR kind = ?)"
+        if not include_expired:
+            query += " AND expired = 0"
+        with self._lock:
+            rows = self._db.execute(query + " ORDER BY created_at DESC", (kind, kind)).fetchall()
+        return [dict(row) for row in rows]
+
+    def latest_containing(self, project: str) -> Optional[Dict]:
+        """The newest restorable backup that includes ``project``"""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT b.* FROM backup_projects p JOIN backups b ON b.name = p.backup"
+                " WHERE p.project = ? AND b.expired = 0 ORDER BY p.created_at DESC LIMIT 1",
+                (project,)
+            ).fetchone()
+        return dict(row) if row else None
+
+    def expire(self, now: Optional[float] = None) -> int:
+        """Mark backups past retention as expired; returns how many were marked"""
+        cutoff = (now or time.time()) - self.retention_days * 86400
+        with self._lock:
+            cursor = self._db.execute(
+                "UPDATE backups SET expired = 1 WHERE expired = 0 AND created_at < ?"
+                " AND created_at < (SELECT MAX(created_at) FROM backups AS newest WHERE newest.kind = backups.kind)",
+                (cutoff,)
+            )
+            return cursor.rowcount
+
+    def reclaimable(self) -> List[str]:
+        """Expired backups whose archive no live backup references"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT name FROM backups b WHERE expired = 1 AND NOT EXISTS ("
+                " SELECT 1 FROM chunk_refs r JOIN backups live ON live.name = r.backup"
+                " WHERE r.archive = b.name AND live.expired = 0)"
+            ).fetchall()
+        return [row["name"] for row in rows]
+
+    def remove(self, name: str):
+        with self._lock:
+            self._db.execute("DELETE FROM backups WHERE name = ?", (name,))
+
+    def start_gc(self, collect, interval: float):
+        """Run ``collect()`` every ``interval`` seconds, or sooner when ``request_gc`` is called"""
+        if self._gc_thread is None:
+            self._gc_thread = threading.Thread(
+                target=self._gc_loop, args=(collect, interval), name="backup-gc", daemon=True
+            )
+            self._gc_thread.start()
+
+    def request_gc(self):
+        self._gc_requested.set()
+
+    def _gc_loop(self, collect, interval: float):
+        while True:
+            try:
+                collect()
+            except Exception as e:
+                self.logger.error(f"Backup retention failed: {str(e)}")
+            self._gc_requested.wait(interval)
+            self._gc_requested.clear()
@@ -0,0 +1,419 @@
+import datetime
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import stat
+import tarfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, Iterator, List, Optional
+
+try:
+    import numpy as np
+except ImportError:  # Optional; chunk boundaries are then found in pure Python, far slower
+    np = None
+
+# Gear table for content-defined chunking; seeded so boundaries (and
+# therefore chunk digests) are stable across runs and hosts
+_GEAR_RNG = random.Random(0x67656172)
+_GEAR = [_GEAR_RNG.getrandbits(64) for _ in range(256)]
+_MASK64 = (1 << 64) - 1
+_GEAR_ARRAY = np.array(_GEAR, dtype=np.uint64) if np is not None else None
+# The hash only depends on the last 64 bytes: bit j of a byte's gear value is shifted out after 64 steps
+_WINDOW = 64
+
+class ParallelGzipWriter:
+    """File-like writer that gzips on several cores.
+
+    Input is cut into ``block_size`` blocks and each block is compressed as
+    an independent gzip member on a thread pool (zlib releases the GIL).
+    Members are written to ``sink`` in order, and a concatenation of gzip
+    members is itself a valid gzip file, readable by gzip, tar and Python's
+    ``tarfile``. At most ``2 * workers`` blocks are in flight, so memory
+    stays bounded and a slow sink slows the producer down.
+    """
+
+    def __init__(self, sink: BinaryIO, level: int = 6, workers: Optional[int] = None,
+                 block_size: int = 1024 * 1024):
+        self.sink = sink
+        self.level = level
+        self.block_size = block_size
+        self.workers = workers or os.cpu_count() or 1
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._buffer = bytearray()
+        self._pending = deque()
+        self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pgzip")
+        self._closed = False
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._submit(bytes(self._buffer[:self.block_size]))
+            del self._buffer[:self.block_size]
+        return len(data)
+
+    def flush(self):
+        pass  # Blocks are only emitted whole; close() emits the tail
+
+    def close(self):
+        """Compress what is left and wait for all members; does not close ``sink``"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._buffer or not self.bytes_in:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._write_next()
+        finally:
+            self._pool.shutdown(wait=True)
+
+    def _submit(self, block: bytes):
+        self.bytes_in += len(block)
+        self._pending.append(self._pool.submit(gzip.compress, block, self.level, mtime=0))
+        while len(self._pending) > 2 * self.workers:
+            self._write_next()
+
+    def _write_next(self):
+        member = self._pending.popleft().result()
+        self.sink.write(member)
+        self.bytes_out += len(member)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._closed = True
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+class Chunker:
+    """Content-defined chunking with a gear rolling hash (as in FastCDC).
+
+    A boundary is placed where the hash of the preceding bytes matches a
+    mask, so inserting or deleting bytes only changes the chunks around the
+    edit. Chunks are between ``min_size`` and ``max_size`` bytes and average
+    roughly ``avg_size``. Files no larger than ``whole_file_size`` (most
+    source files) are one chunk and are never hashed byte by byte.
+
+    With numpy the hash is computed for a whole read buffer at once, by
+    combining windows of doubling width, and only the first bytes after each
+    chunk start (before the window is full) are hashed one at a time; the
+    boundaries are identical to the pure-Python loop used without numpy.
+    """
+
+    def __init__(self, min_size: int = 16 * 1024, avg_size: int = 64 * 1024,
+                 max_size: int = 256 * 1024, read_size: int = 1024 * 1024,
+                 whole_file_size: int = 1024 * 1024):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.read_size = max(read_size, max_size)
+        self.whole_file_size = whole_file_size
+        bits = max(1, (avg_size - min_size).bit_length() - 1)
+        # Test the high bits: they depend on the last 64 bytes, not just the last few
+        self.mask = ((1 << bits) - 1) << (64 - bits)
+
+    def chunks(self, f: BinaryIO, size: Optional[int] = None) -> Iterator[bytes]:
+        """Split ``f``; ``size``, if known, lets small files skip chunking"""
+        if size is not None and size <= self.whole_file_size:
+            data = f.read()
+            if data:
+                yield data
+            return
+        buffer = b""
+        pos = 0
+        eof = False
+        candidates = None
+        while True:
+            # Refill at most once per read_size consumed, not once per chunk
+            while not eof and len(buffer) - pos < self.max_size:
+                data = f.read(self.read_size)
+                eof = not data
+                buffer = buffer[pos:] + data
+                pos = 0
+                candidates = None
+            remaining = len(buffer) - pos
+            if not remaining:
+                return
+            if remaining <= self.min_size and eof:
+                yield buffer[pos:]
+                return
+            end = min(len(buffer), pos + self.max_size)
+            if np is None:
+                cut = self._boundary(buffer, pos, end)
+            else:
+                if candidates is None:
+                    candidates = self._candidates(buffer)
+                cut = self._boundary_vectorized(buffer, candidates, pos, end)
+            yield buffer[pos:cut]
+            pos = cut
+
+    def _boundary(self, buffer: bytes, start: int, end: int) -> int:
+        return self._scan(buffer, start + self.min_size, end) or end
+
+    def _scan(self, buffer: bytes, begin: int, end: int) -> Optional[int]:
+        """Hash from ``begin`` with an empty window; the cut after the first match"""
+        h = 0
+        gear = _GEAR
+        mask = self.mask
+        for i in range(begin, end):
+            h = ((h << 1) + gear[buffer[i]]) & _MASK64
+            if not h & mask:
+                return i + 1
+        return None
+
+    def _candidates(self, buffer: bytes):
+        """Positions whose full-window hash matches the mask"""
+        h = _GEAR_ARRAY[np.frombuffer(buffer, dtype=np.uint8)]
+        # h[i] covers bytes i-width+1..i; adding the previous window shifted past it doubles the width
+        width = 1
+        while width < _WINDOW:
+            h[width:] += h[:-width] << np.uint64(width)
+            width *= 2
+        return np.flatnonzero(h & np.uint64(self.mask) == 0)
+
+    def _boundary_vectorized(self, buffer: bytes, candidates, start: int, end: int) -> int:
+        begin = start + self.min_size
+        full = min(end, begin + _WINDOW - 1)
+        cut = self._scan(buffer, begin, full)
+        if cut is not None:
+            return cut
+        k = int(np.searchsorted(candidates, full))
+        if k < len(candidates) and candidates[k] < end:
+            return int(candidates[k]) + 1
+        return end
+
+class BackupIndex:
+    """Local record of what earlier incremental backups already hold.
+
+    ``files`` maps an absolute path to ``[size, mtime_ns, inode, digests]``
+    from the last backup that read it; a file whose stat still matches is
+    not read again. ``chunks`` maps a chunk digest to ``[archive, size]``
+    for the archive storing it. Both are saved (atomically) only after a backup completes.
+    """
+
+    def __init__(self, index_dir: Path):
+        self.index_dir = Path(index_dir)
+        self.files: Dict[str, list] = self._load("files.json")
+        self.chunks: Dict[str, list] = self._load("chunks.json")
+
+    def _load(self, name: str) -> Dict:
+        try:
+            with open(self.index_dir / name) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save(self):
+        self.index_dir.mkdir(parents=True, exist_ok=True)
+        for name, data in (("files.json", self.files), ("chunks.json", self.chunks)):
+            path = self.index_dir / name
+            tmp_path = path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(tmp_path, path)
+
+class IncrementalArchiver:
+    """Writes a deduplicated backup into a streaming tar.
+
+    Each regular file is split into content-defined chunks named by SHA-256;
+    only chunks not held by an earlier backup (per ``BackupIndex``) are
+    stored, as ``chunks/<digest>``. ``finish`` appends ``manifest.json``
+    listing every entry with its chunk digests, plus ``chunk_sources``
+    giving the archive holding each chunk and its size, which is everything
+    a restore needs. The manifest is also returned, to be stored beside the
+    archive so a restore can read it without scanning the archive.
+    """
+
+    def __init__(self, tar: tarfile.TarFile, index: BackupIndex, backup_name: str,
+                 chunker: Optional[Chunker] = None):
+        self.tar = tar
+        self.index = index
+        self.backup_name = backup_name
+        self.chunker = chunker or Chunker()
+        self.logger = logging.getLogger(__name__)
+        self.entries: List[Dict] = []
+        self.chunk_sources: Dict[str, list] = {}
+        self.files_index: Dict[str, list] = {}
+        self.roots: List[str] = []
+        self.stats = {"files": 0, "files_unchanged": 0, "bytes_read": 0,
+                      "chunks_new": 0, "chunks_reused": 0, "bytes_stored": 0}
+
+    def add(self, path: str, arcname: str):
+        """Add a file or directory tree"""
+        root = Path(path)
+        if not root.exists():
+            self.logger.warning(f"Skipping missing backup source {path}")
+            return
+        self.roots.append(str(root))
+        self._add_entry(root, arcname)
+        if root.is_dir() and not root.is_symlink():
+            for dirpath, dirnames, filenames in os.walk(root):
+                dirnames.sort()
+                rel_dir = Path(dirpath).relative_to(root)
+                for name in dirnames + sorted(filenames):
+                    self._add_entry(Path(dirpath) / name, f"{arcname}/{(rel_dir / name).as_posix()}")
+
+    def _add_entry(self, path: Path, arcname: str):
+        st = path.lstat()
+        entry = {"path": arcname, "mode": stat.S_IMODE(st.st_mode), "mtime": st.st_mtime}
+        if stat.S_ISLNK(st.st_mode):
+            entry.update(type="symlink", target=os.readlink(path))
+        elif stat.S_ISDIR(st.st_mode):
+            entry.update(type="dir")
+        elif stat.S_ISREG(st.st_mode):
+            entry.update(type="file", size=st.st_size, chunks=self._file_chunks(path, st))
+        else:
+            return  # Sockets, fifos and devices are not backed up
+        self.entries.append(entry)
+
+    def _file_chunks(self, path: Path, st: os.stat_result) -> List[str]:
+        self.stats["files"] += 1
+        key = str(path)
+        signature = [st.st_size, st.st_mtime_ns, st.st_ino]
+        previous = self.index.files.get(key)
+        if previous and previous[:3] == signature and all(d in self.index.chunks for d in previous[3]):
+            self.stats["files_unchanged"] += 1
+            digests = previous[3]
+            for digest in digests:
+                self.chunk_sources[digest] = self.index.chunks[digest]
+                self.stats["chunks_reused"] += 1
+        else:
+            digests = []
+            with open(path, "rb") as f:
+                for chunk in self.chunker.chunks(f, st.st_size):
+                    self.stats["bytes_read"] += len(chunk)
+                    digest = hashlib.sha256(chunk).hexdigest()
+                    digests.append(digest)
+                    self._store_chunk(digest, chunk)
+        self.files_index[key] = signature + [digests]
+        return digests
+
+    def _store_chunk(self, digest: str, chunk: bytes):
+        if digest in self.chunk_sources:
+            return  # Already stored or referenced by this backup
+        if digest in self.index.chunks:
+            self.chunk_sources[digest] = self.index.chunks[digest]
+            self.stats["chunks_reused"] += 1
+            return
+        info = tarfile.TarInfo(f"chunks/{digest}")
+        info.size = len(chunk)
+        self.tar.addfile(info, io.BytesIO(chunk))
+        self.chunk_sources[digest] = [self.backup_name, len(chunk)]
+        self.stats["chunks_new"] += 1
+        self.stats["bytes_stored"] += len(chunk)
+
+    def finish(self) -> bytes:
+        """Append and return the manifest; call ``commit`` once the archive is safely stored"""
+        manifest = json.dumps({
+            "backup": self.backup_name,
+            "created_at": datetime.datetime.now().isoformat(),
+            "entries": self.entries,
+            "chunk_sources": self.chunk_sources
+        }, separators=(",", ":")).encode()
+        info = tarfile.TarInfo("manifest.json")
+        info.size = len(manifest)
+        self.tar.addfile(info, io.BytesIO(manifest))
+        return manifest
+
+    def commit(self):
+        """Record this backup's files and chunks so the next one can skip them"""
+        # Forget files that disappeared from the trees this backup covered
+        for key in [k for k in self.index.files if any(k == r or k.startswith(r + os.sep) for r in self.roots)]:
+            if key not in self.files_index:
+                del self.index.files[key]
+        self.index.files.update(self.files_index)
+        for digest, source in self.chunk_sources.items():
+            self.index.chunks.setdefault(digest, source)
+        self.index.save()
+
+class ParallelExtractor:
+    """Writes restored entries under ``root`` with file writes on a thread pool.
+
+    Directories and symlinks are created immediately; file contents are
+    written by ``workers`` threads, with at most ``max_pending`` writes
+    queued so a fast archive stream cannot outrun the disk unboundedly.
+    Paths are archive-relative and may not escape ``root``. Modes and
+    mtimes are applied in ``close``, after all data is written.
+    """
+
+    def __init__(self, root: Path, workers: int = 8, max_pending: int = 64):
+        self.root = Path(root)
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="restore")
+        self._pending = deque()
+        self._attributes: List = []  # (path, mode, mtime), applied in close()
+        self.files = 0
+        self.bytes_written = 0
+
+    def _path(self, rel: str) -> Path:
+        path = (self.root / rel).resolve()
+        if path != self.root.resolve() and self.root.resolve() not in path.parents:
+            raise ValueError(f"Refusing to restore {rel!r} outside {self.root}")
+        return self.root / rel
+
+    def directory(self, rel: str, mode: int, mtime: float):
+        path = self._path(rel)
+        path.mkdir(parents=True, exist_ok=True)
+        self._attributes.append((path, mode, mtime))
+
+    def symlink(self, rel: str, target: str):
+        path = self._path(rel)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.symlink(target, path)
+
+    def hardlink(self, rel: str, target_rel: str):
+        path = self._path(rel)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        os.link(self._path(target_rel), path)
+
+    def create(self, rel: str, size: int, mode: int, mtime: float) -> Path:
+        """Create a file of ``size`` bytes to be filled by ``write_at``"""
+        path = self._path(rel)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "wb") as f:
+            f.truncate(size)
+        self._attributes.append((path, mode, mtime))
+        self.files += 1
+        return path
+
+    def write_at(self, path: Path, offset: int, data: bytes):
+        self._submit(self._pwrite, path, offset, data)
+
+    def _pwrite(self, path: Path, offset: int, data: bytes):
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, offset)
+        finally:
+            os.close(fd)
+
+    def _submit(self, fn, *args):
+        self._pending.append(self._pool.submit(fn, *args))
+        self.bytes_written += len(args[-1])
+        while len(self._pending) > self.max_pending:
+            self._pending.popleft().result()
+        while self._pending and self._pending[0].done():
+            self._pending.popleft().result()
+
+    def close(self):
+        try:
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._pool.shutdown(wait=True)
+        # Deepest first, so setting a file's mtime does not bump its directory's afterwards
+        for path, mode, mtime in sorted(self._attributes, key=lambda a: len(a[0].parts), reverse=True):
+            os.chmod(path, mode)
+            os.utime(path, (mtime, mtime))
+
+    def abort(self):
+        self._pool.shutdown(wait=True, cancel_futures=True)
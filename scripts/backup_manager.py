@@ -1,12 +1,22 @@
 import os
+import shutil
 import tarfile
 import datetime
+import time
+import uuid
+import hashlib
+import json
+import threading
 import boto3
-from typing import Optional
+from collections import defaultdict
+from typing import BinaryIO, Dict, List, Optional, Set, Tuple
 from pathlib import Path
 import subprocess
 import logging
 from configs.backup_config import BackupConfig
+from scripts.backup_catalog import BackupCatalog
+from scripts.backup_engine import BackupIndex, IncrementalArchiver, ParallelExtractor, ParallelGzipWriter
+from scripts.backup_storage import LocalBackend, MultipartUploader, S3Backend
 
 class BackupManager:
     def __init__(self, config: BackupConfig):
@@ -20,40 +30,155 @@ class BackupManager:
                 aws_secret_access_key=self.config.s3_secret_key,
                 region_name=self.config.s3_region
             )
+            self.storage = S3Backend(self.s3_client, self.config.s3_bucket)
+        else:
+            self.storage = LocalBackend(self.config.local_storage_path)
 
-    def create_backup(self, backup_type: str = "full"):
-        """Create a backup of specified type"""
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        backup_name = f"{backup_type}_{timestamp}.tar.gz"
-        backup_path = Path(self.config.local_storage_path) / backup_name
-        
+        self.catalog = BackupCatalog(self.config.catalog_path, self.config.retention_days)
+        # Held by incremental backups and garbage collection, so chunks a
+        # running backup references cannot be deleted underneath it
+        self._lock = threading.Lock()
+
+    def start_gc(self):
+        """Start expiring and deleting backups in the background (see ``collect_garbage``)"""
+        self.catalog.start_gc(self.collect_garbage, self.config.gc_interval)
+
+    def create_backup(self, backup_type: str = "full", incremental: bool = False) -> str:
+        """Create a backup of specified type.
+
+        The tar stream is gzipped on all cores and uploaded part by part
+        while it is produced, to the local backup directory or to S3 (see
+        ``MultipartUploader``). If the previous backup of this kind was
+        interrupted, its upload is resumed. ``incremental`` stores only file
+        content that no earlier incremental backup holds, plus a manifest;
+        see ``IncrementalArchiver``. Completed backups are recorded in the
+        catalog. Returns the archive's location.
+        """
+        if incremental:
+            with self._lock:
+                return self._create_backup(backup_type, incremental)
+        return self._create_backup(backup_type, incremental)
+
+    def _create_backup(self, backup_type: str, incremental: bool) -> str:
+        kind = f"{backup_type}_incr" if incremental else backup_type
+        backup_name = self._interrupted_backup(kind)
+        if backup_name is None:
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            backup_name = f"{kind}_{timestamp}.tar.gz"
+
+        sources: List[Tuple[str, str]] = []
+        if backup_type in ["full", "projects"]:
+            sources.append(("/app/projects", "projects"))
+        if backup_type in ["full", "database"]:
+            self._backup_database()
+            sources.append(("/app/backups/db_dump.sql", "database/db_dump.sql"))
+        if backup_type in ["full", "configs"]:
+            sources.append(("/app/configs", "configs"))
+
+        sink = MultipartUploader(
+            self.storage,
+            backup_name,
+            self.config.upload_state_path,
+            part_size=self.config.upload_part_size,
+            concurrency=self.config.upload_concurrency,
+            max_bandwidth=self.config.upload_max_bandwidth
+        )
+        location = self.storage.location(backup_name)
+        started = time.monotonic()
         try:
-            with tarfile.open(backup_path, "w:gz") as tar:
-                # Backup projects
-                if backup_type in ["full", "projects"]:
-                    tar.add("/app/projects", arcname="projects")
-                
-                # Backup databases
-                if backup_type in ["full", "database"]:
-                    self._backup_database()
-                    tar.add("/app/backups/db_dump.sql", arcname="database/db_dump.sql")
-                
-                # Backup configurations
-                if backup_type in ["full", "configs"]:
-                    tar.add("/app/configs", arcname="configs")
-            
-            self.logger.info(f"Created backup: {backup_path}")
-            
-            # Upload to S3 if enabled
-            if self.config.s3_enabled:
-                self._upload_to_s3(backup_path, backup_name)
-            
-            return backup_path
-        
+            with ParallelGzipWriter(sink, level=self.config.compression_level,
+                                    workers=self.config.compression_workers) as gz:
+                with tarfile.open(fileobj=gz, mode="w|") as tar:
+                    if incremental:
+                        archiver = IncrementalArchiver(tar, BackupIndex(self.config.index_path), backup_name)
+                        for path, arcname in sources:
+                            archiver.add(path, arcname)
+                        manifest = archiver.finish()
+                    else:
+                        for path, arcname in sources:
+                            tar.add(path, arcname=arcname)
+            sink.close()
+            if incremental:
+                self.storage.put(f"{backup_name}.manifest.json", manifest)
         except Exception as e:
+            sink.abort()
             self.logger.error(f"Backup failed: {str(e)}")
             raise
 
+        if incremental:
+            # Only now are the new chunks safely stored for later backups to reference
+            archiver.commit()
+            self.logger.info(f"Incremental backup stats: {archiver.stats}")
+
+        chunk_refs: Dict[str, int] = defaultdict(int)
+        if incremental:
+            for archive, _ in archiver.chunk_sources.values():
+                chunk_refs[archive] += 1
+        self.catalog.record(
+            backup_name, kind, backup_type, incremental, sink.size, sink.sha256.hexdigest(),
+            location, self._project_names() if backup_type in ["full", "projects"] else [], chunk_refs
+        )
+        self.catalog.request_gc()
+
+        elapsed = max(time.monotonic() - started, 1e-6)
+        self.logger.info(
+            f"Created backup: {location} ({gz.bytes_in / 2**20:.1f} MiB in, {gz.bytes_out / 2**20:.1f} MiB out, "
+            f"{gz.bytes_in / 2**20 / elapsed:.1f} MiB/s)"
+        )
+        return location
+
+    @staticmethod
+    def _project_names() -> List[str]:
+        projects = Path("/app/projects")
+        if not projects.is_dir():
+            return []
+        return sorted(p.name for p in projects.iterdir() if p.is_dir())
+
+    def collect_garbage(self) -> List[str]:
+        """Expire backups past retention and delete the ones nothing references.
+
+        Runs periodically on the catalog's GC thread once ``start_gc`` has
+        been called. Incremental chunks are
+        stored inside the archive that first held them, so an expired
+        archive is kept as long as a live backup reads chunks from it.
+        Returns the names of the deleted backups.
+        """
+        expired = self.catalog.expire()
+        if expired:
+            self.logger.info(f"Expired {expired} backups past {self.config.retention_days} days retention")
+        with self._lock:
+            deleted = []
+            for name in self.catalog.reclaimable():
+                try:
+                    self.storage.delete(f"{name}.manifest.json")
+                    self.storage.delete(name)
+                except Exception as e:
+                    self.logger.error(f"Failed to delete backup {name}: {str(e)}")
+                    continue
+                self.catalog.remove(name)
+                deleted.append(name)
+
+            if deleted:
+                # Forget chunks stored in deleted archives; files that used them are re-chunked
+                index = BackupIndex(self.config.index_path)
+                gone = set(deleted)
+                stale = [digest for digest, (archive, _) in index.chunks.items() if archive in gone]
+                if stale:
+                    for digest in stale:
+                        del index.chunks[digest]
+                    index.save()
+                self.logger.info(f"Deleted {len(deleted)} expired backups: {', '.join(deleted)}")
+        return deleted
+
+    def _interrupted_backup(self, kind: str) -> Optional[str]:
+        """Name of an unfinished upload of this kind of backup, if any"""
+        for upload in MultipartUploader.pending_uploads(self.config.upload_state_path):
+            name = upload["key"]
+            if name.startswith(f"{kind}_") and name[len(kind) + 1:len(kind) + 2].isdigit():
+                self.logger.info(f"Resuming interrupted backup {name}")
+                return name
+        return None
+
     def _backup_database(self):
         """Create database dump"""
         dump_path = Path("/app/backups/db_dump.sql")
@@ -70,49 +195,219 @@ class BackupManager:
         env = {**os.environ, "PGPASSWORD": self.config.db_password}
         subprocess.run(cmd, env=env, check=True)
 
-    def _upload_to_s3(self, backup_path: Path, backup_name: str):
-        """Upload backup to S3"""
+    def restore_project(self, project: str, target_root: str = "/app") -> str:
+        """Restore one project from the newest backup that contains it; returns the backup's name"""
+        backup = self.catalog.latest_containing(project)
+        if backup is None:
+            raise FileNotFoundError(f"No backup contains project {project}")
+        self.restore_backup(backup["name"], projects=[project], target_root=target_root)
+        return backup["name"]
+
+    def restore_backup(self, backup_path: str, projects: Optional[List[str]] = None,
+                       paths: Optional[List[str]] = None, target_root: str = "/app"):
+        """Restore from a backup.
+
+        ``backup_path`` is a local archive or the name of a stored backup.
+        With ``projects`` and/or ``paths`` (archive paths such as
+        ``projects/api/src`` or ``configs``) only those are restored;
+        otherwise everything in the archive is. The archive is read in one
+        streaming pass (for incremental backups: the manifest, then only the
+        archives holding needed chunks) into a staging directory. Each
+        restored tree is then moved next to its target (copied if the target
+        is on another filesystem, such as a projects volume) and swapped in
+        with a rename; if any swap fails the ones already made are rolled
+        back, so a failed restore leaves the existing files untouched.
+        """
+        selection = None
+        if projects or paths:
+            selection = [f"projects/{name}" for name in projects or []] + [p.strip("/") for p in paths or []]
+
+        target_root = Path(target_root)
+        staging = target_root / f".restore-{uuid.uuid4().hex}"
+        staging.mkdir(parents=True)
+        extractor = ParallelExtractor(staging)
         try:
-            self.s3_client.upload_file(
-                str(backup_path),
-                self.config.s3_bucket,
-                f"backups/{backup_name}"
+            if "_incr_" in Path(backup_path).name:
+                restored = self._restore_incremental(backup_path, selection, extractor)
+            else:
+                restored = self._restore_archive(backup_path, selection, extractor)
+            extractor.close()
+
+            units = selection if selection is not None else sorted({name.split("/")[0] for name in restored})
+            dump_path = staging / "database" / "db_dump.sql"
+            if dump_path.exists() and any(unit.split("/")[0] == "database" for unit in units):
+                # Before any files are swapped, so a failed import changes nothing
+                self._restore_database(str(dump_path))
+
+            self._swap_in(staging, target_root, [unit for unit in units if unit.split("/")[0] != "database"])
+
+            self.logger.info(
+                f"Restored from backup: {backup_path} "
+                f"({extractor.files} files, {extractor.bytes_written / 2**20:.1f} MiB)"
             )
-            self.logger.info(f"Uploaded backup to S3: {backup_name}")
+
         except Exception as e:
-            self.logger.error(f"S3 upload failed: {str(e)}")
+            extractor.abort()
+            self.logger.error(f"Restore failed: {str(e)}")
             raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
 
-    def restore_backup(self, backup_path: str):
-        """Restore from a backup file"""
+    @staticmethod
+    def _selected(name: str, selection: Optional[List[str]]) -> bool:
+        return selection is None or any(name == s or name.startswith(s + "/") for s in selection)
+
+    def _open_backup(self, backup_path: str, name: Optional[str] = None) -> BinaryIO:
+        """Open ``name`` (default: the backup itself), preferring files beside a local archive"""
+        local = Path(backup_path)
+        if local.is_file():
+            sibling = local if name is None else local.parent / name
+            if sibling.is_file():
+                return open(sibling, "rb")
+        return self.storage.open_read(name or local.name)
+
+    def _restore_archive(self, backup_path: str, selection: Optional[List[str]],
+                         extractor: ParallelExtractor) -> Set[str]:
+        restored = set()
+        with self._open_backup(backup_path) as f, tarfile.open(fileobj=f, mode="r|gz") as tar:
+            for member in tar:
+                name = member.name
+                if not self._selected(name, selection):
+                    continue
+                if member.isdir():
+                    extractor.directory(name, member.mode, member.mtime)
+                elif member.issym():
+                    extractor.symlink(name, member.linkname)
+                elif member.islnk():
+                    if not self._selected(member.linkname, selection):
+                        self.logger.warning(f"Skipping {name}: hardlink target {member.linkname} not restored")
+                        continue
+                    extractor.hardlink(name, member.linkname)
+                elif member.isfile():
+                    path = extractor.create(name, member.size, member.mode, member.mtime)
+                    source = tar.extractfile(member)
+                    offset = 0
+                    while True:
+                        data = source.read(4 * 1024 * 1024)
+                        if not data:
+                            break
+                        extractor.write_at(path, offset, data)
+                        offset += len(data)
+                else:
+                    continue
+                restored.add(name)
+        return restored
+
+    def _load_manifest(self, backup_path: str) -> Dict:
+        name = Path(backup_path).name
         try:
-            with tarfile.open(backup_path, "r:gz") as tar:
-                # Restore projects
-                if any(name.startswith("projects/") for name in tar.getnames()):
-                    shutil.rmtree("/app/projects")
-                    tar.extractall("/app", members=[
-                        m for m in tar.getmembers() 
-                        if m.name.startswith("projects/")
-                    ])
-                
-                # Restore database
-                if any(name.startswith("database/") for name in tar.getnames()):
-                    tar.extract("database/db_dump.sql", "/app/backups")
-                    self._restore_database("/app/backups/db_dump.sql")
-                
-                # Restore configs
-                if any(name.startswith("configs/") for name in tar.getnames()):
-                    shutil.rmtree("/app/configs")
-                    tar.extractall("/app", members=[
-                        m for m in tar.getmembers() 
-                        if m.name.startswith("configs/")
-                    ])
-            
-            self.logger.info(f"Restored from backup: {backup_path}")
-        
-        except Exception as e:
-            self.logger.error(f"Restore failed: {str(e)}")
+            with self._open_backup(backup_path, f"{name}.manifest.json") as f:
+                return json.loads(f.read())
+        except FileNotFoundError:
+            pass
+        # No sidecar: the manifest is the archive's last member
+        with self._open_backup(backup_path) as f, tarfile.open(fileobj=f, mode="r|gz") as tar:
+            for member in tar:
+                if member.name == "manifest.json":
+                    return json.loads(tar.extractfile(member).read())
+        raise ValueError(f"{backup_path} has no manifest")
+
+    def _restore_incremental(self, backup_path: str, selection: Optional[List[str]],
+                             extractor: ParallelExtractor) -> Set[str]:
+        manifest = self._load_manifest(backup_path)
+        chunk_sources = manifest["chunk_sources"]
+        restored = set()
+        targets: Dict[str, List[Tuple[Path, int]]] = defaultdict(list)
+        for entry in manifest["entries"]:
+            name = entry["path"]
+            if not self._selected(name, selection):
+                continue
+            if entry["type"] == "dir":
+                extractor.directory(name, entry["mode"], entry["mtime"])
+            elif entry["type"] == "symlink":
+                extractor.symlink(name, entry["target"])
+            else:
+                path = extractor.create(name, entry["size"], entry["mode"], entry["mtime"])
+                offset = 0
+                for digest in entry["chunks"]:
+                    targets[digest].append((path, offset))
+                    offset += chunk_sources[digest][1]
+            restored.add(name)
+
+        by_archive: Dict[str, Set[str]] = defaultdict(set)
+        for digest in targets:
+            by_archive[chunk_sources[digest][0]].add(digest)
+
+        for archive, needed in sorted(by_archive.items()):
+            with self._open_backup(backup_path, archive) as f, tarfile.open(fileobj=f, mode="r|gz") as tar:
+                for member in tar:
+                    digest = member.name[len("chunks/"):]
+                    if not member.name.startswith("chunks/") or digest not in needed:
+                        continue
+                    data = tar.extractfile(member).read()
+                    if hashlib.sha256(data).hexdigest() != digest:
+                        raise ValueError(f"Chunk {digest} in {archive} is corrupt")
+                    for path, offset in targets[digest]:
+                        extractor.write_at(path, offset, data)
+                    needed.discard(digest)
+                    if not needed:
+                        break
+            if needed:
+                raise ValueError(f"{len(needed)} chunks missing from {archive}")
+        return restored
+
+    def _swap_in(self, staging: Path, target_root: Path, units: List[str]):
+        """Replace each unit under ``target_root`` with its staged tree, all or nothing.
+
+        Staged trees are first moved beside their targets, so every swap is
+        a rename within one directory; the replaced trees are kept there
+        until all swaps have succeeded.
+        """
+        token = uuid.uuid4().hex[:12]
+        placed: List[Tuple[Path, Path, Path]] = []  # (placed tree, target, where the old tree goes)
+        swapped: List[Tuple[Path, Path, bool]] = []  # (target, old tree, whether there was one)
+        keep: Set[Path] = set()  # Old trees that could not be put back
+        try:
+            for unit in units:
+                staged = staging / unit
+                target = target_root / unit
+                if not staged.exists() and not staged.is_symlink():
+                    self.logger.warning(f"Nothing to restore for {target}")
+                    continue
+                target.parent.mkdir(parents=True, exist_ok=True)
+                beside = target.parent / f".restore-{token}-{target.name}"
+                placed.append((beside, target, target.parent / f".replaced-{token}-{target.name}"))
+                shutil.move(str(staged), str(beside))
+
+            for beside, target, replaced in placed:
+                existed = target.exists() or target.is_symlink()
+                if existed:
+                    os.rename(target, replaced)
+                # Recorded before the rename so a failure puts the old tree back too
+                swapped.append((target, replaced, existed))
+                os.rename(beside, target)
+        except Exception:
+            for target, replaced, existed in reversed(swapped):
+                try:
+                    self._remove_tree(target)
+                    if existed:
+                        os.rename(replaced, target)
+                except OSError as e:
+                    keep.add(replaced)
+                    self.logger.error(f"Failed to roll back {target}, previous contents are in {replaced}: {str(e)}")
             raise
+        finally:
+            for beside, _, replaced in placed:
+                self._remove_tree(beside)
+                if replaced not in keep:
+                    self._remove_tree(replaced)
+
+    @staticmethod
+    def _remove_tree(path: Path):
+        if path.is_symlink() or path.is_file():
+            path.unlink()
+        elif path.exists():
+            shutil.rmtree(path, ignore_errors=True)
 
     def _restore_database(self, dump_path: str):
         """Restore database from dump"""
@@ -0,0 +1,377 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional
+
+class StorageBackend(ABC):
+    """Where backup archives are stored, as multipart uploads.
+
+    Parts are numbered from 1; ``offset`` is the part's byte position in the
+    final object, for backends that write in place.
+    """
+
+    @abstractmethod
+    def location(self, key: str) -> str:
+        ...
+
+    @abstractmethod
+    def create_multipart(self, key: str) -> str:
+        ...
+
+    @abstractmethod
+    def upload_part(self, key: str, upload_id: str, part_number: int, offset: int, data: bytes) -> str:
+        ...
+
+    @abstractmethod
+    def list_parts(self, key: str, upload_id: str) -> Optional[Dict[int, str]]:
+        """Parts already stored for ``upload_id``; None if the upload no longer exists"""
+
+    @abstractmethod
+    def complete_multipart(self, key: str, upload_id: str, parts: Dict[int, str]):
+        ...
+
+    @abstractmethod
+    def abort_multipart(self, key: str, upload_id: str):
+        ...
+
+    @abstractmethod
+    def open_read(self, key: str) -> BinaryIO:
+        """Stream an object's content; raises FileNotFoundError if it does not exist"""
+
+    @abstractmethod
+    def put(self, key: str, data: bytes):
+        ...
+
+    @abstractmethod
+    def delete(self, key: str):
+        """Delete an object; deleting a missing object is not an error"""
+
+class S3Backend(StorageBackend):
+    def __init__(self, client, bucket: str, prefix: str = "backups/"):
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{self.prefix}{key}"
+
+    def create_multipart(self, key: str) -> str:
+        response = self.client.create_multipart_upload(Bucket=self.bucket, Key=self.prefix + key)
+        return response["UploadId"]
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, offset: int, data: bytes) -> str:
+        response = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=self.prefix + key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data
+        )
+        return response["ETag"]
+
+    def list_parts(self, key: str, upload_id: str) -> Optional[Dict[int, str]]:
+        parts = {}
+        kwargs = {"Bucket": self.bucket, "Key": self.prefix + key, "UploadId": upload_id}
+        while True:
+            try:
+                response = self.client.list_parts(**kwargs)
+            except self.client.exceptions.NoSuchUpload:
+                return None
+            for part in response.get("Parts", []):
+                parts[part["PartNumber"]] = part["ETag"]
+            if not response.get("IsTruncated"):
+                return parts
+            kwargs["PartNumberMarker"] = response["NextPartNumberMarker"]
+
+    def complete_multipart(self, key: str, upload_id: str, parts: Dict[int, str]):
+        self.client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.prefix + key,
+            UploadId=upload_id,
+            MultipartUpload={"Parts": [{"PartNumber": n, "ETag": parts[n]} for n in sorted(parts)]}
+        )
+
+    def abort_multipart(self, key: str, upload_id: str):
+        self.client.abort_multipart_upload(Bucket=self.bucket, Key=self.prefix + key, UploadId=upload_id)
+
+    def open_read(self, key: str) -> BinaryIO:
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.prefix + key)["Body"]
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(self.location(key))
+
+    def put(self, key: str, data: bytes):
+        self.client.put_object(Bucket=self.bucket, Key=self.prefix + key, Body=data)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+class LocalBackend(StorageBackend):
+    """Stores archives in a local directory (also the offline stand-in for S3).
+
+    An upload is a sparse ``.{key}.{upload_id}.partial`` file that parts are
+    written into at their offsets, with a sidecar recording finished parts;
+    completing it is a rename.
+    """
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def location(self, key: str) -> str:
+        return str(self.root / key)
+
+    def _partial(self, key: str, upload_id: str) -> Path:
+        return self.root / f".{key}.{upload_id}.partial"
+
+    def create_multipart(self, key: str) -> str:
+        upload_id = uuid.uuid4().hex
+        self._partial(key, upload_id).touch()
+        return upload_id
+
+    def upload_part(self, key: str, upload_id: str, part_number: int, offset: int, data: bytes) -> str:
+        partial = self._partial(key, upload_id)
+        fd = os.open(partial, os.O_WRONLY)
+        try:
+            os.pwrite(fd, data, offset)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        etag = hashlib.md5(data).hexdigest()
+        with self._lock, open(partial.with_suffix(".parts"), "a") as f:
+            f.write(f"{part_number} {etag} {offset + len(data)}\n")
+        return etag
+
+    def list_parts(self, key: str, upload_id: str) -> Optional[Dict[int, str]]:
+        partial = self._partial(key, upload_id)
+        if not partial.exists():
+            return None
+        parts = {}
+        try:
+            for line in partial.with_suffix(".parts").read_text().splitlines():
+                number, etag, _ = line.split()
+                parts[int(number)] = etag
+        except FileNotFoundError:
+            pass
+        return parts
+
+    def complete_multipart(self, key: str, upload_id: str, parts: Dict[int, str]):
+        partial = self._partial(key, upload_id)
+        ends = {}
+        for line in partial.with_suffix(".parts").read_text().splitlines():
+            number, etag, end = line.split()
+            if parts.get(int(number)) == etag:
+                ends[int(number)] = int(end)
+        # A resumed upload may have ended shorter than the interrupted attempt
+        os.truncate(partial, ends[max(parts)])
+        os.replace(partial, self.root / key)
+        partial.with_suffix(".parts").unlink()
+
+    def abort_multipart(self, key: str, upload_id: str):
+        partial = self._partial(key, upload_id)
+        for path in (partial, partial.with_suffix(".parts")):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    def open_read(self, key: str) -> BinaryIO:
+        return open(self.root / key, "rb")
+
+    def put(self, key: str, data: bytes):
+        path = self.root / key
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, key: str):
+        try:
+            (self.root / key).unlink()
+        except FileNotFoundError:
+            pass
+
+class BandwidthLimiter:
+    """Token bucket shared by upload threads; ``rate`` is bytes per second"""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst or rate
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, amount: int):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+
+class MultipartUploader:
+    """File-like writer that uploads to a ``StorageBackend`` while data is produced.
+
+    Every ``part_size`` bytes written become one part, uploaded on a pool of
+    ``concurrency`` threads (at most ``2 * concurrency`` parts are buffered,
+    so a slow network slows the producer rather than growing memory). Parts
+    are retried ``retries`` times, and ``max_bandwidth`` (bytes/s) caps the
+    combined upload rate.
+
+    Progress is persisted to ``{state_dir}/{key}.json``: the upload id and
+    each finished part's SHA-256. If a run is interrupted, running it again
+    with the same key (re-producing the same bytes) resumes the upload: a
+    part whose digest matches a finished part is not sent again.
+    """
+
+    def __init__(self, backend: StorageBackend, key: str, state_dir: str,
+                 part_size: int = 16 * 1024 * 1024, concurrency: int = 4,
+                 max_bandwidth: Optional[float] = None, retries: int = 3):
+        self.backend = backend
+        self.key = key
+        self.part_size = part_size
+        self.concurrency = concurrency
+        self.retries = retries
+        self.limiter = BandwidthLimiter(max_bandwidth) if max_bandwidth else None
+        self.logger = logging.getLogger(__name__)
+        self.bytes_uploaded = 0
+        self.parts_skipped = 0
+        self.size = 0
+        self.sha256 = hashlib.sha256()  # Of the whole object, skipped parts included
+
+        self.state_path = Path(state_dir) / f"{re.sub(r'[^A-Za-z0-9._-]', '_', key)}.json"
+        self.state_path.parent.mkdir(parents=True, exist_ok=True)
+        self._state_lock = threading.Lock()
+        self._state = self._load_state()
+        self._buffer = bytearray()
+        self._next_part = 1
+        self._pending = deque()
+        self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="upload")
+        self._closed = False
+
+    @property
+    def upload_id(self) -> str:
+        return self._state["upload_id"]
+
+    def _load_state(self) -> Dict:
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+            if state["part_size"] == self.part_size:
+                stored = self.backend.list_parts(self.key, state["upload_id"])
+                if stored is not None:
+                    # Trust only parts the backend confirms
+                    state["parts"] = {
+                        number: part for number, part in state["parts"].items()
+                        if stored.get(int(number)) == part["etag"]
+                    }
+                    self.logger.info(f"Resuming upload of {self.key} ({len(state['parts'])} parts stored)")
+                    return state
+        except (FileNotFoundError, ValueError, KeyError):
+            pass
+        state = {"key": self.key, "upload_id": self.backend.create_multipart(self.key),
+                 "part_size": self.part_size, "parts": {}}
+        self._save_state(state)
+        return state
+
+    def _save_state(self, state: Dict):
+        tmp_path = self.state_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.state_path)
+
+    def write(self, data) -> int:
+        self.sha256.update(data)
+        self.size += len(data)
+        self._buffer += data
+        while len(self._buffer) >= self.part_size:
+            self._submit(bytes(self._buffer[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def _submit(self, data: bytes):
+        part_number = self._next_part
+        self._next_part += 1
+        self._pending.append(self._pool.submit(self._upload_part, part_number, data))
+        while len(self._pending) > 2 * self.concurrency:
+            self._pending.popleft().result()
+
+    def _upload_part(self, part_number: int, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()
+        stored = self._state["parts"].get(str(part_number))
+        if stored and stored["sha256"] == digest and stored["size"] == len(data):
+            self.parts_skipped += 1
+            return
+
+        for attempt in range(self.retries + 1):
+            try:
+                if self.limiter:
+                    self.limiter.consume(len(data))
+                etag = self.backend.upload_part(
+                    self.key, self.upload_id, part_number, (part_number - 1) * self.part_size, data
+                )
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                self.logger.warning(f"Upload of part {part_number} of {self.key} failed, retrying: {str(e)}")
+                time.sleep(2 ** attempt)
+
+        with self._state_lock:
+            self._state["parts"][str(part_number)] = {"etag": etag, "sha256": digest, "size": len(data)}
+            self.bytes_uploaded += len(data)
+            self._save_state(self._state)
+
+    def close(self):
+        """Upload the last part, wait for all parts and complete the upload"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._buffer or self._next_part == 1:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self._pool.shutdown(wait=True)
+
+        parts = {n: self._state["parts"][str(n)]["etag"] for n in range(1, self._next_part)}
+        self.backend.complete_multipart(self.key, self.upload_id, parts)
+        self.state_path.unlink()
+        self.logger.info(
+            f"Uploaded {self.backend.location(self.key)}: {self.bytes_uploaded} bytes sent, "
+            f"{self.parts_skipped} parts already stored"
+        )
+
+    def abort(self, keep_state: bool = True):
+        """Stop uploading; with ``keep_state`` the parts stay so a rerun can resume"""
+        self._closed = True
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        if not keep_state:
+            self.backend.abort_multipart(self.key, self.upload_id)
+            self.state_path.unlink(missing_ok=True)
+
+    @staticmethod
+    def pending_uploads(state_dir: str) -> List[Dict]:
+        """Interrupted uploads recorded under ``state_dir``"""
+        uploads = []
+        for path in sorted(Path(state_dir).glob("*.json")):
+            try:
+                with open(path) as f:
+                    uploads.append(json.load(f))
+            except ValueError:
+                continue
+        return uploads
@@ -0,0 +1,24 @@
+"""Make the API source importable from the benchmark scripts.
+
+In a checkout the source tree may be ``api /src``, with package
+directories such as ``services `` carrying a trailing space; directories
+are matched by their stripped names and such packages are registered
+under their import names.
+"""
+import sys
+import types
+from pathlib import Path
+
+def add_api_source() -> Path:
+    """Put the API source directory on ``sys.path``; returns it"""
+    repo = Path(__file__).resolve().parents[2]
+    api = next(p for p in repo.iterdir() if p.is_dir() and p.name.strip() == "api")
+    src = api / "src"
+    sys.path.insert(0, str(src))
+    for path in src.iterdir():
+        name = path.name.strip()
+        if path.is_dir() and name != path.name and name not in sys.modules:
+            package = types.ModuleType(name)
+            package.__path__ = [str(path)]
+            sys.modules[name] = package
+    return src
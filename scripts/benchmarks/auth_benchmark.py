@@ -0,0 +1,85 @@
+"""Benchmark authentication overhead: token verification and bcrypt logins.
+
+Usage: python scripts/benchmarks/auth_benchmark.py [--requests N] [--logins N]
+
+Compares a full ``jwt.decode`` per request with ``decode_token`` answering
+repeat tokens from the verified-token cache, then runs a burst of logins
+with bcrypt on the event loop and on the bcrypt pool, measuring how long
+other requests (a 1 ms heartbeat task) were stalled.
+"""
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+
+from api_source import add_api_source
+
+add_api_source()
+
+from jose import jwt
+
+from utils.security import (
+    ALGORITHM, SECRET_KEY, create_access_token, decode_token, get_password_hash, token_cache,
+    verify_password, verify_password_async
+)
+
+def _report(label: str, count: int, elapsed: float):
+    print(f"{label:<40} {elapsed / count * 1e6:>9.1f} us/op  {count / elapsed:>10.0f} ops/s")
+
+def bench_tokens(requests: int, users: int = 100):
+    tokens = [create_access_token({"sub": f"user{i}"}, timedelta(minutes=30)) for i in range(users)]
+
+    start = time.perf_counter()
+    for i in range(requests):
+        jwt.decode(tokens[i % users], SECRET_KEY, algorithms=[ALGORITHM])
+    _report("jwt.decode per request", requests, time.perf_counter() - start)
+
+    token_cache.clear()
+    start = time.perf_counter()
+    for i in range(requests):
+        decode_token(tokens[i % users])
+    _report(f"decode_token ({users} distinct tokens)", requests, time.perf_counter() - start)
+    print(f"  cache hits={token_cache.hits} misses={token_cache.misses}")
+
+async def _heartbeat(stop: asyncio.Event) -> float:
+    """Largest delay, in seconds, of a task that wants to run every millisecond"""
+    worst = 0.0
+    while not stop.is_set():
+        before = time.perf_counter()
+        await asyncio.sleep(0.001)
+        worst = max(worst, time.perf_counter() - before - 0.001)
+    return worst
+
+async def _login_burst(logins: int, hashed: str, off_loop: bool):
+    async def login():
+        if off_loop:
+            return await verify_password_async("secret", hashed)
+        return verify_password("secret", hashed)
+
+    stop = asyncio.Event()
+    heartbeat = asyncio.ensure_future(_heartbeat(stop))
+    await asyncio.sleep(0.01)
+    start = time.perf_counter()
+    await asyncio.gather(*(login() for _ in range(logins)))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    worst = await heartbeat
+    label = "bcrypt pool" if off_loop else "bcrypt on event loop"
+    print(f"{label:<40} {logins} logins in {elapsed:.2f}s, worst event loop stall {worst * 1000:.1f} ms")
+
+def bench_logins(logins: int):
+    hashed = get_password_hash("secret")
+    for off_loop in (False, True):
+        asyncio.run(_login_burst(logins, hashed, off_loop))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--logins", type=int, default=8)
+    args = parser.parse_args()
+
+    bench_tokens(args.requests)
+    bench_logins(args.logins)
+
+if __name__ == "__main__":
+    main()
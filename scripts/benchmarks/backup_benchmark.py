@@ -0,0 +1,120 @@
+"""Benchmark backup archive throughput against a generated local directory tree.
+
+Usage: python scripts/benchmarks/backup_benchmark.py [--files N] [--file-kib N] [--change-pct P] [--workers N]
+
+Compares single-threaded ``tarfile`` gzip with ``ParallelGzipWriter``, then
+runs two incremental backups, changing ``--change-pct`` percent of the files
+in between, and times the chunker alone on one large file. Archives go
+to a counting sink, so disk write speed is excluded.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import tarfile
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+
+from scripts import backup_engine
+from scripts.backup_engine import BackupIndex, Chunker, IncrementalArchiver, ParallelGzipWriter
+
+WORDS = [
+    "import", "def", "return", "class", "self", "async", "await", "const", "function",
+    "project", "environment", "dependency", "process", "config", "value", "result", "for", "in"
+]
+
+class _CountingSink:
+    def __init__(self):
+        self.bytes = 0
+
+    def write(self, data) -> int:
+        self.bytes += len(data)
+        return len(data)
+
+def _make_tree(root: Path, files: int, file_kib: int, seed: int = 1) -> int:
+    rng = random.Random(seed)
+    total = 0
+    for i in range(files):
+        path = root / f"project{i % 20}" / f"dir{i % 7}" / f"file{i}.txt"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        size = rng.randint(file_kib * 512, file_kib * 1536)
+        if i % 10 == 0:
+            data = os.urandom(size)  # Binary assets
+        else:
+            text = " ".join(rng.choice(WORDS) for _ in range(size // 6))
+            data = text.encode()[:size]
+        path.write_bytes(data)
+        total += len(data)
+    return total
+
+def _report(label: str, size: int, elapsed: float, extra: str = ""):
+    print(f"{label:<36} {size / 2**20 / elapsed:>9.1f} MiB/s  {elapsed:>7.2f}s  {extra}")
+
+def bench_tarfile(root: Path, size: int):
+    sink = _CountingSink()
+    start = time.perf_counter()
+    with tarfile.open(fileobj=sink, mode="w:gz") as tar:
+        tar.add(str(root), arcname="projects")
+    _report("tarfile w:gz (1 thread)", size, time.perf_counter() - start, f"out={sink.bytes / 2**20:.1f} MiB")
+
+def bench_parallel(root: Path, size: int, workers: int):
+    sink = _CountingSink()
+    start = time.perf_counter()
+    with ParallelGzipWriter(sink, workers=workers) as gz:
+        with tarfile.open(fileobj=gz, mode="w|") as tar:
+            tar.add(str(root), arcname="projects")
+    _report(f"ParallelGzipWriter ({workers} workers)", size, time.perf_counter() - start,
+            f"out={sink.bytes / 2**20:.1f} MiB")
+
+def bench_incremental(root: Path, size: int, workers: int, change_pct: float, index_dir: Path):
+    index = BackupIndex(index_dir)
+    for run in (1, 2):
+        if run == 2:
+            files = sorted(p for p in root.rglob("*") if p.is_file())
+            for path in random.Random(2).sample(files, int(len(files) * change_pct / 100)):
+                with open(path, "ab") as f:
+                    f.write(b"\n# changed\n")
+        sink = _CountingSink()
+        start = time.perf_counter()
+        with ParallelGzipWriter(sink, workers=workers) as gz:
+            with tarfile.open(fileobj=gz, mode="w|") as tar:
+                archiver = IncrementalArchiver(tar, index, f"incr{run}")
+                archiver.add(str(root), "projects")
+                archiver.finish()
+        archiver.commit()
+        stats = archiver.stats
+        _report(f"incremental run {run}", size, time.perf_counter() - start,
+                f"out={sink.bytes / 2**20:.1f} MiB unchanged={stats['files_unchanged']}/{stats['files']} "
+                f"new_chunks={stats['chunks_new']}")
+
+def bench_chunker(size: int = 32 * 2**20):
+    data = os.urandom(size)
+    start = time.perf_counter()
+    count = sum(1 for _ in Chunker().chunks(io.BytesIO(data)))
+    mode = "numpy" if backup_engine.np is not None else "pure Python"
+    _report(f"Chunker (random data, {mode})", size, time.perf_counter() - start, f"chunks={count}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--files", type=int, default=2000)
+    parser.add_argument("--file-kib", type=int, default=64)
+    parser.add_argument("--change-pct", type=float, default=5.0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp) / "projects"
+        size = _make_tree(root, args.files, args.file_kib)
+        print(f"tree: {args.files} files, {size / 2**20:.1f} MiB")
+        bench_tarfile(root, size)
+        for workers in sorted({1, args.workers}):
+            bench_parallel(root, size, workers)
+        bench_incremental(root, size, args.workers, args.change_pct, Path(tmp) / "index")
+        bench_chunker()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark the per-request cost of MetricsMiddleware.
+
+Usage: python scripts/benchmarks/instrumentation_benchmark.py [--requests N]
+
+Drives a small FastAPI app directly through its ASGI interface (no server
+or HTTP client in the loop) without middleware, with ``MetricsMiddleware``,
+and with an equivalent ``BaseHTTPMiddleware`` for comparison, and reports
+the added time per request.
+"""
+import argparse
+import asyncio
+import time
+
+from api_source import add_api_source
+
+add_api_source()
+
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from utils.instrumentation import MetricsMiddleware
+from utils.monitoring import API_LATENCY, API_REQUESTS
+
+class _BaseHTTPMetrics(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        started = time.perf_counter()
+        response = await call_next(request)
+        route = request.scope.get("route")
+        endpoint = getattr(route, "path", "unmatched")
+        API_LATENCY.labels(endpoint=endpoint, method=request.method).observe(time.perf_counter() - started)
+        API_REQUESTS.labels(endpoint=endpoint, method=request.method, status=str(response.status_code)).inc()
+        return response
+
+def _make_app(middleware=None) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/projects/{project_name}")
+    async def project(project_name: str):
+        return {"name": project_name}
+
+    @app.get("/stream")
+    async def stream():
+        async def chunks():
+            for _ in range(4):
+                yield b"x" * 1024
+        return StreamingResponse(chunks())
+
+    if middleware is not None:
+        app.add_middleware(middleware)
+    return app
+
+async def _drive(app, path: str, requests: int) -> float:
+    async def receive():
+        if not received.is_set():
+            received.set()
+            return {"type": "http.request", "body": b"", "more_body": False}
+        await disconnected.wait()  # Responses listening for a disconnect wait until cancelled
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    disconnected = asyncio.Event()
+    start = time.perf_counter()
+    for i in range(requests):
+        received = asyncio.Event()
+        scope = {
+            "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+            "scheme": "http", "path": path.format(i=i % 100), "raw_path": b"", "root_path": "",
+            "query_string": b"", "headers": [], "client": ("127.0.0.1", 1234), "server": ("test", 80)
+        }
+        await app(scope, receive, send)
+    return time.perf_counter() - start
+
+async def bench(requests: int):
+    variants = [("no middleware", None), ("MetricsMiddleware", MetricsMiddleware),
+                ("BaseHTTPMiddleware equivalent", _BaseHTTPMetrics)]
+    for path in ("/projects/p{i}", "/stream"):
+        print(f"GET {path}")
+        baseline = None
+        for label, middleware in variants:
+            app = _make_app(middleware)
+            await _drive(app, path, 200)  # Warm up
+            elapsed = await _drive(app, path, requests)
+            per_request = elapsed / requests * 1e6
+            if baseline is None:
+                baseline = per_request
+                print(f"  {label:<32} {per_request:>8.1f} us/request")
+            else:
+                print(f"  {label:<32} {per_request:>8.1f} us/request  (+{per_request - baseline:.1f} us)")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    args = parser.parse_args()
+    asyncio.run(bench(args.requests))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""Benchmark TaskQueue enqueue/dequeue throughput against fakeredis.
+
+Usage: python scripts/benchmarks/task_queue_benchmark.py [--tasks N] [--batch N] [--rtt-ms MS]
+
+fakeredis runs in-process, so by default the numbers measure client-side
+serialization only. ``--rtt-ms`` adds a simulated network round trip to
+every request sent to the server, which is where batching pays off.
+"""
+import argparse
+import time
+
+import fakeredis
+import redis
+
+from api_source import add_api_source
+
+add_api_source()
+
+from services.task_queue import TaskQueue
+
+class _DelayedConnection(fakeredis.FakeConnection):
+    """fakeredis connection that sleeps for one round trip per request"""
+    rtt = 0.0
+
+    def send_packed_command(self, *args, **kwargs):
+        time.sleep(self.rtt)
+        return super().send_packed_command(*args, **kwargs)
+
+def _redis(rtt: float):
+    _DelayedConnection.rtt = rtt
+    pool = redis.ConnectionPool(connection_class=_DelayedConnection, server=fakeredis.FakeServer())
+    return redis.Redis(connection_pool=pool)
+
+def _report(label: str, count: int, elapsed: float):
+    print(f"{label:<32} {count / elapsed:>12,.0f} tasks/sec")
+
+def bench_enqueue(tasks: int, batch: int, backend: str, rtt: float):
+    queue = TaskQueue(_redis(rtt), backend=backend)
+    start = time.perf_counter()
+    for i in range(tasks):
+        queue.enqueue("build", {"project": f"p{i}"})
+    _report(f"{backend}: enqueue", tasks, time.perf_counter() - start)
+
+    queue = TaskQueue(_redis(rtt), backend=backend)
+    queue.backend.register("build")
+    start = time.perf_counter()
+    for offset in range(0, tasks, batch):
+        queue.enqueue_many(("build", {"project": f"p{i}"})
+                           for i in range(offset, min(offset + batch, tasks)))
+    _report(f"{backend}: enqueue_many({batch})", tasks, time.perf_counter() - start)
+    return queue
+
+def bench_dequeue(queue: TaskQueue, tasks: int, batch: int, backend: str):
+    start = time.perf_counter()
+    dequeued = 0
+    while dequeued < tasks:
+        messages = queue.backend.take("build", batch)
+        if not messages:
+            break
+        pipe = queue.redis.pipeline()
+        queue.backend.ack(pipe, "build", [message_id for message_id, _ in messages if message_id])
+        pipe.execute()
+        dequeued += len(messages)
+    _report(f"{backend}: dequeue batch({batch})", dequeued, time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--tasks", type=int, default=20000)
+    parser.add_argument("--batch", type=int, default=100)
+    parser.add_argument("--rtt-ms", type=float, default=0.0)
+    args = parser.parse_args()
+
+    for backend in ("list", "stream"):
+        queue = bench_enqueue(args.tasks, args.batch, backend, args.rtt_ms / 1000)
+        bench_dequeue(queue, args.tasks, args.batch, backend)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+#!/bin/bash
+
+# Starts nginx and the API server (the container's entrypoint)
+#
+# Process limits need the API to own its cgroup (see CgroupManager), but the
+# container starts with this shell in its root cgroup and nginx would join it.
+# With a writable cgroup v2 root, everything already running is moved into an
+# "init" leaf, nginx starts there, and uvicorn runs alone in an "api" leaf.
+# Otherwise the API still starts, with process limits disabled.
+
+CGROUP_ROOT="/sys/fs/cgroup"
+
+function isolate_cgroups() {
+    [ -f "$CGROUP_ROOT/cgroup.controllers" ] && [ -w "$CGROUP_ROOT/cgroup.procs" ] || return 1
+    mkdir -p "$CGROUP_ROOT/init" "$CGROUP_ROOT/api" || return 1
+    for pid in $(cat "$CGROUP_ROOT/cgroup.procs"); do
+        echo "$pid" > "$CGROUP_ROOT/init/cgroup.procs" 2>/dev/null
+    done
+    # Only possible once the root cgroup holds no processes
+    echo "+cpu +memory +pids" > "$CGROUP_ROOT/cgroup.subtree_control"
+}
+
+if ! isolate_cgroups; then
+    echo "Cannot isolate the API in its own cgroup; process limits will be disabled"
+fi
+
+if [ -n "$PROMETHEUS_MULTIPROC_DIR" ]; then
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+    mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+fi
+
+nginx || exit 1
+
+if [ -d "$CGROUP_ROOT/api" ]; then
+    echo $$ > "$CGROUP_ROOT/api/cgroup.procs"
+fi
+exec uvicorn main:app --host 0.0.0.0 --port 8000